@@ -4,11 +4,13 @@
 # created: Alexander Kabza, Mar 1, 2016
 # last mod: Thomas Ludwig, 2019-05-22 onto EMH ED300L
 # For documentation and further information see http://www.kabza.de/MyHome/SmartMeter.html
-import binascii
 import flask
 import json
+import logging
+import logs
 import sys
 import serial
+import sml
 import threading
 import time
 
@@ -28,69 +30,38 @@ port = serial.Serial(
     baudrate=9600,
     parity=serial.PARITY_NONE,
     stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS
+    bytesize=serial.EIGHTBITS,
+    timeout=1
 )
 
 # port.open();
 
-start = '1b1b1b1b01010101'
-end = '1b1b1b1b1a'
-
-data = ''
-
-while True:
-    char_bin = port.read()
-    char = binascii.hexlify(char_bin)
-    # data = data + char.encode('HEX')
-    # char = codecs.encode(char_bin, "Hex")
-    data = data + char.decode('ascii')
-    # data = data + char
-    pos = data.find(start)
-    if (pos != -1):
-        data = data[pos:len(data)]
-    pos = data.find(end)
-    if (pos != -1):
-        # print(data + '\n')
-        timestamp = (time.strftime("%Y-%m-%d ") + time.strftime("%H:%M:%S"))
-        result = timestamp
-
-        search = '0100010801ff'
-        """ search key counter value 1 """
-        pos1 = data.find(search)
-        if (pos1 != -1):
-            pos1 = pos1 + len(search) + 14
-            value1 = data[pos1:pos1 + 10]
-            energy1 = int(value1, 16) / 1e4
-            print(timestamp + ' kWh: ' + search + ' = ' + value1 + ' = ' + str(energy1) + ' kWh')
-            result = result + ';' + str(energy1)
-
-        search = '0100010802ff'
-        """ search key counter value 2 """
-        pos2 = data.find(search)
-        if (pos2 != -1):
-            pos2 = pos2 + len(search) + 14
-            value2 = data[pos2:pos2 + 10]
-            energy2 = int(value2, 16) / 1e4
-            print(timestamp + ' kWh: ' + search + ' = ' + value2 + ' = ' + str(energy2) + ' kWh')
-            result = result + ';' + str(energy2)
-
-        search = '0100100700ff'
-        """ search key topical consume """
-        pos3 = data.find(search)
-        if (pos3 != -1):
-            pos3 = pos3 + len(search) + 14
-            value3 = data[pos3:pos3 + 8]
-            power = int(value3, 16) / 1e1
-            print('W: ' + search + ' = ' + value3 + ' = ' + str(power) + ' W')
-            result = result + ';' + str(power)
-
-        writexml(timestamp, energy1, energy2, power)
-
-        with open('output.csv', 'a') as logfile:
-            logfile.write(result + '\n')
-
-#        file = open('message.dat', 'w')
-#        file.write (data)
-#        file.close()
-
-        data = ''
\ No newline at end of file
+logs.setup()
+log = logging.getLogger("MyHomePower3")
+
+for frame in sml.read_frames(port):
+    try:
+        values = sml.reading(sml.decode_frame(frame))
+    except sml.SmlError as e:
+        log.warning('SML frame dropped: %s', e)
+        continue
+    timestamp = (time.strftime("%Y-%m-%d ") + time.strftime("%H:%M:%S"))
+    result = timestamp
+
+    energy1 = values["energyNT"]
+    energy2 = values["energyHT"]
+    power = values["power"]
+    if energy1 is not None:
+        log.debug('%s kWh: %s = %s kWh', timestamp, sml.OBIS_ENERGY1, energy1)
+        result = result + ';' + str(energy1)
+    if energy2 is not None:
+        log.debug('%s kWh: %s = %s kWh', timestamp, sml.OBIS_ENERGY2, energy2)
+        result = result + ';' + str(energy2)
+    if power is not None:
+        log.debug('W: %s = %s W', sml.OBIS_POWER, power)
+        result = result + ';' + str(power)
+
+    writexml(timestamp, energy1, energy2, power)
+
+    with open('output.csv', 'a') as logfile:
+        logfile.write(result + '\n')
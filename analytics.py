@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+# Consumption analytics over the minute rollup. The minute rows of any number
+# of days are laid out as one (days x 1440) numpy array by local clock minute,
+# load profile, base load and peak windows are computed for all days at once.
+# Nothing here touches the db; smartserver stores the report of every closed
+# day in the day_report table, so history is computed only once.
+import datetime
+
+import numpy as np
+
+from timeutil import local_offsets
+
+PROFILE_MINUTES = 15        # minutes per slot of the daily load profile
+NIGHT = (0, 5)              # local hours searched for the base load
+BASE_WINDOW = 60            # minutes the base load has to be held
+PEAK_WINDOW = 15            # minutes of a peak window
+PEAKS = 3                   # peak windows per day, they do not overlap
+MIN_COVERAGE = 0.8          # share of minutes with data a window needs
+_EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+
+def local_midnight(day) -> int:
+    """ epoch of the local midnight starting day (days since 1970-01-01 in local time) """
+    date = datetime.date.fromordinal(day + _EPOCH_DAY)
+    return int(datetime.datetime.combine(date, datetime.time()).timestamp())
+
+
+def minute_grid(ts, power) -> tuple:
+    """
+    :param ts: numpy array of minute bucket starts (epoch)
+    :param power: W of every minute, nan where unknown
+    :return: (local day numbers, days x 1440 W with nan gaps, days x 1440 epoch of every minute or 0)
+
+    The day of a clock change has a gap (spring) or the mean of both passes (autumn) at 2-3 am.
+    """
+    local = ts + local_offsets(ts)
+    days, row = np.unique(local // 86400, return_inverse=True)
+    row = row.reshape(-1)
+    minute = (local % 86400) // 60
+    valid = ~np.isnan(power)
+    sums = np.zeros((len(days), 1440))
+    counts = np.zeros((len(days), 1440))
+    np.add.at(sums, (row[valid], minute[valid]), power[valid])
+    np.add.at(counts, (row[valid], minute[valid]), 1)
+    stamps = np.zeros((len(days), 1440), dtype=np.int64)
+    stamps[row, minute] = ts
+    with np.errstate(invalid="ignore"):
+        return days, sums / counts, stamps
+
+
+def rolling_mean(grid, window) -> np.ndarray:
+    """ mean of every window of minutes along the last axis, nan where less than MIN_COVERAGE has data """
+    valid = ~np.isnan(grid)
+    pad = [(0, 0)] * (grid.ndim - 1) + [(1, 0)]
+    sums = np.pad(np.cumsum(np.where(valid, grid, 0.0), axis=-1), pad)
+    counts = np.pad(np.cumsum(valid, axis=-1), pad)
+    sums = sums[..., window:] - sums[..., :-window]
+    counts = counts[..., window:] - counts[..., :-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts >= window * MIN_COVERAGE, sums / counts, np.nan)
+
+
+def load_profile(grid, minutes=PROFILE_MINUTES) -> np.ndarray:
+    """ days x (1440 / minutes) mean W per slot, nan for slots without data """
+    slots = grid.reshape(len(grid), -1, minutes)
+    valid = ~np.isnan(slots)
+    with np.errstate(invalid="ignore"):
+        return np.where(valid, slots, 0.0).sum(axis=-1) / valid.sum(axis=-1)
+
+
+def base_load(grid, night=NIGHT, window=BASE_WINDOW) -> tuple:
+    """ (W, first minute) of the lowest window mean within the night hours, nan / -1 without data """
+    means = rolling_mean(grid[:, night[0] * 60:night[1] * 60], window)
+    if means.shape[-1] == 0:
+        return np.full(len(grid), np.nan), np.full(len(grid), -1)
+    known = ~np.isnan(means).all(axis=-1)
+    first = np.argmin(np.where(np.isnan(means), np.inf, means), axis=-1)
+    value = means[np.arange(len(grid)), first]
+    return np.where(known, value, np.nan), np.where(known, first + night[0] * 60, -1)
+
+
+def peak_windows(grid, window=PEAK_WINDOW, count=PEAKS) -> tuple:
+    """ (W, first minute) arrays of shape days x count, highest window first, nan / -1 if missing """
+    means = rolling_mean(grid, window)
+    score = np.where(np.isnan(means), -np.inf, means)
+    positions = np.arange(score.shape[-1])
+    rows = np.arange(len(grid))
+    values = np.full((len(grid), count), np.nan)
+    starts = np.full((len(grid), count), -1)
+    for i in range(count):
+        best = np.argmax(score, axis=-1)
+        found = np.isfinite(score[rows, best])
+        values[found, i] = score[rows, best][found]
+        starts[found, i] = best[found]
+        # windows overlapping the one just taken are out
+        overlap = np.abs(positions[None, :] - best[:, None]) < window
+        score[overlap & found[:, None]] = -np.inf
+    return values, starts
+
+
+def cost(used1, used2, tariff, days=1):
+    """ price of NT (used1) and HT (used2) kWh plus the fixed price of days, scalars or arrays """
+    return used1 * tariff["nt"] + used2 * tariff["ht"] + days * tariff.get("daily", 0.0)
+
+
+def day_reports(ts, used1, used2, power) -> list:
+    """
+    :param ts: numpy array of minute bucket starts (epoch), oldest first
+    :param used1: kWh NT per minute
+    :param used2: kWh HT per minute
+    :param power: mean W per minute, nan where only the counters are known
+    :return: one row for the day_report table per local day with data
+    """
+    if not len(ts):
+        return []
+    used = np.nan_to_num(used1) + np.nan_to_num(used2)
+    # minutes without power samples (e.g. imported counters) take the consumption instead
+    power = np.where(np.isnan(power), used * 60000.0, power)
+    days, grid, stamps = minute_grid(ts, power)
+    # energy is summed per day, the grid would average the repeated hour of the autumn clock change
+    row = np.searchsorted(days, (ts + local_offsets(ts)) // 86400)
+    used1 = np.bincount(row, weights=np.nan_to_num(used1), minlength=len(days))
+    used2 = np.bincount(row, weights=np.nan_to_num(used2), minlength=len(days))
+    minutes = (~np.isnan(grid)).sum(axis=-1)
+    profile = load_profile(grid)
+    base, base_minute = base_load(grid)
+    peaks, peak_minute = peak_windows(grid)
+    rows = []
+    for i, day in enumerate(days.tolist()):
+        def at(minute):
+            return int(stamps[i, minute]) if minute >= 0 else None
+        top = [[at(m), round(p, 1)] for p, m in zip(peaks[i].tolist(), peak_minute[i].tolist()) if m >= 0]
+        rows.append({
+            "ts": local_midnight(day),
+            "used1": round(float(used1[i]), 4), "used2": round(float(used2[i]), 4),
+            "minutes": int(minutes[i]),
+            "base_load": None if np.isnan(base[i]) else round(float(base[i]), 1),
+            "base_ts": at(int(base_minute[i])),
+            "peak_power": top[0][1] if top else None, "peak_ts": top[0][0] if top else None,
+            "peaks": top,
+            "profile": [None if p != p else int(round(p)) for p in profile[i].tolist()],
+        })
+    return rows
+
+
+def week_over_week(day_ts, used) -> tuple:
+    """
+    :param day_ts: numpy array of local midnights (epoch), oldest first
+    :param used: kWh of every day
+    :return: (kWh of the same weekday one week before or nan for every day,
+              [{"week": "2026-W42", "from", "days", "used", "change"}, ...] where change
+              compares the mean per day with the previous week)
+    """
+    dates = [datetime.date.fromtimestamp(t) for t in day_ts.tolist()]
+    ordinal = np.array([d.toordinal() for d in dates], dtype=np.int64)
+    i = np.searchsorted(ordinal, ordinal - 7)
+    found = (i < len(ordinal)) & (ordinal[np.minimum(i, len(ordinal) - 1)] == ordinal - 7)
+    before = np.where(found, used[np.minimum(i, len(used) - 1)], np.nan)
+
+    # monday of every day starts its week
+    monday = ordinal - np.array([d.weekday() for d in dates], dtype=np.int64)
+    keys, idx, counts = np.unique(monday, return_index=True, return_counts=True)
+    totals = np.add.reduceat(used, idx) if len(used) else np.zeros(0)
+    per_day = totals / np.maximum(counts, 1)
+    weeks = []
+    for k, (key, total, n, mean) in enumerate(zip(keys.tolist(), totals.tolist(), counts.tolist(), per_day.tolist())):
+        start = datetime.date.fromordinal(key)
+        year, week, _ = start.isocalendar()
+        previous = per_day[k - 1] if k and keys[k - 1] == key - 7 else None
+        weeks.append({"week": "%d-W%02d" % (year, week), "from": int(day_ts[idx[k]]), "days": n,
+                      "used": round(total, 3),
+                      "change": round(mean / previous - 1, 4) if previous else None})
+    return before, weeks
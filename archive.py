@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+
+# Retention for the raw power log: samples older than keep_days are moved
+# into one compressed columnar file per local month (powerlog-YYYY-MM.npz)
+# and deleted from the db, or from the raw store file of the meter with the
+# mmap backend. Range reads combine archive and db. Every meter has its own
+# directory, the functions take the meter id of its rows.
+# Usage: python archive.py [path/to/power.db] [keep days]
+import datetime
+import glob
+import os
+import sys
+
+import numpy as np
+from sqlalchemy import select, text
+
+FIELDS = ("ts", "energy1", "energy2", "power")
+
+
+def month_path(directory, year, month) -> str:
+    return os.path.join(directory, "powerlog-%04d-%02d.npz" % (year, month))
+
+
+def _month_of(ts) -> tuple:
+    dt = datetime.datetime.fromtimestamp(ts)
+    return dt.year, dt.month
+
+
+def _month_bounds(year, month) -> tuple:
+    start = datetime.datetime(year, month, 1)
+    end = start.replace(year=year + month // 12, month=month % 12 + 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def empty() -> dict:
+    return {"ts": np.empty(0, dtype=np.int64), "energy1": np.empty(0), "energy2": np.empty(0),
+            "power": np.empty(0)}
+
+
+def load_month(path) -> dict:
+    with np.load(path) as f:
+        data = {k: f[k] for k in FIELDS}
+    if data["power"].dtype == np.float32:
+        # files written before power was stored as float64, the shortest decimal is the value read from the meter
+        data["power"] = data["power"].astype(str).astype(np.float64)
+    return data
+
+
+def write_month(path, data):
+    """ merges data into the month file, samples are unique by ts and sorted """
+    if os.path.exists(path):
+        old = load_month(path)
+        data = {k: np.concatenate((old[k], data[k])) for k in FIELDS}
+    _, idx = np.unique(data["ts"], return_index=True)
+    data = {k: v[idx] for k, v in data.items()}
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, ts=data["ts"].astype(np.int64), energy1=data["energy1"].astype(np.float64),
+                        energy2=data["energy2"].astype(np.float64), power=data["power"].astype(np.float64))
+    os.replace(tmp, path)
+
+
+def months(directory) -> list:
+    """ (year, month) of all archive files, oldest first """
+    result = []
+    for path in sorted(glob.glob(os.path.join(directory, "powerlog-*.npz"))):
+        name = os.path.basename(path)[len("powerlog-"):-len(".npz")]
+        try:
+            year, month = name.split("-")
+            result.append((int(year), int(month)))
+        except ValueError:
+            continue
+    return result
+
+
+def load_range(directory, start=None, end=None) -> dict:
+    """
+    :param start: first epoch second (inclusive), None from the beginning
+    :param end: last epoch second (exclusive), None up to the end
+    :return: dict of numpy arrays ts, energy1, energy2, power
+    """
+    parts = []
+    for year, month in months(directory):
+        m_start, m_end = _month_bounds(year, month)
+        if (end is not None and m_start >= end) or (start is not None and m_end <= start):
+            continue
+        data = load_month(month_path(directory, year, month))
+        lo = 0 if start is None else np.searchsorted(data["ts"], start)
+        hi = len(data["ts"]) if end is None else np.searchsorted(data["ts"], end)
+        parts.append({k: v[lo:hi] for k, v in data.items()})
+    if not parts:
+        return empty()
+    return {k: np.concatenate([p[k] for p in parts]) for k in FIELDS}
+
+
+def _of_meter(query, raw_table, meter_id):
+    """ None selects the rows of every meter """
+    return query if meter_id is None else query.where(raw_table.c.meter_id == meter_id)
+
+
+def query_db(conn, raw_table, start=None, end=None, meter_id=None) -> dict:
+    query = _of_meter(select(raw_table.c.ts, raw_table.c.energy1, raw_table.c.energy2, raw_table.c.power),
+                      raw_table, meter_id)
+    if start is not None:
+        query = query.where(raw_table.c.ts >= start)
+    if end is not None:
+        query = query.where(raw_table.c.ts < end)
+    rows = conn.execute(query.order_by(raw_table.c.ts)).fetchall()
+    if not rows:
+        return empty()
+    data = np.array(rows, dtype=np.float64)
+    return {"ts": data[:, 0].astype(np.int64), "energy1": data[:, 1], "energy2": data[:, 2], "power": data[:, 3]}
+
+
+def query_raw(engine, raw_table, directory, start=None, end=None, meter_id=None) -> dict:
+    """ raw samples of a meter in [start, end) from its archive directory and the db """
+    old = load_range(directory, start, end)
+    with engine.connect() as conn:
+        new = query_db(conn, raw_table, start, end, meter_id)
+    return combine(old, new)
+
+
+def archive_chunks(directory, chunk_size=200000):
+    """ yields archived samples as (ts, energy1, energy2, power) like rebuild.read_chunks() """
+    for year, month in months(directory):
+        data = load_month(month_path(directory, year, month))
+        for i in range(0, len(data["ts"]), chunk_size):
+            yield tuple(data[k][i:i + chunk_size].astype(np.float64) if k != "ts" else data[k][i:i + chunk_size]
+                        for k in FIELDS)
+
+
+def _cutoff(keep_days) -> int:
+    """ local midnight keep_days ago """
+    cutoff_dt = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) \
+        - datetime.timedelta(days=keep_days)
+    return int(cutoff_dt.timestamp())
+
+
+def apply_retention(engine, raw_table, directory, keep_days, vacuum=True, meter_id=None) -> int:
+    """
+    :param directory: archive directory of the meter
+    :param keep_days: days of raw samples which stay in the db
+    :param meter_id: meter whose samples are moved, None moves the rows of every meter
+    :return: number of samples moved into the archive
+
+    Samples before local midnight keep_days ago are written to the month
+    files first and deleted from the db afterwards, one month at a time.
+    """
+    cutoff = _cutoff(keep_days)
+    with engine.connect() as conn:
+        first = conn.execute(_of_meter(select(raw_table.c.ts).where(raw_table.c.ts < cutoff), raw_table, meter_id)
+                             .order_by(raw_table.c.ts).limit(1)).scalar()
+    if first is None:
+        return 0
+    os.makedirs(directory, exist_ok=True)
+    moved = 0
+    year, month = _month_of(first)
+    while True:
+        m_start, m_end = _month_bounds(year, month)
+        if m_start >= cutoff:
+            break
+        with engine.connect() as conn:
+            data = query_db(conn, raw_table, m_start, min(m_end, cutoff), meter_id)
+        if len(data["ts"]):
+            write_month(month_path(directory, year, month), data)
+            with engine.begin() as conn:
+                conn.execute(_of_meter(raw_table.delete(), raw_table, meter_id)
+                             .where(raw_table.c.ts >= int(data["ts"][0]))
+                             .where(raw_table.c.ts <= int(data["ts"][-1])))
+            moved += len(data["ts"])
+        year, month = _month_of(m_end)
+    if moved and vacuum and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    return moved
+
+
+def apply_store_retention(store, directory, keep_days) -> int:
+    """ like apply_retention() for a rawstore.RawStore, the store file is compacted once at the end """
+    cutoff = _cutoff(keep_days)
+    data = store.range(end=cutoff)
+    if not len(data):
+        return 0
+    os.makedirs(directory, exist_ok=True)
+    ts = data["ts"]
+    year, month = _month_of(int(ts[0]))
+    while True:
+        m_start, m_end = _month_bounds(year, month)
+        if m_start >= cutoff:
+            break
+        lo, hi = np.searchsorted(ts, m_start), np.searchsorted(ts, m_end)
+        if hi > lo:
+            write_month(month_path(directory, year, month), {k: data[k][lo:hi] for k in FIELDS})
+        year, month = _month_of(m_end)
+    return store.drop_before(int(ts[-1]) + 1)
+
+
+def combine(old, new) -> dict:
+    """ archived samples followed by the newer ones of the db or raw store """
+    if not len(old["ts"]):
+        return new
+    if len(new["ts"]):
+        # a sample may be in both if the process died between archiving and deleting
+        new = {k: v[new["ts"] > old["ts"][-1]] for k, v in new.items()}
+    return {k: np.concatenate((old[k], new[k])) for k in FIELDS}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        os.environ["SMARTSERVER_DB"] = os.path.abspath(sys.argv[1])
+    import smartserver
+    smartserver.create_app()
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else smartserver.raw_retention_days
+    smartserver.writer.flush()
+    for meter_id, manager in smartserver.managers.items():
+        directory = smartserver.meter_archive_dir(meter_id)
+        if manager.store is not None:
+            moved = apply_store_retention(manager.store, directory, days)
+        else:
+            moved = apply_retention(smartserver.db.engine, smartserver.PowerLog.__table__, directory, days,
+                                    meter_id=meter_id)
+        print("Archived %d samples of meter %s older than %d days to %s" % (moved, meter_id, days, directory))
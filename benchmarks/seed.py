@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+# Synthetic power.db for the benchmarks. The samples follow the meter
+# simulator (meter.SimulatorSource): a random power of up to 1000 W every
+# delay seconds, both counters grow by the energy of the interval. They are
+# generated with numpy and end now, the rollup tables are built by
+# rebuild.py and the day reports by the server code, like after an import.
+# Usage: python benchmarks/seed.py power.db [--years 1 | --rows 100000] [--delay 10]
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def samples(rows, delay=10, end=None, seed=1, start_values=(1110.0, 2220.0)):
+    """
+    :param rows: number of samples
+    :param end: epoch of the last sample, default now
+    :return: (ts, energy1, energy2, power) numpy arrays, oldest first
+    """
+    end = int(time.time()) if end is None else end
+    rng = np.random.default_rng(seed)
+    ts = end - delay * np.arange(rows - 1, -1, -1, dtype=np.int64)
+    power = np.ceil(rng.random(rows) * 1000)
+    used = np.cumsum(power / 1000 * delay / 3600)
+    return ts, start_values[0] + used, start_values[1] + used, power
+
+
+def seed(path, rows, delay=10, chunk=200000, reports=True) -> dict:
+    """
+    Creates path with rows raw samples, the rollups and the day reports.
+    smartserver is imported with SMARTSERVER_DB set to path.
+    :return: {"rows", "seconds"} and the seconds of the steps
+    """
+    path = os.path.abspath(path)
+    if os.path.exists(path):
+        os.remove(path)
+    os.environ["SMARTSERVER_DB"] = path
+    sys.path.insert(0, root)
+    import rebuild
+    import smartserver
+
+    t0 = time.perf_counter()
+    smartserver.create_app()
+    smartserver.writer.flush()
+    ts, e1, e2, power = samples(rows, delay)
+    con = sqlite3.connect(path)
+    with con:
+        for i in range(0, rows, chunk):
+            con.executemany("INSERT INTO power_log (ts, energy1, energy2, power) VALUES (?, ?, ?, ?)",
+                            zip(ts[i:i + chunk].tolist(), e1[i:i + chunk].tolist(),
+                                e2[i:i + chunk].tolist(), power[i:i + chunk].tolist()))
+    con.close()
+    t1 = time.perf_counter()
+    rebuild.rebuild(smartserver.db.engine, smartserver.PowerLog.__table__,
+                    {res: t.__table__ for res, t in smartserver.rollup_tables.items()}, chunk)
+    t2 = time.perf_counter()
+    if reports:
+        with smartserver.app.app_context():
+            smartserver.update_reports()
+    t3 = time.perf_counter()
+    return {"rows": rows, "seconds": t3 - t0, "insert": t1 - t0, "rollups": t2 - t1, "reports": t3 - t2}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="seeds a power.db with simulated meter samples")
+    parser.add_argument("db")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--years", type=float, help="years of samples (default 1)")
+    size.add_argument("--rows", type=int, help="number of samples")
+    parser.add_argument("--delay", type=int, default=10, help="seconds between samples")
+    args = parser.parse_args()
+    count = args.rows or int((args.years or 1) * 365 * 86400 / args.delay)
+    result = seed(args.db, count, args.delay)
+    print("Seeded %s with %d samples in %.1f s" % (args.db, result["rows"], result["seconds"]))
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+# Startup benchmark: every run is a fresh interpreter which imports
+# smartserver, calls create_app() and answers its first requests, like the Pi
+# after a power cut. The timings are printed as json, the median of all runs
+# in "median".
+# Usage: python benchmarks/startup.py [--db power.db] [--runs 5] [--output startup.json]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child process, prints one json line
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, %(root)r)
+import smartserver
+result = {"import": time.perf_counter() - t0,
+          "numpy_loaded": type(sys.modules.get("numpy")).__name__ == "module",
+          "matplotlib_loaded": "matplotlib" in sys.modules}
+t = time.perf_counter()
+smartserver.create_app()
+result["create_app"] = time.perf_counter() - t
+result.update(("create_app." + k, v) for k, v in smartserver.startup.items())
+client = smartserver.app.test_client()
+for name, url in (("first_home", "/"), ("second_home", "/"), ("first_current", "/current")):
+    t = time.perf_counter()
+    status = client.get(url).status_code
+    result[name] = time.perf_counter() - t
+    result[name + ".status"] = status
+result["ready"] = time.perf_counter() - t0
+print(json.dumps(result))
+"""
+
+
+def run_once(db) -> dict:
+    env = dict(os.environ, SMARTSERVER_DB=db, SMARTSERVER_GRAPHS=os.path.join(os.path.dirname(db), "graphs"))
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD % {"root": root}], env=env, cwd=os.path.dirname(db),
+                         capture_output=True, text=True, check=True).stdout
+    wall = time.perf_counter() - t0
+    result = json.loads(out.strip().splitlines()[-1])
+    # includes the start of the interpreter
+    result["process"] = wall
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time from process start to the first answered request")
+    parser.add_argument("--db", help="sqlite file, default an empty db in a temporary directory")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="also write the json to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.abspath(args.db) if args.db else os.path.join(tmp, "power.db")
+        runs = [run_once(db) for _ in range(args.runs)]
+    keys = [k for k, v in runs[0].items() if isinstance(v, float)]
+    report = {"benchmark": "startup", "python": platform.python_version(), "machine": platform.machine(),
+              "db": args.db or "empty", "runs": runs,
+              "median": {k: statistics.median(r[k] for r in runs) for k in keys}}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(json.dumps(report["median"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
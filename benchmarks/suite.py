@@ -0,0 +1,421 @@
+#!/usr/bin/python3
+
+# Benchmark suite of the hot paths: SML decode, ingest, rollup, the query
+# endpoints at several db sizes, startup, the raw sample backends and the
+# SSE fan-out. Everything
+# which imports smartserver runs in a fresh interpreter per db, seeded dbs
+# are kept in the work directory and reused. The results are written as
+# json; --compare prints the metrics which changed against an older file.
+# Usage: python benchmarks/suite.py [--sizes 1000,100000,10000000] [--output results.json]
+#                                   [--only decode,rollup,raw,ingest,queries,startup,sse] [--compare old.json]
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import resource
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+
+GROUPS = ["decode", "rollup", "raw", "ingest", "queries", "startup", "sse"]
+
+
+def timed(func, repeat) -> dict:
+    """ median, p95 and max milliseconds of repeat calls of func """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {"median_ms": round(statistics.median(times), 3),
+            "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+            "max_ms": round(times[-1], 3)}
+
+
+def bench_decode(args) -> dict:
+    """ frames of the capture decoded per second, bytes per second through the frame buffer """
+    import sml
+    frames = sml.frames_from_hexdump(os.path.join(root, "textscratch.txt"))
+    rounds = max(1, 20000 // len(frames))
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            sml.reading(sml.decode_frame(frame))
+    decode = len(frames) * rounds / (time.perf_counter() - t0)
+    stream = b"".join(frames) * rounds
+    buffer = sml.SmlFrameBuffer()
+    found = 0
+    t0 = time.perf_counter()
+    for i in range(0, len(stream), 256):
+        found += len(buffer.feed(stream[i:i + 256]))
+    elapsed = time.perf_counter() - t0
+    return {"frames_per_s": round(decode), "frame_bytes": len(frames[0]),
+            "split_mb_per_s": round(len(stream) / elapsed / 1e6, 2), "split_frames": found}
+
+
+def bench_rollup(args) -> dict:
+    """ incremental rollup per sample and the vectorized rebuild of the same samples """
+    import rebuild
+    import rollup
+    import seed
+    n = args.rollup_samples
+    ts, e1, e2, power = seed.samples(n)
+    engine = rollup.RollupEngine()
+    dts = [datetime.datetime.fromtimestamp(t) for t in ts.tolist()]
+    rows = 0
+    t0 = time.perf_counter()
+    for dt, a, b, p in zip(dts, e1.tolist(), e2.tolist(), power.tolist()):
+        rows += len(engine.add(dt, a, b, p))
+    incremental = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    result = rebuild.compute(iter([(ts, e1, e2, power)]))
+    vectorized = time.perf_counter() - t0
+    return {"samples": n, "closed_rows": rows, "incremental_us_per_sample": round(incremental / n * 1e6, 2),
+            "rebuild_samples_per_s": round(n / vectorized),
+            "rebuild_rows": {res: len(r) for res, r in result.items()}}
+
+
+def bench_raw(args) -> dict:
+    """ appends and range reads of the power_log table against the mmap raw store, same samples """
+    import tempfile
+    import archive
+    import rawstore
+    import seed
+    from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, create_engine
+    n = args.raw_samples
+    ts, e1, e2, power = seed.samples(n)
+    appends = min(n, 20000)
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        engine = create_engine("sqlite:///" + os.path.join(tmp, "raw.db"))
+        table = Table("power_log", MetaData(), Column("id", Integer, primary_key=True),
+                      Column("meter_id", String(32)), Column("ts", Integer), Column("energy1", Float),
+                      Column("energy2", Float), Column("power", Float))
+        Index("ix_power_log_meter_ts", table.c.meter_id, table.c.ts)
+        table.metadata.create_all(engine)
+        rows = [{"meter_id": "main", "ts": t, "energy1": a, "energy2": b, "power": p}
+                for t, a, b, p in zip(ts.tolist(), e1.tolist(), e2.tolist(), power.tolist())]
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        db_bulk = time.perf_counter() - t0
+
+        store = rawstore.RawStore(os.path.join(tmp, "main.raw"))
+        t0 = time.perf_counter()
+        for t, a, b, p in zip(ts[:appends].tolist(), e1.tolist(), e2.tolist(), power.tolist()):
+            store.append(t, a, b, p)
+        append = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        store.extend(rawstore.records_of(ts[appends:], e1[appends:], e2[appends:], power[appends:]))
+        store_bulk = time.perf_counter() - t0
+
+        start, end = int(ts[0]), int(ts[-1]) + 1
+        hour = (end - 3600, end)
+
+        def read_db(a, b):
+            with engine.connect() as conn:
+                archive.query_db(conn, table, a, b, "main")
+        result = {"samples": n, "file_bytes": os.path.getsize(store.path),
+                  "store_append_us": round(append / appends * 1e6, 2),
+                  "store_bulk_samples_per_s": round((n - appends) / store_bulk) if n > appends else None,
+                  "db_bulk_samples_per_s": round(n / db_bulk),
+                  "db_all": timed(lambda: read_db(start, end), 3),
+                  "store_all": timed(lambda: store.query(start, end), args.repeat),
+                  "db_hour": timed(lambda: read_db(*hour), args.repeat),
+                  "store_hour": timed(lambda: store.query(*hour), args.repeat)}
+        store.close()
+        engine.dispose()
+    return result
+
+
+def bench_sse(args) -> dict:
+    """ time until an event reached every listener, thread queues and the asyncio stream server """
+    import sse
+    import streamserver
+    result = {"announcer": {}, "streamserver": {}}
+    events = 50
+    for n in args.listeners:
+        announcer = sse.MessageAnnouncer()
+        queues = [announcer.listen() for _ in range(n)]
+
+        def fan_out():
+            announcer.publish("power", {"power": 1234, "level": "low"})
+            for q in queues:
+                q.get_nowait()
+        stats = timed(fan_out, events)
+        stats["us_per_listener"] = round(stats["median_ms"] * 1000 / n, 3)
+        result["announcer"][str(n)] = stats
+
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    for n in args.listeners:
+        if 2 * n + 50 > limit:
+            result["streamserver"][str(n)] = {"skipped": "open file limit %d" % limit}
+            continue
+        announcer = sse.MessageAnnouncer()
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = streamserver.StreamServer(announcer, host="127.0.0.1", port=port).start()
+        clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(n)]
+        sel = selectors.DefaultSelector()
+        for c in clients:
+            c.sendall(b"GET /listen HTTP/1.1\r\nHost: bench\r\n\r\n")
+            c.setblocking(False)
+            sel.register(c, selectors.EVENT_READ, {"buffer": b"", "last": 0})
+        deadline = time.time() + 30
+        while server.clients < n and time.time() < deadline:
+            time.sleep(0.01)
+        times = []
+        missed = 0
+        for _ in range(events):
+            waiting = set(clients)
+            t0 = time.perf_counter()
+            event_id = announcer.publish("power", {"power": 1234, "level": "low"})
+            deadline = time.time() + 10
+            while waiting and time.time() < deadline:
+                for key, _ in sel.select(1):
+                    state = key.data
+                    try:
+                        data = state["buffer"] + key.fileobj.recv(65536)
+                    except BlockingIOError:
+                        continue
+                    # an id may be cut by the end of the read, keep the open line
+                    head, _, state["buffer"] = data.rpartition(b"\n")
+                    ids = re.findall(rb"^id: (\d+)$", head, re.M)
+                    if ids:
+                        state["last"] = max(state["last"], int(ids[-1]))
+                    if state["last"] >= event_id:
+                        waiting.discard(key.fileobj)
+            missed += len(waiting)
+            if not waiting:
+                times.append((time.perf_counter() - t0) * 1000)
+        sel.close()
+        for c in clients:
+            c.close()
+        if not times:
+            result["streamserver"][str(n)] = {"clients": server.peak_clients, "missed": missed}
+            continue
+        times.sort()
+        result["streamserver"][str(n)] = {"median_ms": round(statistics.median(times), 3),
+                                          "p95_ms": round(times[int(len(times) * 0.95)], 3),
+                                          "max_ms": round(times[-1], 3), "clients": server.peak_clients,
+                                          "missed": missed, "slow_clients": server.slow_clients,
+                                          "us_per_listener": round(statistics.median(times) * 1000 / n, 3)}
+    return result
+
+
+# runs in a fresh interpreter with SMARTSERVER_DB set, prints one json line
+def child_ingest(args) -> dict:
+    """ DbManager.append_data and /input samples per second into an empty db """
+    import seed
+    import smartserver
+    smartserver.create_app()
+    n = args.ingest_samples
+    ts, e1, e2, power = seed.samples(3 * n, end=int(time.time()) + 3 * n * 10)
+    ts, e1, e2, power = ts.tolist(), e1.tolist(), e2.tolist(), power.tolist()
+    result = {"samples": n}
+    writer = smartserver.writer
+    manager = smartserver.managers[smartserver.default_meter]
+    with smartserver.app.app_context():
+        t0 = time.perf_counter()
+        for i in range(n):
+            manager.append_data(datetime.datetime.fromtimestamp(ts[i]), e1[i], e2[i], power[i])
+        queued = time.perf_counter() - t0
+        writer.flush()
+        result["append_data"] = {"samples_per_s": round(n / (time.perf_counter() - t0)),
+                                 "queued_per_s": round(n / queued)}
+
+    client = smartserver.app.test_client()
+    records = [{"timestamp": datetime.datetime.fromtimestamp(ts[i]).isoformat(), "energyNT": e1[i],
+                "energyHT": e2[i], "power": power[i]} for i in range(n, 3 * n)]
+    single = records[:n // 10]
+    t0 = time.perf_counter()
+    for r in single:
+        client.post("/input", json=r)
+    requests = time.perf_counter() - t0
+    smartserver.ingest_queue.join()
+    writer.flush()
+    result["input"] = {"samples": len(single), "requests_per_s": round(len(single) / requests),
+                       "samples_per_s": round(len(single) / (time.perf_counter() - t0)),
+                       "dropped": smartserver.ingest_queue.dropped}
+    batches = records[n // 10:]
+    t0 = time.perf_counter()
+    for i in range(0, len(batches), 1000):
+        client.post("/input", json=batches[i:i + 1000])
+    result["input_batch"] = {"samples": len(batches), "batch": 1000,
+                             "samples_per_s": round(len(batches) / (time.perf_counter() - t0))}
+    return result
+
+
+def child_queries(args) -> dict:
+    """ latency of the read endpoints, uncached (cache cleared before every request) and cached """
+    import smartserver
+    smartserver.create_app()
+    with smartserver.db.engine.connect() as conn:
+        first, last = conn.execute(smartserver.db.text("SELECT min(ts), max(ts) FROM power_log")).first()
+    middle = (first + last) // 2
+    urls = ["/get/minute", "/get/hour", "/get/day",
+            "/get/minute?from=%d&limit=1000" % middle,
+            "/", "/current", "/current?resolution=minute",
+            "/api/series", "/api/series?from=%d&to=%d" % (first, last),
+            "/api/series?from=%d&to=%d&resolution=raw&points=800" % (max(first, last - 7 * 86400), last),
+            "/api/report", "/api/raw?from=%d&to=%d" % (last - 3600, last)]
+    client = smartserver.app.test_client()
+    cache = smartserver.response_cache
+    result = {}
+    for url in urls:
+        cache.clear()
+        t0 = time.perf_counter()
+        status = client.get(url).status_code
+        entry = {"status": status, "first_ms": round((time.perf_counter() - t0) * 1000, 3)}
+
+        def uncached():
+            cache.clear()
+            client.get(url)
+        entry["uncached"] = timed(uncached, args.repeat)
+        entry["cached"] = timed(lambda: client.get(url), args.repeat)
+        result[url] = entry
+    return result
+
+
+CHILDREN = {"ingest": child_ingest, "queries": child_queries}
+
+
+def run_child(group, db, args) -> dict:
+    env = dict(os.environ, SMARTSERVER_DB=db, SMARTSERVER_ARCHIVE=os.path.join(args.workdir, "archive"),
+               SMARTSERVER_GRAPHS=os.path.join(args.workdir, "graphs"))
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", group, "--repeat", str(args.repeat),
+           "--ingest-samples", str(args.ingest_samples)]
+    out = subprocess.run(cmd, env=env, cwd=args.workdir, capture_output=True, text=True)
+    if out.returncode:
+        raise RuntimeError("%s failed: %s" % (group, out.stderr.strip().splitlines()[-1:]))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def seeded_db(rows, args) -> str:
+    """ path of a db with rows samples in the work directory, seeded on first use """
+    path = os.path.join(args.workdir, "power-%d.db" % rows)
+    if not os.path.exists(path):
+        print("Seeding %d rows" % rows, file=sys.stderr)
+        env = dict(os.environ, SMARTSERVER_ARCHIVE=os.path.join(args.workdir, "archive"),
+                   SMARTSERVER_GRAPHS=os.path.join(args.workdir, "graphs"))
+        subprocess.run([sys.executable, os.path.join(here, "seed.py"), path + ".tmp", "--rows", str(rows)],
+                       env=env, cwd=args.workdir, check=True, stdout=subprocess.DEVNULL)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def flatten(results, prefix="") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = prefix + "/" + key if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old, new, threshold=0.1):
+    """ prints the metrics which changed by more than threshold """
+    before = flatten(old["results"])
+    after = flatten(new["results"])
+    print("%-70s %12s %12s %8s" % ("metric (%s -> %s)" % (old.get("revision"), new.get("revision")),
+                                   "before", "after", "change"))
+    for name in sorted(before.keys() & after.keys()):
+        a, b = before[name], after[name]
+        if a and abs(b / a - 1) > threshold:
+            print("%-70s %12g %12g %+7.0f%%" % (name, a, b, (b / a - 1) * 100))
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=root, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks of the smartserver hot paths")
+    parser.add_argument("--sizes", default="1000,100000,10000000", help="raw rows of the query benchmarks")
+    parser.add_argument("--only", default=",".join(GROUPS), help="comma separated groups")
+    parser.add_argument("--listeners", default="1,10,100,1000", help="listener counts of the sse fan-out")
+    parser.add_argument("--repeat", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("--ingest-samples", type=int, default=20000)
+    parser.add_argument("--rollup-samples", type=int, default=100000)
+    parser.add_argument("--raw-samples", type=int, default=259200, help="samples of the raw group, 30 days by default")
+    parser.add_argument("--workdir", default=os.path.join(here, "data"), help="seeded dbs are kept here")
+    parser.add_argument("--output", help="json file for the results")
+    parser.add_argument("--compare", help="results of an older run to compare with")
+    parser.add_argument("--child", choices=list(CHILDREN), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # nothing but the result may go to stdout
+        out = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        out.write(json.dumps(CHILDREN[args.child](args)) + "\n")
+        return
+    args.listeners = [int(n) for n in args.listeners.split(",")]
+    sizes = [int(n) for n in args.sizes.split(",")]
+    groups = [g for g in args.only.split(",") if g]
+    os.makedirs(args.workdir, exist_ok=True)
+    started = time.time()
+    results = {}
+    for group in groups:
+        print("Running %s" % group, file=sys.stderr)
+        t0 = time.perf_counter()
+        if group == "decode":
+            results[group] = bench_decode(args)
+        elif group == "rollup":
+            results[group] = bench_rollup(args)
+        elif group == "raw":
+            results[group] = bench_raw(args)
+        elif group == "sse":
+            results[group] = bench_sse(args)
+        elif group == "ingest":
+            db = os.path.join(args.workdir, "ingest.db")
+            for path in (db, db + "-wal", db + "-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+            results[group] = run_child("ingest", db, args)
+        elif group == "queries":
+            results[group] = {str(rows): run_child("queries", seeded_db(rows, args), args) for rows in sizes}
+        elif group == "startup":
+            import startup
+            results[group] = {}
+            for rows in sizes:
+                runs = [startup.run_once(seeded_db(rows, args)) for _ in range(3)]
+                results[group][str(rows)] = {k: statistics.median(r[k] for r in runs)
+                                             for k, v in runs[0].items() if isinstance(v, float)}
+        else:
+            parser.error("unknown group %s" % group)
+        print("%s done in %.1f s" % (group, time.perf_counter() - t0), file=sys.stderr)
+
+    report = {"suite": "smartserver", "revision": revision(), "started": datetime.datetime.fromtimestamp(
+              started).isoformat(timespec="seconds"), "seconds": round(time.time() - started, 1),
+              "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+              "sizes": sizes, "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+# Response cache for GET routes. Entries are valid as long as the data
+# version did not change; the ingest path calls bump() for every new
+# reading and the db writer after every commit.
+import hashlib
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import Response, make_response, request
+
+
+class ResponseCache:
+    """ cached() decorates a view, entries are keyed by path and query string """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.version = 0
+        self.source = None      # optional callable returning a version bumped by another process
+        self.bypass = None      # optional callable, True runs the view uncached (e.g. while profiling)
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        """ marks every cached response as stale """
+        with self.lock:
+            self.version += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _version(self):
+        if self.source is None:
+            return self.version
+        return self.version, self.source()
+
+    def _key(self):
+        args = sorted(request.args.items(multi=True))
+        return request.path, tuple(args)
+
+    def _get(self, key):
+        with self.lock:
+            version = self._version()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None, version
+            self.entries.move_to_end(key)
+            return entry, version
+
+    def _put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or (self.bypass is not None and self.bypass()):
+                return view(*args, **kwargs)
+            key = self._key()
+            entry, version = self._get(key)
+            if entry is None:
+                self.misses += 1
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                headers = [(k, v) for k, v in response.headers.items()
+                           if k.lower() not in ("content-length", "content-type", "etag")]
+                entry = (version, body, response.mimetype, etag, headers)
+                self._put(key, entry)
+            else:
+                self.hits += 1
+            _, body, mimetype, etag, headers = entry
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype=mimetype, headers=headers)
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+# Write-behind db writer: rows are queued and written by one thread in
+# groups, one transaction per flush instead of one commit per reading.
+# Transactions failing with an OperationalError (e.g. the db is locked by
+# a VACUUM or a CLI tool) are retried with backoff before rows are dropped.
+import logging
+import queue
+import time
+from threading import Event, Lock, Thread
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+import metrics
+
+log = logging.getLogger(__name__)
+commit_seconds = metrics.histogram("smartserver_db_commit_seconds", "duration of one write-behind transaction")
+rows_written = metrics.counter("smartserver_db_rows_written_total", "rows committed per table", labels=("table",))
+rows_failed = metrics.counter("smartserver_db_rows_failed_total", "rows dropped because their transaction failed")
+commit_retries = metrics.counter("smartserver_db_commit_retries_total",
+                                 "transactions retried after an operational error like a locked db")
+_STOP = object()    # ends the writer thread, see stop()
+
+sqlite_pragmas = {
+    "journal_mode": "WAL",      # readers do not block the writer
+    "synchronous": "NORMAL",    # fsync on checkpoint only, safe with WAL
+    "cache_size": -8000,        # 8 MB page cache
+    "temp_store": "MEMORY",
+}
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.split('.')[0] not in ("sqlite3", "pysqlite2"):
+        return
+    cursor = dbapi_connection.cursor()
+    for key, value in sqlite_pragmas.items():
+        cursor.execute("PRAGMA %s=%s" % (key, value))
+    cursor.close()
+
+
+class Ack:
+    """ passed to add_group(), set once the group was committed or dropped """
+    def __init__(self):
+        self.done = Event()
+        self.ok = False
+
+    def set(self, ok):
+        self.ok = ok
+        self.done.set()
+
+    def wait(self, timeout=None) -> bool:
+        """ True if the group was committed """
+        return self.done.wait(timeout) and self.ok
+
+
+class DbWriter:
+    """ add() queues rows for a table, the writer thread inserts them
+        when max_rows are pending or max_delay seconds have passed
+    """
+    def __init__(self, db, max_rows=200, max_delay=60.0, maxsize=20000, context=None, on_commit=None,
+                 attempts=8, max_backoff=5.0):
+        """
+        :param db: flask_sqlalchemy.SQLAlchemy instance
+        :param max_rows: pending rows which trigger a flush
+        :param max_delay: seconds a row may wait before it is written
+        :param maxsize: queued groups before add() blocks the producer
+        :param context: optional callable returning a context manager for the thread
+        :param on_commit: optional callable run after every successful commit
+        :param attempts: tries of a transaction failing with an OperationalError before its rows are dropped
+        :param max_backoff: longest wait in seconds between two tries
+        """
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.context = context
+        self.on_commit = on_commit
+        self.attempts = attempts
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self._lock = Lock()
+        self.commits = 0
+        self.rows_written = 0
+        self.failed = 0
+        self.last_commit_seconds = 0.0
+
+    def add(self, table, row):
+        """ queues one row (dict of column values) for a model class """
+        self.add_group([(table, row)])
+
+    def add_group(self, rows, ack=None):
+        """
+        queues [(table, row), ...] which are always written in the same transaction
+        :param ack: optional Ack, the group is then written at once and ack set afterwards
+        :return: ack
+        """
+        rows = list(rows)
+        if not rows:
+            if ack is not None:
+                ack.set(True)
+            return ack
+        self.start()
+        self.queue.put((rows, ack))
+        return ack
+
+    def flush(self, timeout=None) -> bool:
+        """ writes everything queued so far and waits for the commit """
+        done = Event()
+        self.start()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.flush(timeout=10)
+
+    def stop(self):
+        """ writes everything queued and ends the thread, the next add() starts a new one """
+        with self._lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(_STOP)
+            thread.join()
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name="dbwriter", daemon=True)
+                self.thread.start()
+        return self
+
+    def _run(self):
+        if self.context is not None:
+            with self.context():
+                self._loop()
+        else:
+            self._loop()
+
+    def _loop(self):
+        pending = []
+        acks = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            waiters = []
+            if item is _STOP:
+                if pending:
+                    self._done(acks, self._write(pending))
+                return
+            if isinstance(item, Event):
+                waiters.append(item)
+            elif item:
+                rows, ack = item
+                if not pending:
+                    deadline = time.monotonic() + self.max_delay
+                pending.extend(rows)
+                if ack is not None:
+                    acks.append(ack)
+            if pending and (waiters or acks or len(pending) >= self.max_rows or time.monotonic() >= deadline):
+                self._done(acks, self._write(pending))
+                pending = []
+                acks = []
+                deadline = None
+            for w in waiters:
+                w.set()
+
+    @staticmethod
+    def _done(acks, ok):
+        for ack in acks:
+            ack.set(ok)
+
+    def _write(self, rows) -> bool:
+        """ one transaction for rows, retried on operational errors; returns False if the rows were dropped """
+        grouped = {}
+        for table, row in rows:
+            grouped.setdefault(table, []).append(row)
+        session = self.db.session
+        backoff = 0.1
+        for attempt in range(1, self.attempts + 1):
+            t0 = time.perf_counter()
+            try:
+                for table, table_rows in grouped.items():
+                    session.execute(self._insert(table), table_rows)
+                session.commit()
+            except OperationalError as e:
+                session.rollback()
+                if attempt < self.attempts:
+                    commit_retries.inc()
+                    log.warning("DbWriter commit of %d rows failed (attempt %d of %d), retrying in %.1f s: %s",
+                                len(rows), attempt, self.attempts, backoff, e.orig)
+                    time.sleep(backoff)
+                    backoff = min(self.max_backoff, backoff * 2)
+                    continue
+                return self._drop(rows, "after %d attempts: %s" % (attempt, e.orig))
+            except Exception as e:
+                session.rollback()
+                return self._drop(rows, getattr(e, "orig", e))
+            finally:
+                self.last_commit_seconds = time.perf_counter() - t0
+                commit_seconds.observe(self.last_commit_seconds)
+            self.commits += 1
+            self.rows_written += len(rows)
+            for table, table_rows in grouped.items():
+                rows_written.inc(len(table_rows), table=table.__tablename__)
+            if self.on_commit is not None:
+                self.on_commit()
+            return True
+
+    @staticmethod
+    def _insert(table):
+        """ insert statement of a model, models with replace_on_conflict = True replace rows with the same key """
+        insert = table.__table__.insert()
+        if getattr(table, "replace_on_conflict", False):
+            insert = insert.prefix_with("OR REPLACE", dialect="sqlite")
+        return insert
+
+    def _drop(self, rows, reason) -> bool:
+        self.failed += len(rows)
+        rows_failed.inc(len(rows))
+        log.error("DbWriter DROPPED %d rows for good: %s", len(rows), reason)
+        return False
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+# Downsampling of time series for charts.
+# lttb(): Largest-Triangle-Three-Buckets, keeps the visual shape of a line
+# minmax(): min/max envelope per bucket, keeps every peak
+import numpy as np
+
+
+def lttb(x, y, n) -> tuple:
+    """
+    :param x: sorted numpy array of x values (e.g. epoch seconds)
+    :param y: numpy array of y values, same length
+    :param n: number of points wanted
+    :return: (x, y) with at most n points, first and last point are kept
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return x, y
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n - 2 buckets between the fixed first and last point
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    out = np.empty(n, dtype=np.int64)
+    out[0] = 0
+    out[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x = x[nlo:nhi].mean()
+            avg_y = y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        bx = x[lo:hi]
+        by = y[lo:hi]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return x[out], y[out]
+
+
+def minmax(x, ymin, ymax, n) -> tuple:
+    """
+    :param x: sorted numpy array of x values
+    :param ymin: lower values (the same array as ymax for a single series)
+    :param ymax: upper values
+    :param n: number of buckets wanted
+    :return: (x of bucket start, min per bucket, max per bucket)
+    """
+    size = len(x)
+    if n >= size or n < 1:
+        return x, ymin, ymax
+    idx = np.linspace(0, size, n + 1).astype(np.int64)[:-1]
+    idx = np.unique(idx)
+    return x[idx], np.fmin.reduceat(ymin, idx), np.fmax.reduceat(ymax, idx)
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# Background rendering of the history graphs. Figures are built with the
+# object oriented Figure/Agg API, which keeps no global pyplot state and can
+# run in a thread, and only when the rollup table behind a graph changed.
+# The png files are replaced atomically, so every http worker can serve them.
+# matplotlib takes seconds to import on a Pi, it is only imported by render().
+import datetime
+import io
+import logging
+import os
+import time
+from threading import Event, Thread
+
+log = logging.getLogger(__name__)
+
+# name: (rollup resolution, seconds shown, title, (x locator, interval), x format)
+GRAPHS = {
+    "36h": ("hour", 36 * 3600, "last 36h", ("HourLocator", 4), "%H:%M"),
+    "7d": ("hour", 7 * 86400, "last 7 days", ("DayLocator", 1), "%a %d.%m"),
+    "12m": ("month", 366 * 86400, "last 12 months", ("MonthLocator", 1), "%m.%Y"),
+}
+
+
+def render(name, ts, used1, used2, dpi=80) -> bytes:
+    """
+    :param ts: numpy array of bucket starts (epoch)
+    :param used1: kWh per bucket NT
+    :param used2: kWh per bucket HT
+    :return: png
+    """
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    resolution, _, title, (locator, interval), fmt = GRAPHS[name]
+    fig = Figure(figsize=(8, 3.5), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    x = [datetime.datetime.fromtimestamp(t) for t in ts.tolist()]
+    if resolution == "month":
+        ax.bar(x, used1, width=20, color='r', label="NT")
+        ax.bar(x, used2, width=20, bottom=used1, label="HT")
+        ax.set_ylabel('Verbrauch kWh')
+    else:
+        ax.plot(x, used1 * 1000, 'r', label="NT")
+        ax.plot(x, used2 * 1000, label="HT")
+        ax.set_ylabel('Verbrauch Wh')
+        ax.xaxis.set_minor_locator(mdates.HourLocator())
+    ax.xaxis.set_major_locator(getattr(mdates, locator)(interval=interval))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter(fmt))
+    ax.grid(True)
+    ax.legend(loc="upper left")
+    ax.set_title(title)
+    fig.autofmt_xdate()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+class GraphRenderer:
+    """ start() runs the render loop in a thread, path(name) is the file of a graph """
+    def __init__(self, directory, load, version, interval=60, context=None):
+        """
+        :param directory: where the png files are written
+        :param load: callable(resolution, start) -> (ts, used1, used2) numpy arrays
+        :param version: callable(resolution) -> value which changes with the rollup table
+        :param interval: seconds between checks of the versions
+        :param context: optional callable returning a context manager for the thread
+        """
+        self.directory = directory
+        self.load = load
+        self.version = version
+        self.interval = interval
+        self.context = context
+        self.rendered = {}
+        self.renders = 0
+        self.failed = 0
+        self.last_render_seconds = 0.0
+        self.thread = None
+        self._wake = Event()
+
+    def path(self, name) -> str:
+        return os.path.join(self.directory, "%s.png" % name)
+
+    def render_changed(self) -> list:
+        """ renders the graphs whose data changed, returns their names """
+        os.makedirs(self.directory, exist_ok=True)
+        versions = {}
+        done = []
+        for name, (resolution, span, _, _, _) in GRAPHS.items():
+            if resolution not in versions:
+                versions[resolution] = self.version(resolution)
+            path = self.path(name)
+            if self.rendered.get(name) == versions[resolution] and os.path.exists(path):
+                continue
+            t0 = time.perf_counter()
+            png = render(name, *self.load(resolution, int(time.time()) - span))
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, path)
+            self.rendered[name] = versions[resolution]
+            self.renders += 1
+            self.last_render_seconds = time.perf_counter() - t0
+            done.append(name)
+        return done
+
+    def wake(self):
+        """ checks the versions now instead of after the interval """
+        self._wake.set()
+
+    def start(self, delay=0):
+        """ :param delay: seconds before the first check, keeps the cpu free while the server starts """
+        if self.thread is None:
+            self.thread = Thread(target=self._run, args=(delay,), name="graphs", daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self, delay):
+        if self.context is not None:
+            with self.context():
+                self._loop(delay)
+        else:
+            self._loop(delay)
+
+    def _loop(self, delay):
+        self._wake.wait(delay)
+        self._wake.clear()
+        while True:
+            try:
+                self.render_changed()
+            except Exception as e:
+                self.failed += 1
+                log.error("Rendering graphs failed: %s", e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+# In-process ingest pipeline: producers (meter reader, /input) put readings
+# into a bounded queue, one consumer thread hands them to the storage stage.
+import logging
+import queue
+import time
+from threading import Lock, Thread
+
+import metrics
+
+log = logging.getLogger(__name__)
+handle_seconds = metrics.histogram("smartserver_ingest_handle_seconds", "time the storage stage takes per reading")
+
+
+class IngestQueue:
+    """ put() is called by producers and never blocks them,
+        the consumer thread calls handler(reading) for every reading
+    """
+    def __init__(self, handler, maxsize=1000, context=None):
+        """
+        :param handler: callable taking one reading dict
+        :param maxsize: readings buffered before the oldest get dropped
+        :param context: optional callable returning a context manager the
+                        consumer runs in (e.g. app.app_context)
+        """
+        self.handler = handler
+        self.context = context
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.thread = None
+        self.profiler = None    # a cProfile.Profile enabled around every handler call while set
+        self.profile_lock = Lock()
+        self._lock = Lock()
+
+    def put(self, reading, block=False) -> bool:
+        """ returns False if the queue was full and the oldest reading got dropped,
+            with block=True the producer waits instead (used for replays)
+        """
+        if block:
+            self.queue.put(reading)
+            return True
+        accepted = True
+        while True:
+            try:
+                self.queue.put_nowait(reading)
+                return accepted
+            except queue.Full:
+                accepted = False
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name="ingest", daemon=True)
+                self.thread.start()
+        return self
+
+    def join(self):
+        """ blocks until everything queued so far is handled """
+        self.queue.join()
+
+    def _run(self):
+        if self.context is not None:
+            with self.context():
+                self._consume()
+        else:
+            self._consume()
+
+    def _consume(self):
+        while True:
+            reading = self.queue.get()
+            t0 = time.perf_counter()
+            try:
+                if self.profiler is not None:
+                    self._profiled(reading)
+                else:
+                    self.handler(reading)
+                self.processed += 1
+                handle_seconds.observe(time.perf_counter() - t0)
+            except Exception as e:
+                self.failed += 1
+                log.error("Ingest of %s failed: %s", reading, e)
+            finally:
+                self.queue.task_done()
+
+    def _profiled(self, reading):
+        with self.profile_lock:
+            profiler = self.profiler
+            if profiler is None:
+                return self.handler(reading)
+            profiler.enable()
+            try:
+                return self.handler(reading)
+            finally:
+                profiler.disable()
+
+
+class NoAnswer(RuntimeError):
+    """ RemoteQueue.call() timed out """
+
+
+class RemoteQueue:
+    """ stands in for the IngestQueue in http worker processes: put() and
+        call() send to the ingest process, which runs serve()
+    """
+    def __init__(self, ctx, workers):
+        """
+        :param ctx: multiprocessing context, the queues are created before the workers fork
+        :param workers: number of worker processes, each gets its own reply queue
+        """
+        self.requests = ctx.Queue()
+        self.replies = [ctx.Queue() for _ in range(workers)]
+        self.worker = None
+        self.counter = 0
+        self._lock = Lock()
+
+    def bind(self, worker):
+        """ called in the worker process after the fork """
+        self.worker = worker
+        return self
+
+    def start(self):
+        return self
+
+    def put(self, reading, block=False) -> bool:
+        self.requests.put(("put", None, None, reading))
+        return True
+
+    def call(self, name, payload, timeout=60):
+        """ runs handlers[name](payload) in the ingest process and returns the result,
+            errors are raised as RuntimeError, NoAnswer after timeout seconds
+        """
+        with self._lock:
+            self.counter += 1
+            self.requests.put(("call", (self.worker, self.counter), name, payload))
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    request_id, ok, result = self.replies[self.worker].get(
+                        timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise NoAnswer("ingest process did not answer") from None
+                # replies of calls which timed out before arrive late, they are dropped
+                if request_id == self.counter:
+                    break
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def serve(self, ingest_queue, handlers, context=None):
+        """ ingest process side, blocks forever """
+        if context is not None:
+            with context():
+                self._serve(ingest_queue, handlers)
+        else:
+            self._serve(ingest_queue, handlers)
+
+    def _serve(self, ingest_queue, handlers):
+        while True:
+            kind, reply_to, name, payload = self.requests.get()
+            if kind == "put":
+                ingest_queue.put(payload)
+                continue
+            worker, request_id = reply_to
+            try:
+                result, ok = handlers[name](payload), True
+            except Exception as e:
+                result, ok = str(e), False
+            self.replies[worker].put((request_id, ok, result))
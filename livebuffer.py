@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+
+# Fixed-size ring buffers of the live power at several resolutions. Every
+# value is stored twice, at i and i + capacity, so the newest values are
+# always one contiguous slice and view() never has to copy. All rings live
+# in one numpy record which can sit in shared memory (see livestate.py).
+import datetime
+
+import numpy as np
+
+# name: (bucket seconds, 0 keeps every sample; capacity; seconds shown)
+RESOLUTIONS = {
+    "sample": (0, 600, 600),            # last 10 minutes
+    "minute": (60, 1440, 86400),        # last 24 hours
+    "quarter": (900, 672, 7 * 86400),   # last week
+}
+
+
+def _ring_dtype(capacity):
+    return np.dtype([("head", np.int64), ("count", np.int64), ("sum", np.float64), ("n", np.int64),
+                     ("ts", np.int64, 2 * capacity), ("power", np.float32, 2 * capacity)])
+
+
+layout = np.dtype([(name, _ring_dtype(capacity)) for name, (_, capacity, _) in RESOLUTIONS.items()])
+
+
+class LiveBuffers:
+    """ append() every reading, view() returns (ts, power) numpy views oldest first """
+    def __init__(self, buffer=None):
+        """ :param buffer: optional writable buffer of layout.itemsize bytes, e.g. shared memory """
+        if buffer is None:
+            self.data = np.zeros((), dtype=layout)
+        else:
+            self.data = np.ndarray((), dtype=layout, buffer=buffer)
+        self.late = 0
+
+    def append(self, ts, power) -> bool:
+        """
+        :param ts: epoch seconds of the sample
+        :param power: W
+        :return: True if a new minute started
+        """
+        new_minute = False
+        for name, (seconds, capacity, _) in RESOLUTIONS.items():
+            ring = self.data[name]
+            if not seconds:
+                self._push(ring, capacity, ts, power)
+                continue
+            start = ts - ts % seconds
+            last = ring["ts"][(ring["head"] - 1) % capacity] if ring["count"] else None
+            if last == start:
+                # the open bucket holds the mean so far
+                ring["sum"] += power
+                ring["n"] += 1
+                i = (ring["head"] - 1) % capacity
+                ring["power"][i] = ring["power"][i + capacity] = ring["sum"] / ring["n"]
+            elif last is None or start > last:
+                ring["sum"] = power
+                ring["n"] = 1
+                self._push(ring, capacity, start, power)
+                new_minute = new_minute or name == "minute"
+            else:
+                self.late += 1
+        return new_minute
+
+    def _push(self, ring, capacity, ts, power):
+        i = int(ring["head"])
+        ring["ts"][i] = ring["ts"][i + capacity] = ts
+        ring["power"][i] = ring["power"][i + capacity] = power
+        ring["head"] = (i + 1) % capacity
+        ring["count"] = min(int(ring["count"]) + 1, capacity)
+
+    def load(self, ts, power):
+        """ replaces the contents with the samples of numpy arrays ts (sorted) and power """
+        keep = ~np.isnan(power)
+        ts = np.asarray(ts, dtype=np.int64)[keep]
+        power = np.asarray(power, dtype=np.float64)[keep]
+        for name, (seconds, capacity, _) in RESOLUTIONS.items():
+            ring = self.data[name]
+            if seconds and len(ts):
+                starts = ts - ts % seconds
+                keys, idx, counts = np.unique(starts, return_index=True, return_counts=True)
+                sums = np.add.reduceat(power, idx)
+                ring["sum"] = sums[-1]
+                ring["n"] = counts[-1]
+                values = sums / counts
+            else:
+                keys, values = ts, power
+            keys, values = keys[-capacity:], values[-capacity:]
+            k = len(keys)
+            ring["ts"][:k] = ring["ts"][capacity:capacity + k] = keys
+            ring["power"][:k] = ring["power"][capacity:capacity + k] = values
+            ring["head"] = k % capacity
+            ring["count"] = k
+
+    def copy_from(self, other):
+        self.data[()] = other.data
+        self.late = other.late
+
+    def view(self, resolution, since=None) -> tuple:
+        """
+        :param resolution: "sample", "minute" or "quarter"
+        :param since: first epoch second, default the span of the resolution before the newest value
+        :return: (ts, power) views into the ring, valid until the next append()
+        """
+        _, capacity, span = RESOLUTIONS[resolution]
+        ring = self.data[resolution]
+        count = int(ring["count"])
+        end = int(ring["head"]) + capacity
+        ts = ring["ts"][end - count:end]
+        power = ring["power"][end - count:end]
+        if count:
+            if since is None:
+                since = ts[-1] - span + 1
+            lo = np.searchsorted(ts, since)
+            ts, power = ts[lo:], power[lo:]
+        return ts, power
+
+
+def chart_points(ts, power) -> list:
+    """ [{"time": "HH:MM", "power": W}, ...] as used by the power chart """
+    return [{"time": datetime.datetime.fromtimestamp(t).strftime("%H:%M"), "power": int(round(p))}
+            for t, p in zip(ts.tolist(), power.tolist())]
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+# Live values shared between the ingest process and the http workers in one
+# block of shared memory: a header, one record per meter and the live ring
+# buffers of every meter. Only the ingest process writes, from several
+# threads (ingest consumer, db writer callback, batches); its writers take
+# a process-local lock. A sequence counter (seqlock) lets readers detect a
+# write in progress and retry, so no lock has to be shared between the
+# processes.
+import datetime
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from threading import Lock
+
+import numpy as np
+
+import livebuffer
+
+header = np.dtype([
+    ("seq", np.uint64),             # odd while a write is in progress
+    ("version", np.uint64),         # data version for the response caches
+])
+layout = np.dtype([                 # one record per meter
+    ("power", np.float64),
+    ("dt", np.float64),             # epoch of the last reading, 0 if none yet
+    ("log_ts", np.int64),           # last raw row, log_ts 0 if none
+    ("energy1", np.float64),
+    ("energy2", np.float64),
+    ("log_power", np.float64),
+])
+
+
+def _number(value):
+    """ whole numbers as int, the templates print 800 W instead of 800.0 W """
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class LiveState:
+    """ write() in the ingest process, read() anywhere, forked workers inherit the object """
+    def __init__(self, meter_ids, name=None):
+        """
+        :param meter_ids: ids of the meters, in the same order in every process
+        :param name: attach to an existing block, None creates a new one
+        """
+        self.meter_ids = list(meter_ids)
+        n = len(self.meter_ids)
+        self.owner = name is None
+        if self.owner:
+            size = header.itemsize + n * (layout.itemsize + livebuffer.layout.itemsize)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.data = np.ndarray((), dtype=header, buffer=self.shm.buf)
+        self.records = np.ndarray((n,), dtype=layout, buffer=self.shm.buf, offset=header.itemsize)
+        start = header.itemsize + n * layout.itemsize
+        size = livebuffer.layout.itemsize
+        # meter id: livebuffer.LiveBuffers
+        self.buffers = {m: livebuffer.LiveBuffers(self.shm.buf[start + i * size:start + (i + 1) * size])
+                        for i, m in enumerate(self.meter_ids)}
+        self.index = {m: i for i, m in enumerate(self.meter_ids)}
+        self.lock = Lock()  # writers of this process, seq is a read-modify-write
+        if self.owner:
+            self.data[()] = np.zeros((), dtype=header)
+            self.records[:] = np.zeros(n, dtype=layout)
+            for buffers in self.buffers.values():
+                buffers.data[()] = np.zeros((), dtype=livebuffer.layout)
+
+    @contextmanager
+    def writing(self):
+        """ every change of the record or of the buffers happens inside this """
+        d = self.data
+        with self.lock:
+            d["seq"] += 1
+            try:
+                yield
+            finally:
+                d["version"] += 1
+                d["seq"] += 1
+
+    def write(self, meter_id, power, dt, last):
+        """
+        :param power: current power of the meter in W
+        :param dt: datetime of the last reading
+        :param last: last raw row dict (ts, energy1, energy2, power) or None
+        """
+        d = self.records[self.index[meter_id]]
+        with self.writing():
+            d["power"] = power or 0
+            d["dt"] = dt.timestamp() if dt is not None else 0
+            if last is not None:
+                d["log_ts"] = last["ts"]
+                d["energy1"] = last["energy1"]
+                d["energy2"] = last["energy2"]
+                d["log_power"] = last["power"] or 0
+
+    def bump(self):
+        """ marks the cached responses of all workers as stale """
+        with self.writing():
+            pass
+
+    def version(self) -> int:
+        return int(self.data["version"])
+
+    def _consistent(self, read):
+        """ returns read() of a moment without a write in progress """
+        delay = 0
+        while True:
+            seq = int(self.data["seq"])
+            if not seq % 2:
+                result = read()
+                if int(self.data["seq"]) == seq:
+                    return result
+            # a write takes microseconds, back off up to 1 ms instead of spinning
+            time.sleep(delay)
+            delay = min(0.001, delay * 2 or 0.00001)
+
+    def snapshot(self, meter_id):
+        """ consistent copy of the record of a meter """
+        record = self.records[self.index[meter_id]]
+        return self._consistent(record.copy)
+
+    def series(self, meter_id, resolution, since=None) -> tuple:
+        """ consistent copy of livebuffer.LiveBuffers.view() of a meter """
+        buffers = self.buffers[meter_id]
+        return self._consistent(lambda: tuple(a.copy() for a in buffers.view(resolution, since)))
+
+    def read(self, meter_id) -> dict:
+        """ the same values live_values() returns in the ingest process """
+        d = self.snapshot(meter_id)
+        dt = datetime.datetime.fromtimestamp(float(d["dt"])) if d["dt"] else None
+        last = None
+        if d["log_ts"]:
+            last = {"id": None, "ts": int(d["log_ts"]), "energy1": _number(d["energy1"]),
+                    "energy2": _number(d["energy2"]), "power": _number(d["log_power"])}
+        return {"power": _number(d["power"]), "dt": dt, "last": last}
+
+    def close(self):
+        self.data = None
+        self.records = None
+        self.buffers = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
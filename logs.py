@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+# Leveled logging for the server. The modules log through the standard
+# logging module; setup() installs one handler on the root logger whose
+# RateLimitFilter lets every message template through at most burst times
+# per interval, so a broken meter cannot flood stdout and journald with one
+# line per frame. The level comes from SMARTSERVER_LOG_LEVEL (default INFO).
+import logging
+import os
+import time
+from threading import Lock
+
+level = os.environ.get("SMARTSERVER_LOG_LEVEL", "INFO").upper()
+
+
+class RateLimitFilter(logging.Filter):
+    """ passes burst records per message template and interval, the next passed
+        record tells how many were suppressed in between
+    """
+    def __init__(self, burst=5, interval=60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}
+        self.suppressed = 0
+        self.lock = Lock()
+
+    def filter(self, record) -> bool:
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            start, passed, dropped = self.windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, passed = now, 0
+            if passed >= self.burst:
+                self.windows[key] = (start, passed, dropped + 1)
+                self.suppressed += 1
+                return False
+            self.windows[key] = (start, passed + 1, 0)
+        if dropped:
+            record.msg = "%s (%d similar messages suppressed)" % (record.msg, dropped)
+        return True
+
+
+rate_limit = RateLimitFilter()
+_handler = None
+
+
+def setup(level=level, burst=5, interval=60):
+    """ configures the root logger once, later calls only change the level """
+    global _handler
+    root = logging.getLogger()
+    if _handler is None:
+        rate_limit.burst = burst
+        rate_limit.interval = interval
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        _handler.addFilter(rate_limit)
+        root.addHandler(_handler)
+    root.setLevel(level)
+    # werkzeug writes one line per request, only below INFO they are wanted
+    logging.getLogger("werkzeug").setLevel(logging.DEBUG if level == "DEBUG" else logging.WARNING)
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+
+# Meter sources: everything that produces readings in the form
+# {"timestamp": datetime, "energyNT": kWh, "energyHT": kWh, "power": W}
+# One server can read several meters, each source is configured under a
+# meter id which the readings carry on into storage and the event stream.
+import datetime
+import json
+import logging
+import os
+import random
+import re
+import time
+from math import ceil
+
+import metrics
+import sml
+
+log = logging.getLogger(__name__)
+DEFAULT_METER = "main"      # id of the rows stored before there were several meters
+frames = metrics.counter("smartserver_sml_frames_total", "SML frames by decode result", labels=("result",))
+decode_seconds = metrics.histogram("smartserver_sml_decode_seconds", "time to decode one SML frame",
+                                   buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+
+
+def decode(frame, obis=None) -> dict:
+    """ reading of a raw frame, counted and timed; raises sml.SmlError
+    :param obis: optional {field: OBIS key}, see sml.reading()
+    """
+    t0 = time.perf_counter()
+    try:
+        reading = sml.reading(sml.decode_frame(frame), obis)
+    except sml.SmlError:
+        frames.inc(result="failed")
+        raise
+    decode_seconds.observe(time.perf_counter() - t0)
+    frames.inc(result="decoded")
+    return reading
+
+
+class MeterSource:
+    """ readings() yields one reading dict per meter frame.
+        speed scales the delay between readings: 1 is real time,
+        1000 replays 1000x faster and 0 runs as fast as possible
+    """
+    def __init__(self, delay=10, speed=1):
+        self.delay = delay
+        self.speed = speed
+
+    def readings(self):
+        raise NotImplementedError
+
+    def wait(self, seconds):
+        if self.speed and seconds > 0:
+            time.sleep(seconds / self.speed)
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return self.readings()
+
+
+class SerialSource(MeterSource):
+    """ reads SML frames from the optical interface of the meter """
+    def __init__(self, device='/dev/ttyUSB0', delay=10, baudrate=9600, obis=None):
+        super().__init__(delay=delay, speed=1)
+        self.device = device
+        self.baudrate = baudrate
+        self.obis = obis
+        self.port = None
+        self.frames_failed = 0
+
+    def open(self):
+        import serial
+        self.port = serial.Serial(
+            port=self.device,
+            baudrate=self.baudrate,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1
+        )
+
+    def readings(self):
+        if self.port is None:
+            self.open()
+        for frame in sml.read_frames(self.port):
+            try:
+                reading = decode(frame, self.obis)
+            except sml.SmlError as e:
+                self.frames_failed += 1
+                log.warning("SML frame dropped on %s: %s", self.device, e)
+                continue
+            reading["timestamp"] = datetime.datetime.now().replace(microsecond=0)
+            yield reading
+            self.wait(self.delay)
+            # frames queued up while waiting are stale, start over with the next one
+            self.port.reset_input_buffer()
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+
+class SimulatorSource(MeterSource):
+    """ random power values, counters continue from start_values()
+        start_values: callable returning {"energy1": kWh, "energy2": kWh} or None
+        start: first timestamp for a virtual clock, None uses the wall clock
+    """
+    def __init__(self, delay=20, speed=1, start_values=None, start=None, count=None):
+        super().__init__(delay=delay, speed=speed)
+        self.start_values = start_values
+        self.start = start
+        self.count = count
+
+    def readings(self):
+        q = self.start_values() if self.start_values else None
+        if not q:
+            q = {"energy1": 1110, "energy2": 2220}
+        energy1 = q["energy1"]
+        energy2 = q["energy2"]
+        # the virtual clock counts epoch seconds, local times would repeat or skip hours at dst changes
+        t = int(self.start.timestamp()) if self.start is not None else None
+        n = 0
+        while self.count is None or n < self.count:
+            if t is None:
+                dt = datetime.datetime.now().replace(microsecond=0)
+            else:
+                dt = datetime.datetime.fromtimestamp(t)
+            power = ceil(random.random() * 1000)
+            used = power / 1000 * self.delay / 3600
+            energy1 += used
+            energy2 += used
+            yield {"timestamp": dt, "energyNT": energy1, "energyHT": energy2, "power": power}
+            n += 1
+            if t is not None:
+                t += self.delay
+            self.wait(self.delay)
+
+
+class CaptureSource(MeterSource):
+    """ replays a recorded capture
+        - hex frame dumps like textscratch.txt (one frame per line); these carry
+          no time, readings are spaced by delay starting at start (default now)
+        - JSON lines in the /input record shape
+          {"timestamp": iso, "energyNT": kWh, "energyHT": kWh, "power": W};
+          the gaps between timestamps are replayed scaled by speed
+        loop repeats the capture, shifting timestamps so time keeps increasing
+    """
+    def __init__(self, path, delay=10, speed=0, start=None, loop=False, obis=None):
+        super().__init__(delay=delay, speed=speed)
+        self.path = path
+        self.start = start
+        self.loop = loop
+        self.obis = obis
+        self.frames_failed = 0
+
+    def _is_json(self):
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    return line.startswith('{')
+        return False
+
+    def _hex_readings(self):
+        for frame in sml.frames_from_hexdump(self.path):
+            try:
+                yield decode(frame, self.obis)
+            except sml.SmlError:
+                self.frames_failed += 1
+
+    def _json_readings(self):
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    record["timestamp"] = datetime.datetime.fromisoformat(record["timestamp"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                yield record
+
+    def readings(self):
+        is_json = self._is_json()
+        # times are kept as epoch seconds, stepping local times breaks at dst changes
+        offset = 0
+        t = (self.start or datetime.datetime.now().replace(microsecond=0)).timestamp()
+        last = None
+        while True:
+            first = None
+            for reading in (self._json_readings() if is_json else self._hex_readings()):
+                if is_json:
+                    ts = reading["timestamp"].timestamp()
+                    if first is None:
+                        first = ts
+                    ts += offset
+                else:
+                    ts = t
+                    t += self.delay
+                reading["timestamp"] = datetime.datetime.fromtimestamp(ts)
+                if last is not None:
+                    self.wait(ts - last)
+                last = ts
+                yield reading
+            if not self.loop or last is None:
+                break
+            if is_json:
+                offset = last + self.delay - first
+
+
+def make_source(spec, delay=10, start_values=None, obis=None) -> MeterSource:
+    """
+    :param spec: "serial[:device]", "simulator[@speed]", "replay:path[@speed]" or "auto"
+    :param delay: sensor delay in seconds
+    :param start_values: passed to SimulatorSource
+    :param obis: optional {field: OBIS key} for the frames of serial and hex capture sources
+    :return: MeterSource
+
+    speed is a factor like 10 or 1000, "max" or 0 replays as fast as possible
+    """
+    spec = spec or "auto"
+    speed = None
+    if '@' in spec:
+        spec, speed = spec.rsplit('@', 1)
+        speed = 0 if speed == "max" else float(speed)
+    kind, _, arg = spec.partition(':')
+    if kind == "auto":
+        if os.path.exists('/dev/ttyUSB0'):
+            kind = "serial"
+        else:
+            kind = "simulator"
+    if kind == "serial":
+        return SerialSource(device=arg or '/dev/ttyUSB0', delay=delay, obis=obis)
+    if kind == "simulator":
+        speed = 1 if speed is None else speed
+        # anything but real time runs on a virtual clock
+        start = None if speed == 1 else datetime.datetime.now().replace(microsecond=0)
+        return SimulatorSource(delay=delay * 2, speed=speed, start_values=start_values, start=start)
+    if kind == "replay":
+        return CaptureSource(arg, delay=delay, speed=0 if speed is None else speed, obis=obis)
+    raise ValueError("unknown meter source '%s'" % spec)
+
+
+def parse_meters(spec) -> dict:
+    """
+    :param spec: "id=source,id=source", e.g. "main=serial:/dev/ttyUSB0,pv=serial:/dev/ttyUSB1";
+                 a single source without an id is the DEFAULT_METER
+    :return: {meter id: source spec} in the order given
+    """
+    meters = {}
+    for item in (spec or "auto").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        meter_id, sep, source = item.partition("=")
+        if not sep:
+            meter_id, source = DEFAULT_METER, item
+        meter_id = meter_id.strip()
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,32}", meter_id):
+            raise ValueError("invalid meter id '%s'" % meter_id)
+        if meter_id in meters:
+            raise ValueError("meter '%s' is configured twice" % meter_id)
+        meters[meter_id] = source.strip()
+    return meters or {DEFAULT_METER: "auto"}
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+# Process-local metrics in the Prometheus text format (version 0.0.4).
+# Counters and histograms are plain numbers behind one lock, so updating
+# them on the hot paths costs about a microsecond. Metrics can also read
+# their value from a callback at scrape time, e.g. the depth of a queue or
+# a counter some object keeps anyway. render() returns the scrape text.
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a fast db commit to a slow graph render
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """ values keyed by the tuple of label values, function() replaces them at scrape time """
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), function=None):
+        """
+        :param labels: names of the labels, values are passed as keyword arguments
+        :param function: optional callable returning the value, or {label values tuple: value}
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function
+        self.values = {}
+        self.lock = Lock()
+
+    def _key(self, labels) -> tuple:
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self) -> list:
+        """ [(name suffix, label values, value), ...] """
+        if self.function is not None:
+            value = self.function()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        return [("", key, value) for key, value in items if value is not None]
+
+    def render(self, extra=None) -> str:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        for suffix, key, value in self.samples():
+            names = self.labels + (("le",) if suffix == "_bucket" else ())
+            lines.append("%s%s%s %s" % (self.name, suffix, _labels(names, key, extra), _number(value)))
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self) -> list:
+        with self.lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self.values.items()]
+        samples = []
+        for key, counts, total, n in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", key + (_number(bound),), cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, n))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """ returns the metric registered under the same name first, modules may be reloaded """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self, include=None, labels=None) -> str:
+        """
+        :param include: optional callable(name) -> bool selecting the metrics
+        :param labels: optional {name: value} added to every sample
+        """
+        return "".join(m.render(labels) for name, m in sorted(self.metrics.items())
+                       if include is None or include(name))
+
+
+registry = Registry()
+
+
+def counter(name, help, labels=(), function=None) -> Counter:
+    return registry.register(Counter(name, help, labels, function))
+
+
+def gauge(name, help, labels=(), function=None) -> Gauge:
+    return registry.register(Gauge(name, help, labels, function))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def render(include=None, labels=None) -> str:
+    return registry.render(include, labels)
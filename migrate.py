@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+# One-shot schema upgrades for existing power.db files.
+# - ISO string "timestamp" columns become indexed integer epoch "ts" columns
+# - columns added to the models later are added to old tables, existing rows
+#   get the server default of the column (e.g. meter_id "main")
+# - derived tables (e.g. the day reports) are created again when their
+#   columns changed, the server computes their rows again
+# - indexes the models created before ("ix_" names) but declare no longer
+#   are dropped, e.g. the single-column ts indexes replaced by (meter_id, ts)
+import logging
+import sys
+
+from sqlalchemy import inspect, text
+
+log = logging.getLogger(__name__)
+
+
+def _columns(conn, name) -> list:
+    return [c["name"] for c in inspect(conn).get_columns(name)]
+
+
+def _convert_timestamp(conn, table):
+    """ rebuilds table with an integer ts column, timestamps are local time """
+    old = table.name + "_old"
+    conn.execute(text('ALTER TABLE "%s" RENAME TO "%s"' % (table.name, old)))
+    table.create(conn)
+    old_cols = _columns(conn, old)
+    copy = [c.name for c in table.columns if c.name in old_cols and c.name != "ts"]
+    conn.execute(text(
+        'INSERT INTO "{t}" ({cols}, ts) SELECT {cols}, CAST(strftime(\'%s\', timestamp, \'utc\') AS INTEGER) '
+        'FROM "{old}" WHERE timestamp IS NOT NULL'.format(t=table.name, old=old, cols=", ".join(copy))))
+    conn.execute(text('DROP TABLE "%s"' % old))
+
+
+def _add_missing_columns(conn, table):
+    existing = _columns(conn, table.name)
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = 'ALTER TABLE "%s" ADD COLUMN "%s" %s' % (table.name, column.name,
+                                                       column.type.compile(dialect=conn.dialect))
+        if column.server_default is not None:
+            default = conn.dialect.ddl_compiler(conn.dialect, None).get_column_default_string(column)
+            ddl += " DEFAULT %s" % default
+            if not column.nullable:
+                ddl += " NOT NULL"
+        conn.execute(text(ddl))
+        log.info("Added column %s.%s", table.name, column.name)
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _drop_obsolete_indexes(conn, table):
+    declared = {index.name for index in table.indexes}
+    for index in inspect(conn).get_indexes(table.name):
+        if index["name"].startswith("ix_") and index["name"] not in declared:
+            conn.execute(text('DROP INDEX "%s"' % index["name"]))
+            log.info("Dropped index %s of %s", index["name"], table.name)
+
+
+def upgrade(engine, metadata, derived=()) -> bool:
+    """
+    :param engine: sqlalchemy engine of the power db
+    :param metadata: MetaData of the current models
+    :param derived: names of tables which are dropped and created again instead of being altered
+    :return: True if a table had to be converted
+    """
+    converted = False
+    with engine.begin() as conn:
+        tables = inspect(conn).get_table_names()
+        for table in metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            cols = _columns(conn, table.name)
+            if "timestamp" in cols and "ts" not in cols and "ts" in table.columns:
+                log.info("Converting %s to epoch timestamps", table.name)
+                _convert_timestamp(conn, table)
+                converted = True
+            elif table.name in derived and set(table.columns.keys()) - set(cols):
+                log.info("Recreating %s, its rows are computed again", table.name)
+                table.drop(conn)
+                table.create(conn)
+            else:
+                _add_missing_columns(conn, table)
+                _drop_obsolete_indexes(conn, table)
+    if converted and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    return converted
+
+
+if __name__ == "__main__":
+    import os
+    if len(sys.argv) > 1:
+        os.environ["SMARTSERVER_DB"] = os.path.abspath(sys.argv[1])
+    import smartserver
+    smartserver.create_app()
+    print("Schema is up to date")
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# SVG geometry of the live power charts. A chart keeps the scaled y value and
+# the tick label of every point it shows; new samples only add or change the
+# last points and the svg fragment is rebuilt once after a change, requests
+# get the cached string.
+import datetime
+from collections import deque
+from math import sqrt
+
+# screen_resolution: (width, height) of a chart in svg units
+SIZES = {"low": (800, 300), "high": (1600, 600)}
+# seconds between tick labels per ring buffer resolution
+LABEL_PERIOD = {"sample": 60, "minute": 300, "quarter": 3600}
+# grid lines of the sqrt scaled power axis in W
+GRID = (100, 200, 500, 1000, 2000, 5000, 10000, 15000, 20000)
+
+
+class PowerChart:
+    """ sync() with the newest values of a ring buffer, fragment() returns labels and polyline """
+    def __init__(self, resolution, points=60, width=800, height=300):
+        """
+        :param resolution: livebuffer resolution the chart shows
+        :param points: number of points on the x axis
+        """
+        self.resolution = resolution
+        self.width = width
+        self.height = height
+        self.period = LABEL_PERIOD.get(resolution, 300)
+        step = width / points
+        self.xs = ["%d" % int(i * step) for i in range(points)]
+        self.ts = deque(maxlen=points)
+        self.ys = deque(maxlen=points)
+        self.labels = deque(maxlen=points)
+        self.version = 0
+        self._points = None
+        self._fragment = None
+        self.grid = self.grid_svg()
+
+    def scale(self, power) -> int:
+        """ y of a power value, square root scale like the grid of powerchart.html """
+        return self.height - int(sqrt(max(power, 0)) * 2 * self.height / 300)
+
+    def since(self):
+        """ ts of the newest point, the ring buffer only has to return values from there on """
+        return self.ts[-1] if self.ts else None
+
+    def sync(self, ts, power) -> bool:
+        """
+        :param ts: numpy array of bucket starts, oldest first
+        :param power: numpy array of the values
+        :return: True if the chart changed
+        """
+        changed = False
+        n = self.ts.maxlen
+        for t, p in zip(ts[-n:].tolist(), power[-n:].tolist()):
+            y = self.scale(p)
+            if self.ts and t <= self.ts[-1]:
+                # the open bucket of the ring buffer changes until it is closed
+                if t == self.ts[-1] and y != self.ys[-1]:
+                    self.ys[-1] = y
+                    changed = True
+                continue
+            first = not self.ts or t // self.period != self.ts[-1] // self.period
+            self.labels.append(datetime.datetime.fromtimestamp(t).strftime("%H:%M") if first else ".")
+            self.ts.append(t)
+            self.ys.append(y)
+            changed = True
+        if changed:
+            self.version += 1
+            self._points = None
+            self._fragment = None
+        return changed
+
+    def points(self) -> str:
+        """ the points attribute of the polyline """
+        if self._points is None:
+            self._points = " ".join("%s,%d" % xy for xy in zip(self.xs, self.ys))
+        return self._points
+
+    def label_svg(self) -> str:
+        y = self.height + 15
+        return "".join('<text x="%s" y="%d">%s</text>' % (x, y, label) for x, label in zip(self.xs, self.labels))
+
+    def fragment(self) -> str:
+        """ tick labels and polyline, embedded by powerchart.html """
+        if self._fragment is None:
+            self._fragment = ('<g class="chart-text chart-labels">%s</g>'
+                              '<polyline style="stroke: #306f91; stroke-width: %d" fill="none" class="PWR" '
+                              'points="%s" />' % (self.label_svg(), 4 * self.height // 300, self.points()))
+        return self._fragment
+
+    def grid_svg(self) -> str:
+        """ title, grid lines and power axis, they only depend on the size """
+        lines = "".join('<line x1="0" y1="%d" x2="%d" y2="%d" />' % (self.scale(p), self.width, self.scale(p))
+                        for p in GRID)
+        axis = "".join('<text x="%d" y="%d" text-anchor="end">%s</text>'
+                       % (self.width - 5, self.scale(p) - 4, "{:,}".format(p).replace(",", ".")) for p in GRID)
+        return ('<g class="chart-text"><text x="10" y="12">Current Power</text>'
+                '<text x="%d" y="12" text-anchor="end">W</text></g>'
+                '<g class="chart-grid">%s</g><g class="chart-text">%s</g>' % (self.width - 5, lines, axis))
+
+    def svg(self) -> str:
+        """ standalone svg document """
+        return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">'
+                '<style>.chart-grid{stroke:#ccc;stroke-width:1}.chart-text{font:12px sans-serif;fill:#888}</style>'
+                '%s%s</svg>' % (self.width, self.height + 20, self.width, self.height + 20,
+                                self.grid, self.fragment()))
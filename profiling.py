@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+# On-demand profiling on the device. RequestProfile profiles one request
+# with cProfile or by sampling its thread; Sampler samples named threads
+# (ingest, dbwriter, meter) for some seconds and counts collapsed stacks,
+# the format of flamegraph.pl and speedscope. Nothing runs while no profile
+# was asked for. Results are written to files in a directory, the name is
+# returned so the client knows what to fetch.
+import cProfile
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+FORMATS = ("cprofile", "collapsed")
+
+
+def filename(directory, kind, label="", extension="prof") -> str:
+    """ new file path like directory/request-20261017-214501-123-home.prof """
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+    label = re.sub(r"[^A-Za-z0-9_.]+", "_", label).strip("_")
+    name = "-".join(p for p in (kind, stamp, str(os.getpid()), label) if p)
+    return os.path.join(directory, "%s.%s" % (name, extension))
+
+
+def frame_name(code) -> str:
+    return "%s:%s" % (os.path.basename(code.co_filename).rsplit(".", 1)[0], code.co_name)
+
+
+def collapsed(counts) -> str:
+    """ one "root;child;leaf count" line per stack """
+    return "".join("%s %d\n" % (stack, n) for stack, n in counts.most_common())
+
+
+class Sampler:
+    """ start() samples the stacks of the selected threads every interval seconds
+        in a background thread, stop() returns a Counter of collapsed stacks
+    """
+    def __init__(self, names=None, idents=None, interval=0.005):
+        """
+        :param names: thread names to sample
+        :param idents: thread idents to sample, e.g. the thread of a request
+        """
+        self.names = set(names or ())
+        self.idents = set(idents or ())
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self.thread = None
+
+    def _selected(self) -> dict:
+        threads = {t.ident: t.name for t in threading.enumerate()
+                   if t.name in self.names or t.ident in self.idents}
+        threads.pop(threading.get_ident(), None)
+        return threads
+
+    def sample(self):
+        threads = self._selected()
+        frames = sys._current_frames()
+        for ident, name in threads.items():
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.append(name)
+                self.counts[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.counts
+
+
+class RequestProfile:
+    """ start() before the view, finish() after it writes the file and returns its path """
+    def __init__(self, directory, fmt="cprofile", label="", interval=0.001):
+        self.directory = directory
+        self.fmt = fmt if fmt in FORMATS else "cprofile"
+        self.label = label
+        self.profiler = None
+        self.sampler = None
+        self.interval = interval
+
+    def start(self):
+        if self.fmt == "collapsed":
+            self.sampler = Sampler(idents=[threading.get_ident()], interval=self.interval).start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def finish(self) -> str:
+        if self.sampler is not None:
+            path = filename(self.directory, "request", self.label, "txt")
+            with open(path, "w") as f:
+                f.write(collapsed(self.sampler.stop()))
+        else:
+            self.profiler.disable()
+            path = filename(self.directory, "request", self.label)
+            self.profiler.dump_stats(path)
+        return path
+
+
+def sample_threads(directory, names, seconds, interval=0.005) -> str:
+    """ samples the named threads for seconds in the background, returns the file written then """
+    path = filename(directory, "threads", "_".join(sorted(names)), "txt")
+    sampler = Sampler(names=names, interval=interval)
+
+    def run():
+        sampler.start()
+        time.sleep(seconds)
+        counts = sampler.stop()
+        with open(path, "w") as f:
+            f.write(collapsed(counts))
+    threading.Thread(target=run, name="sampler-timer", daemon=True).start()
+    return path
+
+
+def profile_queue(directory, queue, seconds) -> str:
+    """
+    cProfile of the consumer of an ingest.IngestQueue for seconds, in the background
+    :return: the file written then
+    Raises RuntimeError if the queue is being profiled already.
+    """
+    if queue.profiler is not None:
+        raise RuntimeError("the ingest thread is being profiled already")
+    path = filename(directory, "ingest")
+    profiler = queue.profiler = cProfile.Profile()
+
+    def run():
+        time.sleep(seconds)
+        queue.profiler = None
+        # the consumer may be inside a reading, it leaves the profiler alone after that
+        with queue.profile_lock:
+            profiler.dump_stats(path)
+    threading.Thread(target=run, name="profile-timer", daemon=True).start()
+    return path
@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+
+# Append-only binary store for the raw samples of one meter, used instead
+# of the power_log table when SMARTSERVER_RAW_BACKEND=mmap. The file is a
+# 32 byte header followed by fixed-size records (ts, energy1, energy2,
+# power) ordered by ts. Reads map the file and look at it as a numpy
+# structured array: a range is two binary searches and a slice of the
+# mapping, nothing is copied or turned into row objects. An append writes
+# the records first and the record count in the header afterwards, readers
+# only look at counted records, also those in other processes (the http
+# workers of serve.py). The file is synced at most every sync_interval
+# seconds and on close(), like the db with synchronous=NORMAL a power cut
+# loses the samples of the last sync_interval seconds at most; a count
+# which reached the disk before its records is cut back on open. Counted
+# records are never changed in place: older samples and retention write a
+# new file, readers notice the new inode. The rollup tables stay in the db.
+# Usage: python rawstore.py [path/to/power.db]   copies the power_log rows of every meter into its store,
+#        run it while the server is stopped
+import logging
+import mmap
+import os
+import sys
+import time
+from threading import Lock
+
+import numpy as np
+
+MAGIC = b"SMRAW001"
+header = np.dtype([("magic", "S8"), ("count", "<u8"), ("record_size", "<u4"), ("reserved", "V12")])
+record = np.dtype([("ts", "<i8"), ("energy1", "<f8"), ("energy2", "<f8"), ("power", "<f8")])
+FIELDS = record.names
+_COUNT = header.fields["count"][1]
+
+log = logging.getLogger(__name__)
+
+
+def records_of(ts, energy1, energy2, power) -> np.ndarray:
+    """ record array of columns, a power of None becomes NaN """
+    data = np.empty(len(ts), dtype=record)
+    data["ts"] = ts
+    data["energy1"] = energy1
+    data["energy2"] = energy2
+    data["power"] = np.asarray(power, dtype=np.float64)
+    return data
+
+
+class RawStore:
+    """ one process appends, any process reads; records are unique by ts """
+    def __init__(self, path, sync_interval=10.0):
+        """
+        :param path: file of the store, created if missing
+        :param sync_interval: seconds between two fsyncs of appended records, 0 syncs every append
+        """
+        self.path = path
+        self.lock = Lock()
+        self.sync_interval = sync_interval
+        self.synced = time.monotonic()
+        self.rewrites = 0   # appends older than the last record, they rewrite the file
+        self._open()
+        self._repair()
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._write_file(np.empty(0, dtype=record))
+        self.fd = os.open(self.path, os.O_RDWR)
+        self.inode = os.fstat(self.fd).st_ino
+        head = np.frombuffer(os.pread(self.fd, header.itemsize, 0), dtype=header)
+        if len(head) != 1 or head["magic"][0] != MAGIC or head["record_size"][0] != record.itemsize:
+            os.close(self.fd)
+            raise ValueError("%s is no raw sample store" % self.path)
+        self._map = None
+        self._records = np.empty(0, dtype=record)
+
+    def _repair(self):
+        """ cuts the count back to the records which were written completely and in ts order,
+            after a power cut the count may cover records which never reached the disk
+        """
+        count = self._count()
+        stored = (os.fstat(self.fd).st_size - header.itemsize) // record.itemsize
+        valid = min(count, stored)
+        if valid:
+            ts = np.frombuffer(os.pread(self.fd, valid * record.itemsize, header.itemsize), dtype=record)["ts"]
+            unordered = np.flatnonzero(ts[1:] <= ts[:-1])
+            if len(unordered):
+                valid = int(unordered[0]) + 1
+        if valid != count:
+            log.warning("%s: counted %d records, %d are valid, the rest is dropped", self.path, count, valid)
+            self._set_count(valid)
+            os.fsync(self.fd)
+
+    def _write_file(self, data):
+        """ writes a new file with data and replaces the store by it """
+        head = np.zeros(1, dtype=header)
+        head["magic"] = MAGIC
+        head["count"] = len(data)
+        head["record_size"] = record.itemsize
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(head.tobytes())
+            f.write(data.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _count(self) -> int:
+        return int(np.frombuffer(os.pread(self.fd, 8, _COUNT), dtype="<u8")[0])
+
+    def _set_count(self, count):
+        os.pwrite(self.fd, np.array([count], dtype="<u8").tobytes(), _COUNT)
+
+    def _view(self) -> np.ndarray:
+        """ the counted records, the caller holds the lock """
+        if os.stat(self.path).st_ino != self.inode:
+            # drop_before() of the appending process wrote a new file
+            os.close(self.fd)
+            self._open()
+        count = self._count()
+        if count != len(self._records):
+            size = header.itemsize + count * record.itemsize
+            if self._map is None or len(self._map) < size:
+                # the old mapping goes away with the last array using it
+                self._map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+                count = min(count, (len(self._map) - header.itemsize) // record.itemsize)
+            self._records = np.frombuffer(self._map, dtype=record, count=count, offset=header.itemsize)
+        return self._records
+
+    def __len__(self):
+        return len(self.records())
+
+    def records(self) -> np.ndarray:
+        """ all records as a read-only array on the mapping, oldest first """
+        with self.lock:
+            return self._view()
+
+    def range(self, start=None, end=None) -> np.ndarray:
+        """ records in [start, end) (epoch seconds, None is open) as a slice of the mapping """
+        data = self.records()
+        lo = 0 if start is None else np.searchsorted(data["ts"], start)
+        hi = len(data) if end is None else np.searchsorted(data["ts"], end)
+        return data[lo:hi]
+
+    def query(self, start=None, end=None) -> dict:
+        """ like archive.query_db(): dict of the columns ts, energy1, energy2, power as views """
+        data = self.range(start, end)
+        return {k: data[k] for k in FIELDS}
+
+    def last(self):
+        """ the newest record as a dict like a power_log row, None if empty """
+        data = self.records()
+        if not len(data):
+            return None
+        row = dict(zip(FIELDS, data[-1].tolist()))
+        if row["power"] != row["power"]:
+            row["power"] = None
+        return row
+
+    def chunks(self, chunk_size=200000):
+        """ yields (ts, energy1, energy2, power) arrays like rebuild.read_chunks() """
+        data = self.records()
+        for i in range(0, len(data), chunk_size):
+            part = data[i:i + chunk_size]
+            yield tuple(part[k] for k in FIELDS)
+
+    def append(self, ts, energy1, energy2, power=None):
+        self.extend(records_of([ts], [energy1], [energy2], [power]))
+
+    def extend(self, data):
+        """
+        :param data: array of record in any order
+
+        Records newer than the last one are written behind it before the
+        count covers them, the file is synced if sync_interval has passed
+        since the last sync. Older ones are merged with the
+        records after them into a new file, a record replaces one with the
+        same ts; the arrays readers hold keep the old file.
+        """
+        if not len(data):
+            return
+        if len(data) > 1:
+            _, idx = np.unique(data["ts"], return_index=True)
+            data = data[idx]
+        with self.lock:
+            current = self._view()
+            count = len(current)
+            if not count or data["ts"][0] > current["ts"][-1]:
+                os.pwrite(self.fd, data.tobytes(), header.itemsize + count * record.itemsize)
+                self._set_count(count + len(data))
+                if time.monotonic() - self.synced >= self.sync_interval:
+                    self._sync()
+                return
+            self.rewrites += 1
+            lo = int(np.searchsorted(current["ts"], data["ts"][0]))
+            merged = np.concatenate((data, current[lo:]))
+            _, idx = np.unique(merged["ts"], return_index=True)
+            self._replace(np.concatenate((current[:lo], merged[idx])))
+
+    def drop_before(self, cutoff) -> int:
+        """ removes the records before cutoff by writing a new file, returns their number """
+        with self.lock:
+            current = self._view()
+            n = int(np.searchsorted(current["ts"], cutoff))
+            if n:
+                self._replace(current[n:])
+            return n
+
+    def _replace(self, data):
+        """ writes data into a new file and switches to it, the caller holds the lock """
+        self._write_file(data)
+        os.close(self.fd)
+        self._open()
+        self.synced = time.monotonic()
+
+    def _sync(self):
+        os.fsync(self.fd)
+        self.synced = time.monotonic()
+
+    def sync(self):
+        """ writes the appended records to the disk """
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self._records = np.empty(0, dtype=record)
+            self._map = None
+            os.close(self.fd)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        os.environ["SMARTSERVER_DB"] = os.path.abspath(sys.argv[1])
+    os.environ["SMARTSERVER_RAW_BACKEND"] = "db"
+    import rebuild
+    import smartserver
+    smartserver.create_app()
+    smartserver.writer.flush()
+    with smartserver.db.engine.connect() as conn:
+        for meter_id in smartserver.meters:
+            store = RawStore(smartserver.raw_path(meter_id))
+            before = len(store)
+            for ts, e1, e2, power in rebuild.read_chunks(conn, smartserver.PowerLog.__table__, 200000, meter_id):
+                store.extend(records_of(ts, e1, e2, power))
+            store.sync()
+            print("Copied %d samples of meter %s into %s" % (len(store) - before, meter_id, store.path))
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+# Rebuilds the rollup tables from the raw power log in one vectorized pass.
+# The power log is streamed in chunks into numpy arrays and reduced to
+# minute buckets; hours, days and months are reduced from the minutes.
+# With the mmap raw backend the chunks are slices of the raw store.
+# Every meter is rebuilt on its own.
+# Usage: python rebuild.py [path/to/power.db] [chunk size]
+import sys
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+import archive
+from meter import DEFAULT_METER
+from rollup import RESOLUTIONS
+from timeutil import bucket_keys, key_starts, local_offsets
+
+
+def reduce_runs(keys):
+    """ start index of every run of equal consecutive keys """
+    return np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+
+
+def minute_aggregates(ts, local, e1, e2, power) -> dict:
+    """ aggregates of consecutive samples falling into the same local minute """
+    keys = bucket_keys(local, "minute")
+    idx = reduce_runs(keys)
+    last = np.append(idx[1:], len(ts)) - 1
+    valid = ~np.isnan(power)
+    count = np.add.reduceat(valid.astype(np.int64), idx)
+    return {"key": keys[idx], "ts": ts[idx], "local": local[idx],
+            "open1": e1[idx], "open2": e2[idx], "close1": e1[last], "close2": e2[last],
+            "min": np.minimum.reduceat(np.where(valid, power, np.inf), idx),
+            "max": np.maximum.reduceat(np.where(valid, power, -np.inf), idx),
+            "sum": np.add.reduceat(np.where(valid, power, 0.0), idx),
+            "count": count}
+
+
+def combine(agg, resolution) -> dict:
+    """ reduces minute aggregates to the buckets of resolution """
+    keys = bucket_keys(agg["local"], resolution) if resolution != "minute" else agg["key"]
+    idx = reduce_runs(keys)
+    last = np.append(idx[1:], len(keys)) - 1
+    return {"key": keys[idx], "ts": agg["ts"][idx], "local": agg["local"][idx],
+            "open1": agg["open1"][idx], "open2": agg["open2"][idx],
+            "close1": agg["close1"][last], "close2": agg["close2"][last],
+            "min": np.minimum.reduceat(agg["min"], idx), "max": np.maximum.reduceat(agg["max"], idx),
+            "sum": np.add.reduceat(agg["sum"], idx), "count": np.add.reduceat(agg["count"], idx)}
+
+
+def to_rows(agg, resolution) -> list:
+    """ rollup rows like rollup.Bucket.row(); the last bucket is left open for the live engine """
+    n = len(agg["key"]) - 1
+    if n <= 0:
+        return []
+    start = agg["ts"] - (agg["local"] - key_starts(agg["key"], resolution))
+    # consumption counts from the close of the previous bucket, like the live engine
+    prev1 = np.concatenate((agg["open1"][:1], agg["close1"][:-1]))
+    prev2 = np.concatenate((agg["open2"][:1], agg["close2"][:-1]))
+    count = agg["count"]
+    has_power = count > 0
+    avg = np.where(has_power, agg["sum"] / np.maximum(count, 1), np.nan)
+    columns = {"ts": start, "energy1": agg["close1"], "energy2": agg["close2"],
+               "used1": agg["close1"] - prev1, "used2": agg["close2"] - prev2,
+               "power_min": np.where(has_power, agg["min"], np.nan),
+               "power_max": np.where(has_power, agg["max"], np.nan),
+               "power_avg": avg, "samples": count}
+    lists = {k: v[:n].tolist() for k, v in columns.items()}
+    rows = []
+    for i in range(n):
+        row = {k: lists[k][i] for k in lists}
+        for k in ("power_min", "power_max", "power_avg"):
+            if row[k] != row[k]:
+                row[k] = None
+        rows.append(row)
+    return rows
+
+
+def read_chunks(conn, raw_table, chunk_size, meter_id=DEFAULT_METER):
+    """ yields (ts, energy1, energy2, power) numpy arrays of a meter ordered by ts """
+    query = select(raw_table.c.ts, raw_table.c.energy1, raw_table.c.energy2, raw_table.c.power) \
+        .where(raw_table.c.meter_id == meter_id).order_by(raw_table.c.ts)
+    result = conn.execution_options(stream_results=True).execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        data = np.array(rows, dtype=np.float64)
+        yield data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3]
+
+
+def _after_archive(archived, chunks):
+    """ archive chunks followed by the db chunks newer than the last archived sample """
+    last = None
+    for chunk in archived:
+        if len(chunk[0]):
+            last = chunk[0][-1]
+        yield chunk
+    for chunk in chunks:
+        if last is not None:
+            keep = chunk[0] > last
+            chunk = tuple(c[keep] for c in chunk)
+            if not len(chunk[0]):
+                continue
+        yield chunk
+
+
+def compute(chunks) -> dict:
+    """
+    :param chunks: iterable of (ts, energy1, energy2, power) arrays ordered by ts
+    :return: {resolution: list of rows}
+    """
+    parts = []
+    carry = None
+    for ts, e1, e2, power in chunks:
+        if carry is not None:
+            ts, e1, e2, power = [np.concatenate((c, a)) for c, a in zip(carry, (ts, e1, e2, power))]
+        local = ts + local_offsets(ts)
+        keys = bucket_keys(local, "minute")
+        # samples of the last minute may continue in the next chunk
+        cut = np.searchsorted(keys, keys[-1]) if len(keys) else 0
+        carry = (ts[cut:], e1[cut:], e2[cut:], power[cut:])
+        if cut:
+            parts.append(minute_aggregates(ts[:cut], local[:cut], e1[:cut], e2[:cut], power[:cut]))
+    if carry is not None and len(carry[0]):
+        ts, e1, e2, power = carry
+        parts.append(minute_aggregates(ts, ts + local_offsets(ts), e1, e2, power))
+    if not parts:
+        return {res: [] for res in RESOLUTIONS}
+    minutes = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    return {res: to_rows(combine(minutes, res), res) for res in RESOLUTIONS}
+
+
+def rebuild(engine, raw_table, tables, chunk_size=200000, archive_dir=None, meter_id=DEFAULT_METER,
+            store=None) -> dict:
+    """
+    :param engine: sqlalchemy engine
+    :param raw_table: sqlalchemy Table of the raw power log
+    :param tables: {resolution: sqlalchemy Table}
+    :param archive_dir: directory of archived raw samples of the meter read before the db
+    :param meter_id: meter whose rollups are rebuilt
+    :param store: rawstore.RawStore of the meter read instead of raw_table
+    :return: {resolution: rows written}
+
+    Replaces the rollup rows of the meter in all tables in one transaction.
+    """
+    with engine.connect() as conn:
+        chunks = store.chunks(chunk_size) if store is not None else read_chunks(conn, raw_table, chunk_size, meter_id)
+        if archive_dir:
+            chunks = _after_archive(archive.archive_chunks(archive_dir, chunk_size), chunks)
+        result = compute(chunks)
+    with engine.begin() as conn:
+        for res, table in tables.items():
+            conn.execute(table.delete().where(table.c.meter_id == meter_id))
+            if result[res]:
+                conn.execute(table.insert(), [dict(row, meter_id=meter_id) for row in result[res]])
+    return {res: len(rows) for res, rows in result.items()}
+
+
+if __name__ == "__main__":
+    import os
+    if len(sys.argv) > 1:
+        os.environ["SMARTSERVER_DB"] = os.path.abspath(sys.argv[1])
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    import smartserver
+    smartserver.create_app()
+    smartserver.writer.flush()
+    raw = smartserver.PowerLog.__table__
+    with smartserver.db.engine.connect() as conn:
+        stored = [m for m, in conn.execute(select(raw.c.meter_id).distinct())]
+    for meter_id in list(smartserver.meters) + [m for m in stored if m not in smartserver.meters]:
+        t0 = time.perf_counter()
+        manager = smartserver.managers.get(meter_id)
+        counts = rebuild(smartserver.db.engine, raw,
+                         {res: t.__table__ for res, t in smartserver.rollup_tables.items()}, chunk,
+                         archive_dir=smartserver.meter_archive_dir(meter_id), meter_id=meter_id,
+                         store=manager.store if manager is not None else None)
+        print("Rebuilt %s of meter %s in %.1f s" % (", ".join("%d %s rows" % (n, res) for res, n in counts.items()),
+                                                   meter_id, time.perf_counter() - t0))
+    # the server recomputes the day reports from the new minute table
+    with smartserver.db.engine.begin() as conn:
+        conn.execute(smartserver.DayReport.__table__.delete())
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+# Incremental rollup engine: raw samples go into open minute buckets, a
+# closed bucket is merged into the next coarser level. Buckets are aligned
+# to minute/hour/day/month boundaries in local time and keyed like the
+# vectorized rebuild (timeutil), by epoch plus utc offset, so the repeated
+# hour in autumn opens new minute buckets instead of counting as late.
+import datetime
+
+import timeutil
+
+RESOLUTIONS = ["minute", "hour", "day", "month"]
+
+
+def bucket_start(dt, resolution) -> datetime.datetime:
+    """ start of the calendar bucket dt falls into """
+    if resolution == "minute":
+        return dt.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == "month":
+        return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError("unknown resolution '%s'" % resolution)
+
+
+def next_bucket(start, resolution) -> datetime.datetime:
+    """ start of the bucket following the one starting at start """
+    if resolution == "minute":
+        return start + datetime.timedelta(minutes=1)
+    if resolution == "hour":
+        return start + datetime.timedelta(hours=1)
+    if resolution == "day":
+        return start + datetime.timedelta(days=1)
+    if resolution == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    raise ValueError("unknown resolution '%s'" % resolution)
+
+
+class Bucket:
+    """ aggregates of one open bucket, start is its epoch and key its timeutil.bucket_key() """
+    __slots__ = ("start", "key", "open1", "open2", "close1", "close2", "power_min", "power_max", "power_sum",
+                 "count")
+
+    def __init__(self, start, key, open1, open2):
+        self.start = start
+        self.key = key
+        self.open1 = open1
+        self.open2 = open2
+        self.close1 = open1
+        self.close2 = open2
+        self.power_min = None
+        self.power_max = None
+        self.power_sum = 0.0
+        self.count = 0
+
+    def add_power(self, pmin, pmax, psum, count):
+        if not count:
+            return
+        self.power_min = pmin if self.power_min is None else min(self.power_min, pmin)
+        self.power_max = pmax if self.power_max is None else max(self.power_max, pmax)
+        self.power_sum += psum
+        self.count += count
+
+    def row(self) -> dict:
+        """ row for the rollup table, energy1/energy2 are the counters at the end of the bucket """
+        return {"ts": self.start, "energy1": self.close1, "energy2": self.close2,
+                "used1": self.close1 - self.open1, "used2": self.close2 - self.open2,
+                "power_min": self.power_min, "power_max": self.power_max,
+                "power_avg": self.power_sum / self.count if self.count else None,
+                "samples": self.count}
+
+
+class RollupEngine:
+    """ add() takes raw samples, merge() closed rows of a finer resolution.
+        Both return the rows of all buckets they closed as [(resolution, row), ...]
+    """
+    def __init__(self, last_rows=None):
+        """
+        :param last_rows: {resolution: last row written (dict with ts, energy1, energy2) or None}
+        """
+        self.buckets = dict.fromkeys(RESOLUTIONS)
+        self.last_close = {}
+        self.closed_until = {}  # resolution: epoch where the last written bucket ended
+        self.late = 0      # samples older than the open bucket, left to a rebuild
+        self.offsets = {}   # utc hour: utc offset, timeutil.utc_offset() is slow
+        for resolution, row in (last_rows or {}).items():
+            if row is None:
+                continue
+            self.last_close[resolution] = (row["energy1"], row["energy2"])
+            self.closed_until[resolution] = timeutil.bucket_end(row["ts"], resolution)
+
+    def next_start(self, resolution):
+        """ epoch of the first bucket which has not been written yet, None if nothing was written """
+        return self.closed_until.get(resolution)
+
+    def _offset(self, t) -> int:
+        hour = t // 3600
+        offset = self.offsets.get(hour)
+        if offset is None:
+            if len(self.offsets) > 48:
+                self.offsets.clear()
+            offset = self.offsets[hour] = timeutil.utc_offset(t)
+        return offset
+
+    def open_bucket(self, resolution):
+        bucket = self.buckets[resolution]
+        return bucket.row() if bucket else None
+
+    def add(self, dt, energy1, energy2, power=None) -> list:
+        """ dt is a local datetime (fold=1 in the repeated hour, as fromtimestamp() returns it) or epoch """
+        t = int(dt.timestamp()) if isinstance(dt, datetime.datetime) else int(dt)
+        count = 0 if power is None else 1
+        return self._add(0, t, energy1, energy2, energy1, energy2, power, power, power or 0.0, count)
+
+    def merge(self, resolution, row) -> list:
+        """ merges a closed row of resolution into the next coarser level """
+        level = RESOLUTIONS.index(resolution) + 1
+        if level >= len(RESOLUTIONS):
+            return []
+        used1 = row.get("used1")
+        used2 = row.get("used2")
+        open1 = row["energy1"] - used1 if used1 is not None else row["energy1"]
+        open2 = row["energy2"] - used2 if used2 is not None else row["energy2"]
+        count = row.get("samples") or 0
+        avg = row.get("power_avg")
+        if avg is None or row.get("power_min") is None:
+            count = 0
+        return self._add(level, int(row["ts"]), open1, open2, row["energy1"], row["energy2"],
+                         row.get("power_min"), row.get("power_max"), (avg or 0.0) * count, count)
+
+    def _add(self, level, t, open1, open2, close1, close2, pmin, pmax, psum, count) -> list:
+        resolution = RESOLUTIONS[level]
+        offset = self._offset(t)
+        key = timeutil.bucket_key(t + offset, resolution)
+        start = timeutil.key_start(key, resolution) - offset
+        closed = []
+        bucket = self.buckets[resolution]
+        if bucket is None:
+            if resolution in self.closed_until and t < self.closed_until[resolution]:
+                self.late += 1
+                return closed
+            open_counters = self.last_close.get(resolution, (open1, open2))
+            bucket = self.buckets[resolution] = Bucket(start, key, *open_counters)
+        elif t < bucket.start:
+            self.late += 1
+            return closed
+        elif key != bucket.key:
+            # local time may go back in autumn, a new key after the open bucket starts a new one
+            closed += self._close(level)
+            bucket = self.buckets[resolution] = Bucket(start, key, bucket.close1, bucket.close2)
+        bucket.close1 = close1
+        bucket.close2 = close2
+        bucket.add_power(pmin, pmax, psum, count)
+        return closed
+
+    def _close(self, level) -> list:
+        resolution = RESOLUTIONS[level]
+        bucket = self.buckets[resolution]
+        self.buckets[resolution] = None
+        row = bucket.row()
+        self.last_close[resolution] = (bucket.close1, bucket.close2)
+        self.closed_until[resolution] = timeutil.bucket_end(bucket.start, resolution)
+        closed = [(resolution, row)]
+        if level + 1 < len(RESOLUTIONS):
+            closed += self.merge(resolution, row)
+        return closed
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+# Production entry point. This process owns the meter, the ingest queue, the
+# db writer and the event stream server. Before any of its threads start it
+# forks a supervisor, which forks the http workers and restarts them, so no
+# worker is forked from a process whose threads may hold locks. The workers
+# accept on one shared socket, read the live values from shared memory and
+# open the db read-only. Readings and batches posted to /input are forwarded
+# to this process.
+# Usage: python serve.py [workers] [port]
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from threading import Thread
+
+from werkzeug.serving import make_server
+
+import dbwriter
+import ingest
+import livestate
+import smartserver
+
+log = logging.getLogger("smartserver.serve")
+host = "0.0.0.0"
+workers = int(os.environ.get("SMARTSERVER_WORKERS", os.cpu_count() or 1))
+
+
+def worker_main(index, fd, remote):
+    # ctrl-c reaches the whole process group, the ingest process stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    smartserver.role = "worker"
+    smartserver.ingest_queue = remote.bind(index)
+    smartserver.response_cache.source = smartserver.live.version
+    smartserver.response_cache.clear()
+    # connections of the parent must not be shared, new ones are read-only
+    dbwriter.sqlite_pragmas["query_only"] = "ON"
+    smartserver.db.engine.dispose()
+    server = make_server(host, 0, smartserver.app, threaded=True, fd=fd)
+    server.serve_forever()
+
+
+def start_worker(ctx, index, sock, remote):
+    process = ctx.Process(target=worker_main, args=(index, sock.fileno(), remote),
+                          name="http-%d" % index, daemon=True)
+    process.start()
+    return process
+
+
+def supervise(count, sock, remote):
+    """ supervisor process: keeps count workers running until SIGTERM or the ingest process is gone """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    parent = os.getppid()
+    ctx = multiprocessing.get_context("fork")
+    processes = [start_worker(ctx, i, sock, remote) for i in range(count)]
+    try:
+        while not stopping and os.getppid() == parent:
+            time.sleep(1)
+            for i, process in enumerate(processes):
+                if not process.is_alive() and not stopping:
+                    log.warning("Worker %d exited with %s, restarting", i, process.exitcode)
+                    processes[i] = start_worker(ctx, i, sock, remote)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(5)
+
+
+def main(count=workers, port=smartserver.app_port):
+    sock = socket.create_server((host, port), backlog=128)
+    sock.set_inheritable(True)
+    smartserver.create_app()
+    smartserver.role = "ingest"
+    smartserver.stream_port = smartserver.stream_port or port + 1
+    live = smartserver.live = livestate.LiveState(smartserver.meters)
+    with smartserver.app.app_context():
+        # the ring buffers move into shared memory, the ingest process keeps appending to them
+        for meter_id, manager in smartserver.managers.items():
+            live.buffers[meter_id].copy_from(manager.buffers)
+            manager.buffers = live.buffers[meter_id]
+            live.write(meter_id, power=smartserver.current_power.get(meter_id, 0), dt=None, last=manager.lastLog)
+        # the next write starts the writer thread again, after the fork
+        smartserver.writer.stop()
+        # the workers must not inherit pooled connections
+        smartserver.db.session.remove()
+        smartserver.db.engine.dispose()
+    if threading.active_count() > 1:
+        log.warning("Forking the http workers while threads run: %s",
+                    ", ".join(t.name for t in threading.enumerate() if t is not threading.current_thread()))
+
+    ctx = multiprocessing.get_context("fork")
+    remote = ingest.RemoteQueue(ctx, count)
+    # not a daemon, daemon processes may not have children
+    supervisor = ctx.Process(target=supervise, args=(count, sock, remote), name="http-supervisor")
+    supervisor.start()
+
+    smartserver.start_ingest()
+    Thread(target=remote.serve, name="remote-ingest", daemon=True,
+           args=(smartserver.ingest_queue, {"batch": smartserver.store_batch, "metrics": smartserver.ingest_metrics,
+                                            "profile": smartserver.profile_ingest},
+                 smartserver.app.app_context)).start()
+    log.info("Serving on %s:%d with %d workers, event stream on port %d",
+             host, port, count, smartserver.stream_port)
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    try:
+        while not stopping:
+            time.sleep(1)
+            if not supervisor.is_alive():
+                # forking a new one from here would copy the locks of running threads
+                log.error("Worker supervisor exited with %s, stopping", supervisor.exitcode)
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.terminate()
+        supervisor.join(10)
+        smartserver.live = None
+        smartserver.writer.close()
+        live.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else workers,
+         int(sys.argv[2]) if len(sys.argv) > 2 else smartserver.app_port)
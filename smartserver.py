@@ -2,66 +2,101 @@
 
 # Python code to read values from Smart Meter via SML (smart message language)
 # last mod: Thomas Ludwig, 2020-05-22 onto EMH ED300L
-import binascii
-import random
+import atexit
+import cache
 import datetime
 import flask
 from flask import Flask, render_template, Response, request as freq
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import declared_attr
+import contextlib
+import functools
+import importlib.util
 import json
-from math import ceil, sqrt
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import logging
+import logs
 import os
-import platform
-import queue
-import requests
-import serial
-from threading import Thread
+import dbwriter
+import graphs
+import ingest
+import meter
+import metrics
+import migrate
+import powerchart
+import profiling
+import rollup
+import sse
+import sys
+from threading import RLock, Thread
 import time
 
+
+def lazy_import(name):
+    """ module which is only executed on its first attribute access """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# numeric modules are loaded by the first request or the startup thread, not by the import
+np = lazy_import("numpy")
+analytics = lazy_import("analytics")
+archive = lazy_import("archive")
+downsample = lazy_import("downsample")
+livebuffer = lazy_import("livebuffer")
+rawstore = lazy_import("rawstore")
+streamserver = lazy_import("streamserver")
+
 app_port = 8000
 app = Flask(__name__)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///values.db'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///power.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.environ.get("SMARTSERVER_DB", "power.db")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {'connect_args': {'check_same_thread': False}}
 db = SQLAlchemy(app)
 sensor_delay = 10    # sensor read delay in seconds
-current_power = 0
-current_dt = datetime.datetime.now().strftime("%a,  %d.%m.%Y - %H:%M:%S")
+current_power = {}  # meter id: last power in W
+current_dt = {}     # meter id: time of the last reading as shown on the page
 log_delay_minutes = 30
-screen_resolution = "low"
-
-# # # SSE Function message announcer # # #
-class MessageAnnouncer:
-    """ listen() will be called by clients to receive notifications
-        announce() takes messages and announces them to listeners
-    """
-    def __init__(self):
-        self.listeners = []
-
-    def listen(self):
-        q = queue.Queue(maxsize=5)
-        self.listeners.append(q)
-        return q
-
-    def announce(self, msg):
-        for i in reversed(range(len(self.listeners))):
-            try:
-                self.listeners[i].put_nowait(msg)
-            except queue.Full:
-                del self.listeners[i]
-
-
-announcer = MessageAnnouncer()
-
-def format_sse(data: str, event=None) -> str:
-    msg = f'data: {data}\n\n'
-    if event is not None:
-        msg = f'event: {event}\n{msg}'
-    return msg
+# "auto", "serial[:device]", "simulator[@speed]" or "replay:capture[@speed]", speed e.g. 1000 or max
+meter_source = os.environ.get("SMARTSERVER_SOURCE", "auto")
+# several meters as "id=source,...", e.g. "main=serial:/dev/ttyUSB0,heatpump=serial:/dev/ttyUSB1,pv=serial:/dev/ttyUSB2";
+# rows stored before are those of the meter "main"
+meters = meter.parse_meters(os.environ.get("SMARTSERVER_METERS") or meter_source)
+default_meter = next(iter(meters))  # meter of requests and readings which name none
+meter_obis = {}     # meter id: {"energyNT"|"energyHT"|"power": OBIS key} for meters with other registers
+screen_resolution = "low"   # chart size, see powerchart.SIZES
+chart_minutes = 60   # minute points of the live power chart
+live_charts = {"sample": 60, "minute": chart_minutes, "quarter": 96}   # ring buffer resolution: points
+raw_retention_days = int(os.environ.get("SMARTSERVER_RETENTION_DAYS", 90))   # raw samples kept in the db
+# "db" keeps raw samples in the power_log table, "mmap" in one append-only file per meter (rawstore.py)
+raw_backend = os.environ.get("SMARTSERVER_RAW_BACKEND", "db")
+raw_dir = os.environ.get("SMARTSERVER_RAW_DIR", os.path.join(app.root_path, "raw"))
+raw_sync_seconds = float(os.environ.get("SMARTSERVER_RAW_SYNC_SECONDS", 10))   # a power cut loses this much at most
+role = "single"     # "single", or "ingest" / "worker" when started by serve.py
+live = None         # livestate.LiveState shared with the http workers, set by serve.py
+stream_port = int(os.environ.get("SMARTSERVER_STREAM_PORT", 0))   # >0 serves /listen from the asyncio stream server
+graph_dir = os.environ.get("SMARTSERVER_GRAPHS", os.path.join(app.root_path, "graphs"))
+graph_interval = 60     # seconds between checks for new rollup rows
+archive_dir = os.environ.get("SMARTSERVER_ARCHIVE", os.path.join(app.root_path, "archive"))
+tariff = {"nt": 0.25, "ht": 0.32, "daily": 0.40}   # price per kWh NT (energy1) and HT (energy2), fixed price per day
+report_interval = 3600  # seconds between checks for closed days without a report
+profile_dir = os.environ.get("SMARTSERVER_PROFILES", os.path.join(app.root_path, "profiles"))
+profile_token = os.environ.get("SMARTSERVER_PROFILE_TOKEN")    # without a token only local clients may profile
+profile_max_seconds = 300
+profile_threads = ("ingest", "dbwriter")   # sampled with the meter readers by /profile/ingest?format=collapsed
+
+announcer = sse.MessageAnnouncer()
+sse_heartbeat = 15   # seconds without events before a keepalive comment is sent
+stream_server = None    # streamserver.StreamServer, started by start_ingest() when stream_port is set
+
+logs.setup()
+log = logging.getLogger("smartserver")
 
 
 def convTime(ts) -> dict:
@@ -82,343 +117,414 @@ def convTime(ts) -> dict:
     answer = {"int": dt.timestamp(), "str": dt.isoformat(), "dt": dt}
     return answer
 
-class PowerLog(db.Model):
-    __tablename__ = 'power_log'
-    id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String, nullable=False)
-    energy1 = db.Column(db.Float, nullable=False)
-    energy2 = db.Column(db.Float, nullable=False)
-    power = db.Column(db.Float, nullable=True)
+def epoch(dt) -> int:
+    """ local datetime -> integer epoch seconds as stored in the ts columns """
+    return int(dt.timestamp())
 
-    def __init__(self, timestamp, energy1, energy2, power):
-        self.timestamp = timestamp
-        self.energy1 = energy1
-        self.energy2 = energy2
-        self.power = power
-        
-    def __repr__(self):
-        answer = json.dumps({"id": self.id, "datetime": self.timestamp,
-                             "energy1": self.energy1, "energy2": self.energy2, "power": self.power})
-        return answer
 
-class MinuteTable(db.Model):
-    __tablename__ = 'minute_table'
+class TimeSeries:
+    """ columns shared by the raw log and the rollup tables,
+        ts holds local time as integer epoch seconds
+    """
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String, nullable=False)
+    meter_id = db.Column(db.String(32), nullable=False, default=meter.DEFAULT_METER,
+                         server_default=meter.DEFAULT_METER)
+    ts = db.Column(db.Integer, nullable=False)
     energy1 = db.Column(db.Float, nullable=False)
     energy2 = db.Column(db.Float, nullable=False)
 
-    def __init__(self, timestamp, energy1, energy2):
-        self.timestamp = timestamp
+    @declared_attr
+    def __table_args__(cls):
+        # every query reads the rows of one meter in a ts range, ts needs no index of its own
+        return (db.Index("ix_%s_meter_ts" % cls.__tablename__, "meter_id", "ts"),)
+
+    def __init__(self, ts, energy1, energy2, meter_id=meter.DEFAULT_METER):
+        self.ts = ts
         self.energy1 = energy1
         self.energy2 = energy2
+        self.meter_id = meter_id
+
+    @property
+    def timestamp(self) -> str:
+        return datetime.datetime.fromtimestamp(self.ts).isoformat()
 
     def __repr__(self):
         answer = json.dumps({"id": self.id, "datetime": self.timestamp,
                              "energy1": self.energy1, "energy2": self.energy2})
         return answer
 
-class HourTable(db.Model):
-    __tablename__ = 'hour_table'
-    id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String, nullable=False)
-    energy1 = db.Column(db.Float, nullable=False)
-    energy2 = db.Column(db.Float, nullable=False)
-
-    def __init__(self, timestamp, energy1, energy2):
-        self.timestamp = timestamp
-        self.energy1 = energy1
-        self.energy2 = energy2
+class PowerLog(TimeSeries, db.Model):
+    __tablename__ = 'power_log'
+    power = db.Column(db.Float, nullable=True)
 
+    def __init__(self, ts, energy1, energy2, power, meter_id=meter.DEFAULT_METER):
+        super().__init__(ts, energy1, energy2, meter_id)
+        self.power = power
+        
     def __repr__(self):
         answer = json.dumps({"id": self.id, "datetime": self.timestamp,
-                             "energy1": self.energy1, "energy2": self.energy2})
+                             "energy1": self.energy1, "energy2": self.energy2, "power": self.power})
         return answer
 
-class DayTable(db.Model):
-    __tablename__ = 'day_table'
-    id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String, nullable=False)
-    energy1 = db.Column(db.Float, nullable=False)
-    energy2 = db.Column(db.Float, nullable=False)
+class Rollup(TimeSeries):
+    """ calendar aligned bucket starting at ts, energy1/energy2 are the
+        counters at the end of the bucket, used1/used2 the consumption within
+    """
+    used1 = db.Column(db.Float, nullable=True)
+    used2 = db.Column(db.Float, nullable=True)
+    power_min = db.Column(db.Float, nullable=True)
+    power_max = db.Column(db.Float, nullable=True)
+    power_avg = db.Column(db.Float, nullable=True)
+    samples = db.Column(db.Integer, nullable=True)
+
+class MinuteTable(Rollup, db.Model):
+    __tablename__ = 'minute_table'
 
-    def __init__(self, timestamp, energy1, energy2):
-        self.timestamp = timestamp
-        self.energy1 = energy1
-        self.energy2 = energy2
+class HourTable(Rollup, db.Model):
+    __tablename__ = 'hour_table'
 
-    def __repr__(self):
-        answer = json.dumps({"id": self.id, "datetime": self.timestamp,
-                             "energy1": self.energy1, "energy2": self.energy2})
-        return answer
+class DayTable(Rollup, db.Model):
+    __tablename__ = 'day_table'
 
-class MonthTable(db.Model):
+class MonthTable(Rollup, db.Model):
     __tablename__ = 'month_table'
+
+rollup_tables = {"minute": MinuteTable, "hour": HourTable, "day": DayTable, "month": MonthTable}
+
+class DayReport(db.Model):
+    """ analytics of the closed local day starting at ts, see analytics.day_reports(),
+        peaks and profile hold json lists
+    """
+    __tablename__ = 'day_report'
+    __table_args__ = (db.UniqueConstraint("meter_id", "ts"),)
+    replace_on_conflict = True  # a day computed again replaces its report, see DbWriter._insert()
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String, nullable=False)
-    energy1 = db.Column(db.Float, nullable=False)
-    energy2 = db.Column(db.Float, nullable=False)
+    meter_id = db.Column(db.String(32), nullable=False, default=meter.DEFAULT_METER,
+                         server_default=meter.DEFAULT_METER)
+    ts = db.Column(db.Integer, nullable=False)
+    used1 = db.Column(db.Float, nullable=False)
+    used2 = db.Column(db.Float, nullable=False)
+    minutes = db.Column(db.Integer, nullable=False)
+    base_load = db.Column(db.Float, nullable=True)
+    base_ts = db.Column(db.Integer, nullable=True)
+    peak_power = db.Column(db.Float, nullable=True)
+    peak_ts = db.Column(db.Integer, nullable=True)
+    peaks = db.Column(db.Text, nullable=False)
+    profile = db.Column(db.Text, nullable=False)
 
-    def __init__(self, timestamp, energy1, energy2):
-        self.timestamp = timestamp
-        self.energy1 = energy1
-        self.energy2 = energy2
 
-    def __repr__(self):
-        answer = json.dumps({"id": self.id, "datetime": self.timestamp,
-                             "energy1": self.energy1, "energy2": self.energy2})
-        return answer
+response_cache = cache.ResponseCache()
 
 
-db.create_all()
+def data_changed():
+    """ invalidates the cached responses of this process and of the http workers """
+    response_cache.bump()
+    if live is not None:
+        live.bump()
+
+
+writer = dbwriter.DbWriter(db, context=app.app_context, on_commit=data_changed)
+atexit.register(writer.close)
+
+def meter_archive_dir(meter_id) -> str:
+    """ the meter "main" keeps the archive directory from before there were several meters """
+    return archive_dir if meter_id == meter.DEFAULT_METER else os.path.join(archive_dir, meter_id)
+
+
+def raw_path(meter_id) -> str:
+    return os.path.join(raw_dir, "%s.raw" % meter_id)
+
 
 class DbManager:
-    def __init__(self):
-        self.last_ts = datetime.datetime.now()
-        self.current_power_list = []
-        self.lastMinuteRow = None
-        self.lastHourRow = None
-        self.lastDayRow = None
-        self.lastMonthRow = None
+    """ keeps the last raw row and the open rollup buckets of one meter in memory
+        and hands new rows to the write-behind writer, raw rows go to the raw
+        store of the meter instead with the mmap backend
+    """
+    def __init__(self, meter_id=meter.DEFAULT_METER):
+        self.meter_id = meter_id
+        self.store = rawstore.RawStore(raw_path(meter_id), raw_sync_seconds) if raw_backend == "mmap" else None
+        if self.store is not None:
+            atexit.register(self.store.sync)
+        self.buffers = livebuffer.LiveBuffers()
+        self.lastLog = None
+        self.rollups = None
+        self.lock = RLock()
         self.update_values()
 
     def update_values(self):
-        self.lastMinuteRow = self.get_last_db_value(MinuteTable)
-        self.lastHourRow = self.get_last_db_value(HourTable)
-        self.lastDayRow = self.get_last_db_value(DayTable)
-        self.lastMonthRow = self.get_last_db_value(MonthTable)
+        """ loads the last rows from the db and reopens the rollup buckets, only needed at startup """
+        self.lastLog = self.store.last() if self.store is not None else self.get_last_db_value(PowerLog)
+        last_rows = {res: self.get_last_db_value(table) for res, table in rollup_tables.items()}
+        self.rollups = rollup.RollupEngine(last_rows)
+        rows = []
+        # rows of a finer table newer than the last closed bucket belong to open buckets
+        for res, finer in (("month", "day"), ("day", "hour"), ("hour", "minute")):
+            table = rollup_tables[finer]
+            for r in self.query_since(table, self.rollups.next_start(res)):
+                rows += self.rollups.merge(finer, r)
+        for r in self.raw_since(self.rollups.next_start("minute")):
+            rows += self.rollups.add(r["ts"], r["energy1"], r["energy2"], r["power"])
+        if rows:
+            writer.add_group(self.rollup_rows(rows))
+        span = max(span for _, _, span in livebuffer.RESOLUTIONS.values())
+        raw = self.query_raw(start=int(time.time()) - span)
+        self.buffers.load(raw["ts"], raw["power"])
+
+    def raw_since(self, start):
+        if self.store is None:
+            yield from self.query_since(PowerLog, start)
+            return
+        data = self.store.range(start)
+        for ts, energy1, energy2, power in zip(*(data[k].tolist() for k in rawstore.FIELDS)):
+            yield {"ts": ts, "energy1": energy1, "energy2": energy2, "power": None if power != power else power}
+
+    def query_raw(self, start=None, end=None) -> dict:
+        """ raw samples in [start, end) from the archive and the db or raw store """
+        directory = meter_archive_dir(self.meter_id)
+        if self.store is None:
+            return archive.query_raw(db.engine, PowerLog.__table__, directory, start, end, self.meter_id)
+        return archive.combine(archive.load_range(directory, start, end), self.store.query(start, end))
+
+    def query_since(self, table, start):
+        query = db.session.query(table).filter(table.meter_id == self.meter_id)
+        if start is not None:
+            query = query.filter(table.ts >= start)
+        columns = [c.name for c in table.__table__.columns]
+        for row in query.order_by(table.ts).yield_per(1000):
+            yield {c: getattr(row, c) for c in columns}
 
     def get_last_db_value(self, table):
-        answer = db.session.query(table).order_by(table.id.desc()).first()
-        return answer
+        answer = db.session.query(table).filter(table.meter_id == self.meter_id).order_by(table.ts.desc()).first()
+        if answer is None:
+            return None
+        return {c.name: getattr(answer, c.name) for c in table.__table__.columns}
 
     def append_data(self, ts, energy1, energy2, power=0):
-        newLog = PowerLog(timestamp=ts.isoformat(), energy1=energy1, energy2=energy2, power=power)
-        db.session.add(newLog)
-        print("Powerlog logged on %s" % ts.isoformat())
-        logtime = convTime(ts)["dt"]
-        try:
-            if logtime - datetime.timedelta(minutes=1) >= convTime(self.lastMinuteRow.timestamp)["dt"]:
-                new = MinuteTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-                db.session.add(new)
-                print("MinuteTable logged on %s" % ts.isoformat())
-                if logtime - datetime.timedelta(hours=1) >= convTime(self.lastHourRow.timestamp)["dt"]:
-                    new_h = HourTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-                    db.session.add(new_h)
-                    print("HourTable logged on %s" % ts.isoformat())
-                    if logtime - datetime.timedelta(days=1) >= convTime(self.lastDayRow.timestamp)["dt"]:
-                        new_d = DayTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-                        db.session.add(new_d)
-                        print("DayTable logged on %s" % ts.isoformat())
-                        if logtime - datetime.timedelta(months=1) >= convTime(self.lastMonthRow.timestamp)["dt"]:
-                            new_m = MonthTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-                            db.session.add(new_m)
-                            print("MonthTable logged on %s" % ts.isoformat())
-                db.session.commit()
-                self.update_values()
-        except:
-            new = MinuteTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-            db.session.add(new)
-            new_h = HourTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-            db.session.add(new_h)
-            new_d = DayTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-            db.session.add(new_d)
-            new_m = MonthTable(timestamp=convTime(ts)["str"], energy1=energy1, energy2=energy2)
-            db.session.add(new_m)
-            db.session.commit()
-            self.update_values()
-
-    def append_current_power(self, ts, power):
-        if ts - datetime.timedelta(minutes=1) > self.last_ts:
-            if len(self.current_power_list) > 60:
-                self.current_power_list.pop(0)
-            h = ts.strftime("%H:%M")
-            self.current_power_list.append({"time": h, "power": power})
-            self.last_ts = ts
-
-    def get_curr_power_list(self):
-        return self.current_power_list
-
-
-dbm = DbManager()
-
-def pm_simulator(sens_delay):
-    global current_power
-    global current_dt
-    delay = sens_delay * 2
-    while True:
-        v = queryData()
-        if not v == 'None':
-            q = json.loads(v)
-        else:
-            q = {"energy1": 1110, "energy2": 2220}
-        dt = datetime.datetime.today()
-        rand = random.random()
-        power = ceil(rand*1000)
-        current_power = power
-        current_dt = datetime.datetime.now().strftime("%a,  %d.%m.%Y - %H:%M:%S")
-        energy1 = q["energy1"] + power/1000
-        energy2 = q["energy2"] + power/1000
-        msg = format_sse(data=str(current_power))
-        # msg = format_sse(data="reload")
-        announcer.announce(msg=format_sse(data="reload"))
-        print(msg)
-
-        dbm.append_current_power(ts=dt, power=power)
-        dbm.append_data(dt, energy1, energy2, power)
-        # dh.append_log(ts=dt, energy1=energy1, energy2=energy2, delay=log_delay_minutes)
-        time.sleep(delay)
-
-def _powermeter(sens_delay):
-    global current_power
-    global current_dt
-    power = 0
-    db_write_level = 1
-    port = serial.Serial(
-        port='/dev/ttyUSB0',
-        baudrate=9600,
-        parity=serial.PARITY_NONE,
-        stopbits=serial.STOPBITS_ONE,
-        bytesize=serial.EIGHTBITS
-    )
-    # port.open();
-    start = '1b1b1b1b01010101'
-    end = '1b1b1b1b1a'
-    data = ''
-    while True:
-        ''' if db_write_level == 1:
-            db_write_level = 0
-        else:'''
-        db_write_level = 1
-
-        char_bin = port.read()
-        char = binascii.hexlify(char_bin)
-        data = data + char.decode('ascii')
-        pos = data.find(start)
-        if pos != -1:
-            data = data[pos:len(data)]
-        pos = data.find(end)
-        if pos != -1:
-            timestamp = (time.strftime("%Y-%m-%d ") + time.strftime("%H:%M:%S"))
-            dt = datetime.datetime.today()
-            result = timestamp
-            search = '0100010801ff'
-            """ search key counter value 1 """
-            pos1 = data.find(search)
-            if pos1 != -1:
-                pos1 = pos1 + len(search) + 14
-                value1 = data[pos1:pos1 + 10]
-                energy1 = int(value1, 16) / 1e4
-                print(timestamp + ' kWh: ' + search + ' = ' + value1 + ' = ' + str(energy1) + ' kWh')
-                result = result + ';' + str(energy1)
-            search = '0100010802ff'
-            """ search key counter value 2 """
-            pos2 = data.find(search)
-            if pos2 != -1:
-                pos2 = pos2 + len(search) + 14
-                value2 = data[pos2:pos2 + 10]
-                energy2 = int(value2, 16) / 1e4
-                print(timestamp + ' kWh: ' + search + ' = ' + value2 + ' = ' + str(energy2) + ' kWh')
-                result = result + ';' + str(energy2)
-            search = '0100100700ff'
-            """ search key topical consume """
-            pos3 = data.find(search)
-            if pos3 != -1:
-                pos3 = pos3 + len(search) + 14
-                value3 = data[pos3:pos3 + 8]
-                power = int(value3, 16) / 1e1
-                print('W: ' + search + ' = ' + value3 + ' = ' + str(power) + ' W')
-                result = result + ';' + str(power)
-            # writexml(timestamp, energy1, energy2, power)
-            current_power = power
-            current_dt = datetime.datetime.now().strftime("%a,  %d.%m.%Y - %H:%M:%S")
-            # msg = format_sse(data=str(current_power))
-            # msg = format_sse(data="reload")
-            # announcer.announce(msg=format_sse(data="reload"))
-            # print(msg)
-            # dbm.append_current_power(ts=dt, power=power)
-            # dbm.append_data(dt, energy1, energy2, power)
-            time.sleep(sens_delay)
-            
-def powermeter(sens_delay):
-    global current_power
-    global current_dt
-    power = 0
-    db_write_level = 1
-    port = serial.Serial(
-        port='/dev/ttyUSB0',
-        baudrate=9600,
-        parity=serial.PARITY_NONE,
-        stopbits=serial.STOPBITS_ONE,
-        bytesize=serial.EIGHTBITS
-    )
-    # port.open();
-    start = '1b1b1b1b01010101'
-    end = '1b1b1b1b1a'
-    data = ''
-    while True:
-        ''' if db_write_level == 1:
-            db_write_level = 0
-        else:'''
-        db_write_level = 1
-
-        char_bin = port.read()
-        char = binascii.hexlify(char_bin)
-        data = data + char.decode('ascii')
-        pos = data.find(start)
-        if pos != -1:
-            data = data[pos:len(data)]
-        pos = data.find(end)
-        if pos != -1:
-            timestamp = (time.strftime("%Y-%m-%d ") + time.strftime("%H:%M:%S"))
-            dt = datetime.datetime.now()
-            result = timestamp
-            search = '0100010801ff'
-            """ search key counter value 1 """
-            pos1 = data.find(search)
-            if pos1 != -1:
-                pos1 = pos1 + len(search) + 14
-                value1 = data[pos1:pos1 + 10]
-                energy1 = int(value1, 16) / 1e4
-                print(timestamp + ' kWh: ' + search + ' = ' + value1 + ' = ' + str(energy1) + ' kWh')
-                result = result + ';' + str(energy1)
-            search = '0100010802ff'
-            """ search key counter value 2 """
-            pos2 = data.find(search)
-            if pos2 != -1:
-                pos2 = pos2 + len(search) + 14
-                value2 = data[pos2:pos2 + 10]
-                energy2 = int(value2, 16) / 1e4
-                print(timestamp + ' kWh: ' + search + ' = ' + value2 + ' = ' + str(energy2) + ' kWh')
-                result = result + ';' + str(energy2)
-            search = '0100100700ff'
-            """ search key topical consume """
-            pos3 = data.find(search)
-            if pos3 != -1:
-                pos3 = pos3 + len(search) + 14
-                value3 = data[pos3:pos3 + 8]
-                power = int(value3, 16) / 1e1
-                print('W: ' + search + ' = ' + value3 + ' = ' + str(power) + ' W')
-                result = result + ';' + str(power)
-            # writexml(timestamp, energy1, energy2, power)
-            current_power = power
-            current_dt = datetime.datetime.now().strftime("%a,  %d.%m.%Y - %H:%M:%S")
-            jdata = json.dumps({"timestamp": dt.isoformat(timespec="seconds"), "energyNT": energy1, "energyHT": energy2, "power":power})
-            r = requests.post("http://localhost:%s/input" % str(app_port), jdata,
-                          headers={'Content-type': 'application/json'}, timeout=2.000)
-            print(r)
-            '''if db_write_level == 1:
-                if power:
-                    dbm.append_current_power(ts=dt, power=power)
-                if energy1 and energy2:
-                    dbm.append_data(ts=dt, energy1=energy1, energy2=energy2, power=power)'''
-            data = ''
-            time.sleep(sens_delay)
+        with self.lock:
+            row = {"meter_id": self.meter_id, "ts": epoch(ts), "energy1": energy1, "energy2": energy2,
+                   "power": power}
+            if self.store is not None:
+                self.store.append(row["ts"], energy1, energy2, power)
+                rows = []
+            else:
+                rows = [(PowerLog, row)]
+            self.lastLog = row
+            rows += self.rollup(ts, energy1, energy2, power)
+            if rows:
+                writer.add_group(rows)
+
+    def append_batch(self, readings) -> int:
+        """
+        :param readings: list of reading dicts as returned by parse_reading()
+        :return: number of rows inserted
+
+        Inserts all raw rows with one statement and writes the rollups
+        for the whole batch in the same transaction. With a raw store the
+        raw rows are appended to it at once.
+        """
+        readings = sorted(readings, key=lambda r: r["timestamp"])
+        if not readings:
+            return 0
+        with self.lock:
+            rows = []
+            raw = []
+            for r in readings:
+                row = {"meter_id": self.meter_id, "ts": epoch(r["timestamp"]), "energy1": r["energyNT"],
+                       "energy2": r["energyHT"], "power": r["power"]}
+                raw.append(row)
+                rows += self.rollup(r["timestamp"], r["energyNT"], r["energyHT"], r["power"])
+            if self.store is not None:
+                self.store.extend(rawstore.records_of(*([row[k] for row in raw] for k in rawstore.FIELDS)))
+            else:
+                rows = [(PowerLog, row) for row in raw] + rows
+            if self.lastLog is None or self.lastLog["ts"] <= row["ts"]:
+                self.lastLog = row
+            ack = writer.add_group(rows, ack=dbwriter.Ack())
+        if not ack.wait(timeout=120):
+            raise RuntimeError("batch could not be written")
+        log.info("Batch of %d rows of meter %s logged up to %s", len(readings), self.meter_id,
+                 readings[-1]["timestamp"].isoformat())
+        return len(readings)
+
+    def rollup(self, ts, energy1, energy2, power=None) -> list:
+        """ returns the rows of the rollup buckets closed by the sample at ts as [(table, row), ...] """
+        return self.rollup_rows(self.rollups.add(ts, energy1, energy2, power))
+
+    def rollup_rows(self, closed) -> list:
+        rows = []
+        for res, row in closed:
+            row["meter_id"] = self.meter_id
+            rows.append((rollup_tables[res], row))
+            log.debug("%s logged for %s", rollup_tables[res].__name__, datetime.datetime.fromtimestamp(row["ts"]))
+        return rows
+
+    def append_current_power(self, ts, power) -> bool:
+        """ adds the sample to the live ring buffers, True if a new minute started """
+        return self.buffers.append(epoch(ts), power)
+
+
+managers = {}   # meter id: DbManager, filled by create_app()
+startup = {}    # seconds of the startup steps, see benchmarks/startup.py
+_init_lock = RLock()
+
+
+def create_app():
+    """
+    app factory: brings the db schema up to date and loads the live state of every meter,
+    only the first call does the work, later calls return the app
+    """
+    with _init_lock:
+        if not managers:
+            t0 = time.perf_counter()
+            with app.app_context():
+                migrate.upgrade(db.engine, db.Model.metadata, derived=[DayReport.__tablename__])
+                db.create_all()
+                t1 = time.perf_counter()
+                loaded = {meter_id: DbManager(meter_id) for meter_id in meters}
+            startup["schema"] = t1 - t0
+            startup["live_state"] = time.perf_counter() - t1
+            managers.update(loaded)
+    return app
+
+
+@app.before_request
+def _initialize():
+    # requests which arrive while the startup thread still runs wait here
+    if not managers:
+        create_app()
+
+
+def last_energy_values(meter_id=None):
+    v = queryData(meter_id)
+    if not v == 'None':
+        return json.loads(v)
+    return None
+
+def store_reading(reading):
+    """
+    :param reading: dict {"timestamp": datetime, "energyNT": kWh, "energyHT": kWh, "power": W,
+                          "meter": meter id, default_meter if missing}
+
+    Consumer stage of the ingest queue: updates the live values of the meter,
+    writes to the db and notifies the SSE listeners of its channel.
+    """
+    meter_id = reading.get("meter") or default_meter
+    manager = managers[meter_id]
+    dt = reading["timestamp"]
+    power = reading.get("power")
+    if power is not None:
+        current_power[meter_id] = power
+    current_dt[meter_id] = dt.strftime("%a,  %d.%m.%Y - %H:%M:%S")
+    new_point = False
+    if power:
+        with live.writing() if live is not None else contextlib.nullcontext():
+            new_point = manager.append_current_power(ts=dt, power=power)
+    if reading.get("energyNT") and reading.get("energyHT"):
+        manager.append_data(ts=dt, energy1=reading["energyNT"], energy2=reading["energyHT"], power=power)
+        announcer.publish("energy", {"meter": meter_id, "energy1": reading["energyNT"],
+                                     "energy2": reading["energyHT"]}, channel=meter_id)
+    response_cache.bump()
+    if live is not None:
+        live.write(meter_id, power=current_power.get(meter_id, 0), dt=dt, last=manager.lastLog)
+    if power:
+        announcer.publish("power", {"meter": meter_id, "power": power, "level": power_level(power),
+                                    "datetime": current_dt[meter_id]}, channel=meter_id)
+    if new_point:
+        point = power_list(meter_id)[-1]
+        with chart_lock:
+            # the page shows the chart of its size, line and labels are those of screen_resolution
+            sizes = {}
+            for size in power_charts[meter_id]:
+                chart = sync_charts(meter_id, size)["minute"]
+                sizes[size] = {"line": chart.points(), "labels": chart.label_svg()}
+        announcer.publish("point", dict(sizes[screen_resolution], meter=meter_id, time=point["time"],
+                                        power=point["power"], sizes=sizes), channel=meter_id)
+
+
+def live_values(meter_id=None) -> dict:
+    """ current power and time and the last raw row of a meter (default_meter),
+        an http worker reads them from the shared memory of the ingest process
+    """
+    meter_id = meter_id or default_meter
+    if role == "worker":
+        values = live.read(meter_id)
+        dt = values.pop("dt") or datetime.datetime.now()
+        values["datetime"] = dt.strftime("%a,  %d.%m.%Y - %H:%M:%S")
+        return values
+    return {"power": current_power.get(meter_id, 0),
+            "datetime": current_dt.get(meter_id) or datetime.datetime.now().strftime("%a,  %d.%m.%Y - %H:%M:%S"),
+            "last": managers[meter_id].lastLog}
+
+
+def live_series(meter_id, resolution, since=None) -> tuple:
+    """ (ts, power) numpy arrays of a live ring buffer of a meter, views in the ingest process """
+    if role == "worker":
+        return live.series(meter_id, resolution, since)
+    return managers[meter_id].buffers.view(resolution, since)
+
+
+def power_list(meter_id) -> list:
+    """ [{"time": "HH:MM", "power": W}, ...] of the last chart_minutes minutes """
+    ts, power = live_series(meter_id, "minute")
+    return livebuffer.chart_points(ts[-chart_minutes:], power[-chart_minutes:])
+
+
+# meter id: {size: {resolution: PowerChart}}, a chart of every size in powerchart.SIZES
+power_charts = {meter_id: {size: {res: powerchart.PowerChart(res, points, *dims) for res, points in live_charts.items()}
+                           for size, dims in powerchart.SIZES.items()} for meter_id in meters}
+chart_lock = RLock()    # held while the charts are synced or read, store_reading() and requests share them
+
+def sync_charts(meter_id, size=None) -> dict:
+    """ brings the live charts of a meter in size (default screen_resolution) up to date,
+        only samples newer than a chart's last point are scaled; read them while holding chart_lock
+    """
+    charts = power_charts[meter_id][size or screen_resolution]
+    with chart_lock:
+        for chart in charts.values():
+            chart.sync(*live_series(meter_id, chart.resolution, chart.since()))
+    return charts
+
+
+def size_arg() -> str:
+    """ chart size of the ?size= query parameter, screen_resolution if empty; raises ValueError for unknown sizes """
+    size = freq.args.get("size") or screen_resolution
+    if size not in powerchart.SIZES:
+        raise ValueError("unknown chart size '%s'" % size)
+    return size
+
+
+def power_level(power) -> str:
+    if power <= 500:
+        return "low"
+    elif power <= 2000:
+        return "middle"
+    return "high"
+
+
+ingest_queue = ingest.IngestQueue(store_reading, context=app.app_context)
+
+def meter_reader(meter_id, source):
+    """
+    :param meter_id: id the readings are stored under
+    :param source: meter.MeterSource
+
+    Reads the source and hands every reading to the ingest queue shared by all meters.
+    Real time sources never wait for the queue, replays do.
+    """
+    block = source.speed != 1
+    for reading in source:
+        reading["meter"] = meter_id
+        if not ingest_queue.put(reading, block=block):
+            log.warning("Ingest queue full, dropped oldest reading")
             
 
-def queryData():
-    vals = db.session.query(PowerLog).order_by(PowerLog.id.desc()).first()
-    return str(vals)
+def queryData(meter_id=None):
+    """ latest raw values of a meter as json string, 'None' if nothing was logged yet """
+    vals = live_values(meter_id)["last"]
+    if vals is None:
+        return 'None'
+    return json.dumps({"id": vals.get("id"), "datetime": convTime(vals["ts"])["str"],
+                       "energy1": vals["energy1"], "energy2": vals["energy2"], "power": vals["power"]})
 
 '''def _listData_timefilter(filt):
     valrange = db.session.query(PowerLog).filter(PowerLog.timestamp >= filt).all()
@@ -432,22 +538,6 @@ def list_timediff(ts, sec):
     return str(result)
 '''
 
-def set_multiline(vals: list) -> str:
-    height = 300
-    length = 800
-    if len(vals) > 0:
-        num = length / len(vals)
-        step = int(num)
-    else:
-        step = 1
-    counter = 0
-    valstr = ""
-    for i in range(len(vals)):
-        power = height - int(sqrt(vals[i]["power"])*2)
-        valstr += "{},{} ".format(counter, power)
-        counter += step
-    return valstr
-
 '''def get_last_72_values() -> list:
     """ returns a list of the latest 72 lines
         from db in form [datetime, nt, ht] """
@@ -463,189 +553,577 @@ def set_multiline(vals: list) -> str:
     return val_list
 '''
 
-def _parse_list(val_list) -> list:
-    """ parses the list of power values into consumption
-        returns a list of 3 lists: datetime | used_nt | used_ht
+def rollup_usage(resolution, start, meter_id=None) -> tuple:
+    """ (ts, used1, used2) numpy arrays of a rollup table of a meter (default_meter) from start on, oldest first """
+    t = rollup_tables[resolution].__table__
+    with db.engine.connect() as conn:
+        rows = conn.execute(db.select(t.c.ts, t.c.energy1, t.c.energy2, t.c.used1, t.c.used2)
+                            .where(t.c.meter_id == (meter_id or default_meter), t.c.ts >= start)
+                            .order_by(t.c.ts)).fetchall()
+    data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    # rows written before the rollup engine have no used columns, take the counter difference
+    delta = np.diff(data[:, 1:3], axis=0, prepend=np.nan)
+    used = np.where(np.isnan(data[:, 3:]), delta, data[:, 3:])
+    return data[:, 0].astype(np.int64), used[:, 0], used[:, 1]
+
+
+def rollup_version(resolution, meter_id=None) -> tuple:
+    """ changes whenever rows of the rollup table of a meter are written, also by another process """
+    t = rollup_tables[resolution].__table__
+    with db.engine.connect() as conn:
+        return tuple(conn.execute(db.select(db.func.count(), db.func.max(t.c.ts))
+                                  .where(t.c.meter_id == (meter_id or default_meter))).first())
+
+
+# the history graphs show the default meter
+graph_renderer = graphs.GraphRenderer(graph_dir, rollup_usage, rollup_version, interval=graph_interval)
+
+
+def day_start(dt=None) -> datetime.datetime:
+    """ local midnight of dt, default today """
+    return rollup.bucket_start(dt or datetime.datetime.now(), "day")
+
+
+def compute_reports(start, end, meter_id) -> list:
+    """ day reports of a meter for the local days in [start, end) (epoch) computed from the minute table """
+    t = MinuteTable.__table__
+    with db.engine.connect() as conn:
+        rows = conn.execute(db.select(t.c.ts, t.c.used1, t.c.used2, t.c.power_avg)
+                            .where(t.c.meter_id == meter_id, t.c.ts >= start, t.c.ts < end)
+                            .order_by(t.c.ts)).fetchall()
+    data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return analytics.day_reports(data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3])
+
+
+def update_reports(chunk_days=31) -> int:
+    """ stores the report of every closed day of every meter which has none yet,
+        returns the number of days committed
     """
-    timeList = []
-    ntList = []
-    htList = []
-    last_nt = 0
-    last_ht = 0
-    while val_list:
-        row = val_list.pop()
-        t, nt_val, ht_val = row
-        if not last_nt == 0 and not last_ht == 0:
-            used_nt = (nt_val - last_nt) * 1000
-            used_ht = (ht_val - last_ht) * 1000
-            timeList.append(t)
-            ntList.append(int(used_nt))
-            htList.append(int(used_ht))
-        last_nt = nt_val
-        last_ht = ht_val
-    usage_list = [timeList, ntList, htList]
-    return usage_list
-
-def plot_hourly_graph(value_list):
-    # vl = value_list
-    # vl = np.array(value_list)
-    vl = [np.array(value_list[0]), np.array(value_list[1]), np.array(value_list[2])]
-
-    fig, ax = plt.subplots()
-    ax.plot(vl[0], vl[1], 'r', vl[0], vl[2])  # plot-line
-    datemin = np.datetime64(vl[0][0], 'h')
-    datemax = np.datetime64(vl[0][-1], 'h') + np.timedelta64(1, 'h')
-    ax.set_xlim(datemin, datemax)
-
-    ax.xaxis.set_major_locator(mdates.HourLocator(interval=4))  # set x descriptions
-    ax.xaxis.set_minor_locator(mdates.HourLocator())    # set x separators
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M')) # set description format
-
-    ax.grid(True)   # set grid
-    fig.autofmt_xdate() # rotates x axis descriptors
-    plt.title('last 36h')
-    plt.ylabel('Verbrauch')
-    plt.savefig('hourly_graph.png')
-    # plt.show()
-
-# values72 = parse_list(get_last_72_values())
-# plot_hourly_graph(values72)
+    writer.flush()
+    minutes = MinuteTable.__table__
+    reports = DayReport.__table__
+    today = epoch(day_start())
+    stored = 0
+    for meter_id in meters:
+        with db.engine.connect() as conn:
+            last = conn.execute(db.select(db.func.max(reports.c.ts)).where(reports.c.meter_id == meter_id)).scalar()
+            # days have 23 or 25 hours when the clock changes, the next one starts at the next local midnight
+            after = epoch(rollup.next_bucket(day_start(datetime.datetime.fromtimestamp(last)), "day")) \
+                if last is not None else None
+            query = db.select(db.func.min(minutes.c.ts)).where(minutes.c.meter_id == meter_id)
+            if after is not None:
+                query = query.where(minutes.c.ts >= after)
+            first = conn.execute(query).scalar()
+        if first is None:
+            continue
+        day = day_start(datetime.datetime.fromtimestamp(first))
+        while epoch(day) < today:
+            end = min(epoch(day + datetime.timedelta(days=chunk_days)), today)
+            rows = [dict(r, meter_id=meter_id, peaks=json.dumps(r["peaks"]), profile=json.dumps(r["profile"]))
+                    for r in compute_reports(epoch(day), end, meter_id)]
+            if rows:
+                ack = writer.add_group([(DayReport, r) for r in rows], ack=dbwriter.Ack())
+                if not ack.wait(timeout=120):
+                    raise RuntimeError("the reports of meter %s from %s were not stored" % (meter_id, day.date()))
+                stored += len(rows)
+            day = day_start(datetime.datetime.fromtimestamp(end))
+    return stored
+
+
+def report_loop(interval=report_interval):
+    """ precomputes the reports of closed days, dashboards only read them """
+    while True:
+        try:
+            stored = update_reports()
+            if stored:
+                log.info("Stored the reports of %d days", stored)
+        except Exception as e:
+            log.error("Reports failed: %s", e)
+        time.sleep(interval)
+
+
+def query_reports(start, end, meter_id) -> list:
+    """ day reports of a meter in [start, end), days without a stored report (today) are computed """
+    t = DayReport.__table__
+    with db.engine.connect() as conn:
+        rows = conn.execute(db.select(t).where(t.c.meter_id == meter_id, t.c.ts >= start, t.c.ts < end)
+                            .order_by(t.c.ts)).mappings().fetchall()
+    reports = [dict(r, peaks=json.loads(r["peaks"]), profile=json.loads(r["profile"]), closed=True) for r in rows]
+    for r in reports:
+        del r["id"]
+        del r["meter_id"]
+    rest = epoch(rollup.next_bucket(day_start(datetime.datetime.fromtimestamp(reports[-1]["ts"])), "day")) \
+        if reports else start
+    if rest < end:
+        today = epoch(day_start())
+        reports += [dict(r, closed=r["ts"] < today) for r in compute_reports(rest, end, meter_id)]
+    return reports
 
 @app.route('/listen', methods=['GET'])
 def listen():
-    def stream():
-        messages = announcer.listen()  # returns a queue.Queue
-        while True:
-            msg = messages.get()  # blocks until a new message arrives
-            yield msg
-    return Response(stream(), mimetype='text/event-stream')
+    """ event stream of the meter given by ?meter= (default_meter, "all" for every meter),
+        a reconnecting browser sends Last-Event-ID and gets the missed events
+    """
+    if role == "worker":
+        # the events are published in the ingest process
+        return flask.redirect("%s://%s:%d/listen?%s" % (freq.scheme, freq.host.split(':')[0], stream_port,
+                                                         freq.query_string.decode()), code=307)
+    last_id = freq.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = freq.args.get('lastEventId', type=int)
+    channel = sse.select_channel(freq.args.get("meter"), default_meter)
+    return Response(sse.stream(announcer, last_id, sse_heartbeat, channel), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def parse_reading(content) -> dict:
+    """
+    :param content: record {"timestamp": iso, "energyNT": kWh, "energyHT": kWh, "power": W},
+                    optional "meter": configured meter id, default_meter if missing
+    :return: reading dict with a datetime timestamp
+
+    Raises ValueError for records which can not be stored.
+    """
+    if not isinstance(content, dict):
+        raise ValueError("record is not an object")
+    try:
+        dt = datetime.datetime.fromisoformat(content["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("missing or invalid timestamp")
+    meter_id = content.get("meter") or default_meter
+    if meter_id not in meters:
+        raise ValueError("unknown meter")
+    reading = {"timestamp": dt, "meter": meter_id}
+    for key in ("energyNT", "energyHT", "power"):
+        value = content.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError("%s is not a number" % key)
+        reading[key] = value
+    return reading
+
+
+def parse_batch(body: str):
+    """ returns the records of a JSON array or NDJSON body, None if it is neither """
+    try:
+        content = json.loads(body)
+        return content if isinstance(content, list) else None
+    except ValueError:
+        pass
+    records = []
+    for line in body.splitlines():
+        line = line.strip()
+        if line:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+    return records or None
 
 
 @app.route('/input', methods=['GET', 'POST'])
 def inputdata():
+    """ adapter for external producers: a single reading is handed to the ingest queue,
+        a JSON array or NDJSON body is stored as one batch
+    """
     answer = "Failed"
     content = freq.get_json(silent=True, cache=False)
-    if content:
-        print(content)
-        dt = datetime.datetime.fromisoformat(content["timestamp"])
-        if content["power"]:
-            dbm.append_current_power(ts=dt, power=content["power"])
-            # msg = format_sse(data=str(current_power))
-            # msg = format_sse(data="reload")
-            announcer.announce(msg=format_sse(data="reload"))
-        if content["energyNT"] and content["energyHT"]:
-            dbm.append_data(ts=dt, energy1=content["energyNT"], energy2=content["energyHT"], power=content["power"])
-            answer = "Success"           
-    return answer
+    if isinstance(content, dict):
+        log.debug("Input %s", content)
+        try:
+            reading = parse_reading(content)
+        except ValueError:
+            return answer
+        ingest_queue.start().put(reading)
+        if reading["energyNT"] and reading["energyHT"]:
+            answer = "Success"
+        return answer
+    records = content if isinstance(content, list) else parse_batch(freq.get_data(as_text=True))
+    if records is None:
+        return answer
+    return input_batch(records)
+
+
+def input_batch(records):
+    readings = []
+    errors = []
+    for i, record in enumerate(records):
+        try:
+            reading = parse_reading(record)
+            if not (reading["energyNT"] and reading["energyHT"]):
+                raise ValueError("energyNT and energyHT are required")
+            readings.append(reading)
+        except ValueError as e:
+            errors.append({"record": i, "error": str(e)})
+    if errors:
+        return Response(json.dumps({"inserted": 0, "errors": errors}), status=400, mimetype='application/json')
+    try:
+        if role == "worker":
+            inserted = ingest_queue.call("batch", readings)
+        else:
+            inserted = store_batch(readings)
+    except RuntimeError as e:
+        return Response(json.dumps({"inserted": 0, "errors": [str(e)]}), status=500, mimetype='application/json')
+    return Response(json.dumps({"inserted": inserted}), mimetype='application/json')
                                
 
+def store_batch(readings) -> int:
+    """ stores the readings of every meter in the batch, returns the number inserted """
+    by_meter = {}
+    for r in readings:
+        by_meter.setdefault(r.get("meter") or default_meter, []).append(r)
+    total = 0
+    for meter_id, group in by_meter.items():
+        manager = managers[meter_id]
+        inserted = manager.append_batch(group)
+        with live.writing() if live is not None else contextlib.nullcontext():
+            # samples older than the newest live value are ignored by the buffers
+            for r in sorted(group, key=lambda r: r["timestamp"]):
+                if r["power"]:
+                    manager.append_current_power(ts=r["timestamp"], power=r["power"])
+        if inserted:
+            # history changed, the charts have to be fetched again
+            announcer.publish("reload", {"meter": meter_id, "inserted": inserted}, channel=meter_id)
+        total += inserted
+    return total
+
+
 @app.route('/test', methods=['GET', 'POST'])
 def test():
-    content = flask.request.values
-    if content:
-        print("##### Got content items: #####")
-        for k, v in content.items():
-            print('Key = {} and Value = {}'.format(k, v))
-
-    files = flask.request.files
-    if files:
-        print("##### Got files: #####")
-        for k, v in files.items():
-            print('Key = {} and Value = {}'.format(k, v))
-
-    maybe_json = flask.request.get_json(silent=True, cache=False)
-    if maybe_json:
-        print("##### Got json: #####")
-        thejson = json.dumps(maybe_json, ensure_ascii=False, indent=4)
-        print('thejson = ' + thejson)
-    else:
-        thejson = "no json"
-        print('thejson = ' + thejson)
-
-    args = flask.request.args  # args is ?user=john
-    if args:
-        print("##### Got args: #####")
-        for k, v in args.items():
-            print('Args with Key = {} and Value = {}'.format(k, v))
-
-    form = flask.request.form    # key/value sets
-    if form:
-        print("##### Got form data: #####")
-        for k, v in form.items():
-            print('Form with Key = {} and Value = {}'.format(k, v))
-
-    print("##### Data as text content: #####")
-    print(flask.request.get_data(as_text=True))
-    print("mimetype = %s" % flask.request.mimetype)
-    print("%s" % flask.request.content_length)
-    print("from Server: %s" % flask.request.host)
+    """ logs what a client sent, at debug level """
+    request = flask.request
+    for name, items in (("content item", request.values), ("file", request.files),
+                        ("arg", request.args), ("form field", request.form)):
+        for k, v in items.items():
+            log.debug("Got %s %s = %s", name, k, v)
+    maybe_json = request.get_json(silent=True, cache=False)
+    log.debug("Got json: %s", json.dumps(maybe_json, ensure_ascii=False, indent=4) if maybe_json else "no json")
+    log.debug("Data as text content: %s", request.get_data(as_text=True))
+    log.debug("mimetype = %s, content length = %s, from server %s",
+              request.mimetype, request.content_length, request.host)
     answer = "200"
-    
+
     return answer
 
 
 @app.route('/', methods=['GET', 'POST'])
+@response_cache.cached
 def home():
     content = freq.values
     if content:
         for item in content.items():
-            print(item)
-    currentvalues = json.loads(queryData())
-    ts = datetime.datetime.now()
-    power_line = set_multiline(dbm.get_curr_power_list())
-    print(power_line)
-    if current_power <= 500:
-        currentlevel = "low"
-    elif current_power <= 2000:
-        currentlevel = "middle"
-    else:
-        currentlevel = "high"
+            log.debug("Home got %s", item)
+    try:
+        meter_id = meter_arg()
+        size = size_arg()
+    except ValueError:
+        return Response("unknown meter or chart size", status=404)
+    currentvalues = json.loads(queryData(meter_id))
+    values = live_values(meter_id)
+    currentlevel = power_level(values["power"])
+    with chart_lock:
+        charts = {res: chart.fragment() for res, chart in sync_charts(meter_id, size).items()}
 
     return render_template('home.html', currentvalues=currentvalues, currentlevel=currentlevel,
-                           current_power=current_power, current_dt=current_dt,
-                           power_line=power_line, cpl=dbm.get_curr_power_list())
+                           current_power=values["power"], current_dt=values["datetime"],
+                           charts=charts, chart=power_charts[meter_id][size]["minute"], chart_size=size,
+                           stream_port=stream_port, meter_id=meter_id, meters=list(meters))
 
 @app.route('/current')
+@response_cache.cached
 def current_use():
-    return Response(json.dumps(dbm.get_curr_power_list()), mimetype='application/json')
+    """ chart points of the last hour, with ?resolution=sample|minute|quarter[&from=]
+        the ring buffer of that resolution as columns; ?meter= selects the meter
+    """
+    resolution = freq.args.get("resolution")
+    try:
+        meter_id = meter_arg()
+        if resolution is None:
+            return Response(json.dumps(power_list(meter_id)), mimetype='application/json')
+        if resolution not in livebuffer.RESOLUTIONS:
+            raise ValueError(resolution)
+        since = parse_time_arg(freq.args.get("from"))
+    except ValueError:
+        return Response('{"error": "invalid parameter"}', status=400, mimetype="application/json")
+    ts, power = live_series(meter_id, resolution, since)
+    return Response(json.dumps({"resolution": resolution, "ts": ts.tolist(),
+                                "power": power.astype(np.float64).round(1).tolist()}),
+                    mimetype='application/json')
+
+@app.route('/graph/<name>.png')
+def graph(name):
+    """ history graph rendered in the background by graph_renderer """
+    if name not in graphs.GRAPHS:
+        return Response("unknown graph", status=404)
+    path = graph_renderer.path(name)
+    if not os.path.exists(path):
+        return Response("not rendered yet", status=503, headers={"Retry-After": str(graph_interval)})
+    return flask.send_file(path, mimetype="image/png", max_age=graph_interval, conditional=True)
+
+
+@app.route('/chart/<resolution>.svg')
+@response_cache.cached
+def chart_svg(resolution):
+    """ live chart of the meter given by ?meter= in the size given by ?size= as standalone svg """
+    try:
+        meter_id = meter_arg()
+        size = size_arg()
+    except ValueError:
+        return Response("unknown meter or chart size", status=404)
+    if resolution not in live_charts:
+        return Response("unknown chart", status=404)
+    with chart_lock:
+        svg = sync_charts(meter_id, size)[resolution].svg()
+    return Response(svg, mimetype='image/svg+xml')
+
+
+def parse_time_arg(value):
+    """ epoch seconds or iso string from a query parameter -> int epoch, None if empty """
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return epoch(datetime.datetime.fromisoformat(value))
+
+
+def meter_arg() -> str:
+    """ meter id of the ?meter= query parameter, default_meter if empty; raises ValueError for unknown meters """
+    meter_id = freq.args.get("meter") or default_meter
+    if meter_id not in meters:
+        raise ValueError("unknown meter '%s'" % meter_id)
+    return meter_id
+
+
+def query_rollup(table, start=None, end=None, limit=60, cursor=None, meter_id=None) -> tuple:
+    """
+    :param meter_id: meter of the rows, default_meter if None
+    :param start: first bucket (epoch, inclusive)
+    :param end: last bucket (epoch, exclusive)
+    :param limit: rows returned
+    :param cursor: ts of the last row of the previous page, rows older than it follow
+    :return: (rows newest first with consumption per bucket, cursor of the next page or None)
+
+    Keyset pagination on the (meter_id, ts) index, only limit + 1 rows are read.
+    """
+    t = table.__table__
+    query = db.select(t.c.ts, t.c.energy1, t.c.energy2, t.c.used1, t.c.used2) \
+        .where(t.c.meter_id == (meter_id or default_meter))
+    if start is not None:
+        query = query.where(t.c.ts >= start)
+    if end is not None:
+        query = query.where(t.c.ts < end)
+    if cursor is not None:
+        query = query.where(t.c.ts < cursor)
+    # one row more than needed: its counters give the consumption of the oldest row
+    rows = db.session.execute(query.order_by(t.c.ts.desc()).limit(limit + 1)).fetchall()
+    if not rows:
+        return [], None
+    data = np.array([r[:3] for r in rows], dtype=np.float64)
+    stored = np.array([r[3:] for r in rows], dtype=np.float64)
+    # rows written before the rollup engine have no used columns, take the counter difference
+    delta = data[:-1, 1:] - data[1:, 1:]
+    used = stored[:-1]
+    used = np.where(np.isnan(used), delta, used)
+    result = []
+    for i, r in enumerate(rows[:limit]):
+        val = {"ts": convTime(r[0])["str"], "Strom_NT": round(r[1], 3), "Strom_HT": round(r[2], 3)}
+        if i < len(used):
+            val["used_NT"] = round(float(used[i, 0]), 3)
+            val["used_HT"] = round(float(used[i, 1]), 3)
+        elif r[3] is not None:
+            val["used_NT"] = round(r[3], 3)
+            val["used_HT"] = round(r[4], 3)
+        result.append(val)
+    # the epoch, the local time string of a row is ambiguous in the repeated hour in autumn
+    next_cursor = rows[limit - 1][0] if len(result) == limit else None
+    return result, next_cursor
+
 
 @app.route('/get/<command>')
+@response_cache.cached
 def getDbValue(command):
-    resultList = []
-    valList = []
-
-    if command == "minute":
-        valList = db.session.query(MinuteTable).order_by(MinuteTable.id.desc()).all()
-    elif command == "hour":
-        valList = db.session.query(HourTable).order_by(HourTable.id.desc()).all()
-    elif command == "day":
-        valList = db.session.query(DayTable).order_by(DayTable.id.desc()).all()
-    elif command == "month":
-        valList = db.session.query(MonthTable).order_by(MonthTable.id.desc()).all()
-
-    if valList:
-        lastVal = {}
-        max = 60 if len(valList) >= 60 else len(valList)
-        for i in range(max):
-            ts = valList[i].timestamp
-            energyNT = round(valList[i].energy1, 3)
-            energyHT = round(valList[i].energy2, 3)
-            currentVal = {"ts": ts, "Strom_NT": energyNT, "Strom_HT": energyHT}
-            if lastVal:
-                currentVal["used_NT"] = round(lastVal["Strom_NT"] - currentVal["Strom_NT"], 3)
-                currentVal["used_HT"] = round(lastVal["Strom_HT"] - currentVal["Strom_HT"], 3)
-            resultList.append(currentVal)
-            lastVal = currentVal
+    """ query parameters: meter, from, to (epoch or iso), limit (default 60), cursor (from X-Next-Cursor) """
+    table = rollup_tables.get(command)
+    if table is None:
+        return Response("{}", mimetype="application/json")
+    try:
+        meter_id = meter_arg()
+        start = parse_time_arg(freq.args.get("from"))
+        end = parse_time_arg(freq.args.get("to"))
+        cursor = parse_time_arg(freq.args.get("cursor"))
+        limit = min(max(int(freq.args.get("limit", 60)), 1), 1000)
+    except ValueError:
+        return Response('{"error": "invalid parameter"}', status=400, mimetype="application/json")
+    resultList, next_cursor = query_rollup(table, start, end, limit, cursor, meter_id)
 
     if resultList:
-        return Response(json.dumps(resultList, indent=2), mimetype='application/json')
+        response = Response(json.dumps(resultList, indent=2), mimetype='application/json')
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        return response
     else:
         return Response("{}", mimetype="application/json")
 
 
+# approximate bucket length in seconds, raw samples come every sensor_delay seconds
+series_resolutions = [("month", 30 * 86400), ("day", 86400), ("hour", 3600), ("minute", 60)]
+
+
+def pick_resolution(start, end, points) -> str:
+    """ coarsest resolution which still gives points buckets between start and end """
+    for res, seconds in series_resolutions:
+        if (end - start) / seconds >= points:
+            return res
+    return "raw"
+
+
+def query_series(start, end, resolution, meter_id) -> dict:
+    """ power series of a meter in [start, end) as numpy arrays ts, power, power_min, power_max """
+    if resolution == "raw":
+        data = query_raw(start, end, meter_id)
+        return {"ts": data["ts"], "power": data["power"], "power_min": data["power"], "power_max": data["power"]}
+    t = rollup_tables[resolution].__table__
+    query = db.select(t.c.ts, t.c.power_avg, t.c.power_min, t.c.power_max) \
+        .where(t.c.meter_id == meter_id).where(t.c.ts >= start).where(t.c.ts < end).order_by(t.c.ts)
+    rows = db.session.execute(query).fetchall()
+    if not rows:
+        return {"ts": np.empty(0, dtype=np.int64), "power": np.empty(0), "power_min": np.empty(0),
+                "power_max": np.empty(0)}
+    data = np.array(rows, dtype=np.float64)
+    return {"ts": data[:, 0].astype(np.int64), "power": data[:, 1], "power_min": data[:, 2], "power_max": data[:, 3]}
+
+
+@app.route('/api/series')
+@response_cache.cached
+def series():
+    """ query parameters: meter, from, to (epoch or iso, default last 24h), points (default 800),
+        mode=lttb (points [ts, power]) or minmax (points [ts, min, max]),
+        resolution to override the automatic choice
+    """
+    try:
+        meter_id = meter_arg()
+        end = parse_time_arg(freq.args.get("to"))
+        if end is None:
+            end = epoch(datetime.datetime.now())
+        start = parse_time_arg(freq.args.get("from"))
+        if start is None:
+            start = end - 86400
+        points = min(max(int(freq.args.get("points", 800)), 3), 10000)
+    except ValueError:
+        return Response('{"error": "invalid parameter"}', status=400, mimetype="application/json")
+    mode = freq.args.get("mode", "lttb")
+    if mode not in ("lttb", "minmax"):
+        return Response('{"error": "unknown mode"}', status=400, mimetype="application/json")
+    resolution = freq.args.get("resolution") or pick_resolution(start, end, points)
+    if resolution != "raw" and resolution not in rollup_tables:
+        return Response('{"error": "unknown resolution"}', status=400, mimetype="application/json")
+    data = query_series(start, end, resolution, meter_id)
+    valid = ~np.isnan(data["power"])
+    ts = data["ts"][valid]
+    if mode == "minmax":
+        lo = np.where(np.isnan(data["power_min"]), data["power"], data["power_min"])[valid]
+        hi = np.where(np.isnan(data["power_max"]), data["power"], data["power_max"])[valid]
+        x, lo, hi = downsample.minmax(ts, lo, hi, points)
+        values = [[int(t), round(a, 1), round(b, 1)] for t, a, b in zip(x.tolist(), lo.tolist(), hi.tolist())]
+    else:
+        x, y = downsample.lttb(ts, data["power"][valid], points)
+        values = [[int(t), round(v, 1)] for t, v in zip(x.tolist(), y.tolist())]
+    answer = {"from": start, "to": end, "resolution": resolution, "mode": mode,
+              "rows": int(valid.sum()), "points": values}
+    return Response(json.dumps(answer), mimetype='application/json')
+
+
+def retention_loop(interval=86400):
+    """ moves raw samples older than raw_retention_days into the archive of their meter once a day """
+    while True:
+        for meter_id in meters:
+            try:
+                writer.flush()
+                manager = managers[meter_id]
+                if manager.store is not None:
+                    moved = archive.apply_store_retention(manager.store, meter_archive_dir(meter_id),
+                                                          raw_retention_days)
+                else:
+                    moved = archive.apply_retention(db.engine, PowerLog.__table__, meter_archive_dir(meter_id),
+                                                    raw_retention_days, meter_id=meter_id)
+                if moved:
+                    log.info("Archived %d raw samples of meter %s", moved, meter_id)
+            except Exception as e:
+                log.error("Retention of meter %s failed: %s", meter_id, e)
+        time.sleep(interval)
+
+
+def query_raw(start=None, end=None, meter_id=None) -> dict:
+    """ raw samples of a meter (default_meter) in [start, end) (epoch seconds) from the archive and the db
+        or raw store as numpy arrays
+    """
+    return managers[meter_id or default_meter].query_raw(start, end)
+
+
+@app.route('/api/report')
+@response_cache.cached
+def report():
+    """ query parameters: meter, from, to (epoch or iso, default the last 14 days)
+        per day NT/HT kWh, cost, base load, peak windows, load profile and the same weekday
+        one week before, per week the consumption and the change to the week before
+    """
+    try:
+        meter_id = meter_arg()
+        end = parse_time_arg(freq.args.get("to"))
+        if end is None:
+            end = epoch(datetime.datetime.now()) + 1
+        start = parse_time_arg(freq.args.get("from"))
+    except ValueError:
+        return Response('{"error": "invalid parameter"}', status=400, mimetype="application/json")
+    start = day_start(datetime.datetime.fromtimestamp(start) if start is not None else
+                      day_start() - datetime.timedelta(days=13))
+    # one week more for the comparisons of the first days
+    reports = query_reports(epoch(start - datetime.timedelta(days=7)), end, meter_id)
+    days, weeks = [], []
+    if reports:
+        ts = np.array([r["ts"] for r in reports], dtype=np.int64)
+        used = np.array([r["used1"] + r["used2"] for r in reports])
+        before, weeks = analytics.week_over_week(ts, used)
+        for r, total, prev in zip(reports, used.tolist(), before.tolist()):
+            if r["ts"] < epoch(start):
+                continue
+            r.update(used=round(total, 4), cost=round(analytics.cost(r["used1"], r["used2"], tariff), 2),
+                     week_before=None if prev != prev else round(prev, 4),
+                     change=round(total / prev - 1, 4) if prev == prev and prev else None)
+            days.append(r)
+        weeks = [w for w in weeks if w["from"] + 7 * 86400 > epoch(start)]
+    used1 = sum(d["used1"] for d in days)
+    used2 = sum(d["used2"] for d in days)
+    answer = {"meter": meter_id, "from": epoch(start), "to": end, "tariff": tariff,
+              "total": {"used1": round(used1, 4), "used2": round(used2, 4),
+                        "cost": round(analytics.cost(used1, used2, tariff, len(days)), 2)},
+              "days": days, "weeks": weeks}
+    return Response(json.dumps(answer), mimetype='application/json')
+
+
+@app.route('/api/meters')
+@response_cache.cached
+def meter_list():
+    """ live values of every configured meter, the first one is shown when a request names none """
+    answer = [dict(live_values(meter_id), meter=meter_id, source=meters[meter_id]) for meter_id in meters]
+    return Response(json.dumps(answer), mimetype='application/json')
+
+
 @app.route('/api/<command>')
 def api(command):
-    if command == "listdb":
+    if command == "raw":
+        start = freq.args.get("from", type=int)
+        end = freq.args.get("to", type=int)
+        try:
+            meter_id = meter_arg()
+        except ValueError:
+            return Response('{"error": "invalid parameter"}', status=400, mimetype="application/json")
+        data = query_raw(start, end, meter_id)
+        power = [None if p != p else p for p in data["power"].tolist()]
+        answer = [{"ts": t, "energy1": e1, "energy2": e2, "power": p} for t, e1, e2, p in
+                  zip(data["ts"].tolist(), data["energy1"].tolist(), data["energy2"].tolist(), power)]
+        return Response(json.dumps(answer), mimetype='application/json')
+    elif command == "listdb":
         answer = db.session.query(PowerLog).all()
         return answer
     elif command == "val1h":
@@ -654,16 +1132,177 @@ def api(command):
         return answer
 
 
-def run_app():
-
-    if platform.system() == "Linux" and 'ttyUSB0' in os.listdir('/dev'):
-        ''' dirname = os.environ['/dev']
-            objects = os.listdir(dirname)'''
-        t1 = Thread(target=powermeter, args=[sensor_delay,])
-        t1.start()
+# request metrics are kept by every http worker, everything else by the ingest process
+request_seconds = metrics.histogram("smartserver_http_request_seconds", "request latency per route",
+                                    labels=("route", "method", "status"))
+metrics.counter("smartserver_http_cache_hits_total", "responses served from the response cache",
+                function=lambda: response_cache.hits)
+metrics.counter("smartserver_http_cache_misses_total", "responses rendered by the view",
+                function=lambda: response_cache.misses)
+metrics.gauge("smartserver_ingest_queue_depth", "readings waiting for the ingest consumer",
+              function=lambda: ingest_queue.depth())
+metrics.counter("smartserver_ingest_readings_total", "readings by result", labels=("result",),
+                function=lambda: {("processed",): ingest_queue.processed, ("failed",): ingest_queue.failed,
+                                  ("dropped",): ingest_queue.dropped})
+metrics.gauge("smartserver_db_writer_queue_depth", "row groups waiting for the db writer",
+              function=lambda: writer.depth())
+metrics.counter("smartserver_rollup_late_samples_total", "samples older than the open rollup bucket",
+                labels=("meter",),
+                function=lambda: {(meter_id,): manager.rollups.late for meter_id, manager in managers.items()})
+metrics.counter("smartserver_sse_events_total", "events published", function=lambda: announcer.last_id)
+metrics.gauge("smartserver_sse_listeners", "connected event stream clients", labels=("server",),
+              function=lambda: {("thread",): announcer.count(),
+                                ("stream",): stream_server.clients if stream_server else None})
+metrics.counter("smartserver_sse_dropped_listeners_total", "event stream clients which could not keep up",
+                labels=("server", "reason"),
+                function=lambda: {("thread", "full"): announcer.dropped,
+                                  ("stream", "slow"): stream_server.slow_clients if stream_server else None,
+                                  ("stream", "timeout"): stream_server.timeouts if stream_server else None})
+metrics.counter("smartserver_graph_renders_total", "history graphs rendered", function=lambda: graph_renderer.renders)
+metrics.gauge("smartserver_graph_render_seconds", "duration of the last graph render",
+              function=lambda: graph_renderer.last_render_seconds)
+metrics.counter("smartserver_log_suppressed_total", "log messages suppressed by the rate limit",
+                function=lambda: logs.rate_limit.suppressed)
+
+
+def is_http_metric(name) -> bool:
+    return name.startswith("smartserver_http_")
+
+
+def ingest_metrics(payload=None) -> str:
+    """ metrics of the ingest process, called by http workers through the remote queue """
+    return metrics.render(include=lambda name: not is_http_metric(name))
+
+
+@app.before_request
+def _start_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    start = flask.g.get("request_start")
+    if start is not None:
+        route = freq.url_rule.rule if freq.url_rule is not None else "unmatched"
+        request_seconds.observe(time.perf_counter() - start, route=route, method=freq.method,
+                                status=response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """ Prometheus text format; an http worker adds its own request metrics,
+        labeled with the worker number, to those of the ingest process
+    """
+    if role == "worker":
+        try:
+            text = ingest_queue.call("metrics", None, timeout=10)
+        except RuntimeError as e:
+            return Response("# %s\n" % e, status=503, content_type=metrics.CONTENT_TYPE)
+        text += metrics.render(include=is_http_metric, labels={"worker": ingest_queue.worker})
     else:
-        t1 = Thread(target=pm_simulator, args=[sensor_delay,])
-        t1.start()
+        text = metrics.render()
+    return Response(text, content_type=metrics.CONTENT_TYPE)
+
+
+def may_profile() -> bool:
+    if profile_token:
+        return profile_token in (freq.headers.get("X-Profile-Token"), freq.args.get("profile_token"))
+    return freq.remote_addr in ("127.0.0.1", "::1")
+
+
+@app.before_request
+def _start_profile():
+    """ X-Profile: cprofile|collapsed header or ?profile= profiles this request,
+        the response names the file in X-Profile-File
+    """
+    fmt = freq.headers.get("X-Profile") or freq.args.get("profile")
+    if fmt is None or freq.path.startswith("/profile/") or not may_profile():
+        return
+    label = freq.url_rule.endpoint if freq.url_rule is not None else "unmatched"
+    flask.g.profile = profiling.RequestProfile(profile_dir, fmt.lower(), label).start()
+
+
+@app.after_request
+def _finish_profile(response):
+    profile = flask.g.pop("profile", None)
+    if profile is not None:
+        # a streamed body is produced after this hook, the profile covers the view only
+        response.headers["X-Profile-File"] = os.path.basename(profile.finish())
+    return response
+
+
+# a cached response would leave nothing to profile
+response_cache.bypass = lambda: "profile" in flask.g
+
+
+def profile_ingest(payload) -> str:
+    """ starts a profile of the ingest process, called by http workers through the remote queue
+    :param payload: {"seconds": ..., "format": "cprofile" or "collapsed"}
+    :return: path of the file written when it is done
+    """
+    if payload["format"] == "collapsed":
+        names = profile_threads + tuple("meter-%s" % meter_id for meter_id in meters)
+        return profiling.sample_threads(profile_dir, names, payload["seconds"])
+    return profiling.profile_queue(profile_dir, ingest_queue, payload["seconds"])
+
+
+@app.route('/profile/ingest', methods=['GET', 'POST'])
+def profile_ingest_endpoint():
+    """ query parameters: seconds (default 10), format=cprofile (default) or collapsed;
+        returns 202 at once, the file is written when the seconds are over
+    """
+    if not may_profile():
+        return Response('{"error": "forbidden"}', status=403, mimetype="application/json")
+    try:
+        seconds = min(max(float(freq.args.get("seconds", 10)), 0.1), profile_max_seconds)
+    except ValueError:
+        return Response('{"error": "invalid parameter"}', status=400, mimetype="application/json")
+    fmt = freq.args.get("format", "cprofile")
+    if fmt not in profiling.FORMATS:
+        return Response('{"error": "unknown format"}', status=400, mimetype="application/json")
+    payload = {"seconds": seconds, "format": fmt}
+    try:
+        if role == "worker":
+            path = ingest_queue.call("profile", payload, timeout=10)
+        else:
+            path = profile_ingest(payload)
+    except ingest.NoAnswer as e:
+        return Response(json.dumps({"error": str(e)}), status=503, mimetype="application/json")
+    except RuntimeError as e:
+        return Response(json.dumps({"error": str(e)}), status=409, mimetype="application/json")
+    log.info("Profiling the ingest process for %.1f s into %s", seconds, path)
+    answer = {"file": os.path.basename(path), "seconds": seconds, "format": fmt}
+    return Response(json.dumps(answer), status=202, mimetype="application/json")
+
+
+def start_ingest():
+    """ starts one reader per meter, the ingest consumer, the retention and report jobs and the stream server """
+    ingest_queue.start()
+    for meter_id, spec in meters.items():
+        source = meter.make_source(spec, delay=sensor_delay, obis=meter_obis.get(meter_id),
+                                   start_values=functools.partial(last_energy_values, meter_id))
+        Thread(target=meter_reader, args=[meter_id, source], name="meter-%s" % meter_id, daemon=True).start()
+    Thread(target=retention_loop, daemon=True).start()
+    Thread(target=report_loop, name="reports", daemon=True).start()
+    if stream_port:
+        global stream_server
+        stream_server = streamserver.StreamServer(announcer, port=stream_port, heartbeat=sse_heartbeat,
+                                                  default_channel=default_meter).start()
+    graph_renderer.start(delay=graph_interval)
+
+
+def startup_thread():
+    create_app()
+    start_ingest()
+
+
+def run_app():
+    """ development server, use serve.py in production """
+    # the reloader runs this module in a watcher and a child process, only the child
+    # initializes, in the background so the socket is open at once
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        Thread(target=startup_thread, name="startup", daemon=True).start()
     app.run(host='0.0.0.0', port=app_port, debug=True, use_reloader=True, threaded=True)
 
 
@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+
+# SML (smart message language) decoder for the EMH ED300L and compatible meters.
+# Works on raw bytes: frames are cut out of a bytearray with the escape
+# sequences, checked against their CRC and decoded by walking the TLV tree.
+import sys
+import time
+
+ESCAPE = b'\x1b\x1b\x1b\x1b'
+START = ESCAPE + b'\x01\x01\x01\x01'
+END = ESCAPE + b'\x1a'
+
+# OBIS keys as used by the original hex search loop
+OBIS_ENERGY1 = '0100010801ff'   # 1.8.1 counter value tariff 1 (NT)
+OBIS_ENERGY2 = '0100010802ff'   # 1.8.2 counter value tariff 2 (HT)
+OBIS_POWER = '0100100700ff'     # 16.7.0 topical consume
+# reading field: OBIS key, a meter with other registers (e.g. 2.8.0 of a PV meter) passes its own
+OBIS_KEYS = {"energyNT": OBIS_ENERGY1, "energyHT": OBIS_ENERGY2, "power": OBIS_POWER}
+
+SML_GET_LIST_RESPONSE = 0x0701
+
+# TL types
+_OCTET = 0
+_BOOL = 4
+_INT = 5
+_UINT = 6
+_LIST = 7
+
+
+class SmlError(Exception):
+    """ raised for frames which can not be decoded """
+
+
+def _crc_table() -> list:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data) -> int:
+    """
+    :param data: bytes-like object
+    :return: CRC-16/X-25 in the byte order SML transmits it
+    """
+    crc = 0xffff
+    for b in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ b) & 0xff]
+    crc ^= 0xffff
+    return ((crc & 0xff) << 8) | (crc >> 8)
+
+
+def obis_name(key: str) -> str:
+    """
+    :param key: OBIS key as hex string, e.g. '0100010801ff'
+    :return: readable form, e.g. '1-0:1.8.1*255'
+    """
+    o = bytes.fromhex(key)
+    if len(o) != 6:
+        return key
+    return "%d-%d:%d.%d.%d*%d" % tuple(o)
+
+
+def _read_tl(buf, pos: int):
+    b = buf[pos]
+    pos += 1
+    typ = (b >> 4) & 0x07
+    length = b & 0x0f
+    n_tl = 1
+    while b & 0x80:
+        b = buf[pos]
+        pos += 1
+        length = (length << 4) | (b & 0x0f)
+        n_tl += 1
+    return typ, length, n_tl, pos
+
+
+def parse_tlv(buf, pos: int = 0):
+    """
+    :param buf: bytes or memoryview holding SML data
+    :param pos: offset of the TL field
+    :return: tuple (value, new position)
+
+    Decodes one SML element. Lists become python lists, octet strings bytes,
+    integers int. Optional (0x01) and end of message (0x00) become None.
+    """
+    try:
+        typ, length, n_tl, pos = _read_tl(buf, pos)
+        if typ == _LIST:
+            items = []
+            for _ in range(length):
+                item, pos = parse_tlv(buf, pos)
+                items.append(item)
+            return items, pos
+        size = length - n_tl
+        if size < 0:
+            if typ == _OCTET and length == 0:
+                return None, pos
+            raise SmlError("invalid length %d at %d" % (length, pos))
+        end = pos + size
+        if end > len(buf):
+            raise SmlError("element at %d exceeds buffer" % pos)
+        raw = bytes(buf[pos:end])
+        if typ == _OCTET:
+            value = raw if size else None
+        elif typ == _UINT:
+            value = int.from_bytes(raw, 'big')
+        elif typ == _INT:
+            value = int.from_bytes(raw, 'big', signed=True)
+        elif typ == _BOOL:
+            value = bool(raw[0]) if raw else None
+        else:
+            raise SmlError("unknown type %d at %d" % (typ, pos))
+        return value, end
+    except IndexError:
+        raise SmlError("unexpected end of data at %d" % pos)
+
+
+def parse_messages(body, check_crc: bool = True) -> list:
+    """
+    :param body: unescaped frame content between start and end sequence
+    :param check_crc: verify the CRC of every message
+    :return: list of message bodies as [tag, content]
+    """
+    body = memoryview(body)
+    messages = []
+    pos = 0
+    while pos < len(body):
+        if body[pos] == 0x00:  # fill bytes
+            pos += 1
+            continue
+        msg_start = pos
+        typ, length, n_tl, pos = _read_tl(body, pos)
+        if typ != _LIST or length != 6:
+            raise SmlError("no SML message at %d" % msg_start)
+        fields = []
+        for _ in range(4):
+            value, pos = parse_tlv(body, pos)
+            fields.append(value)
+        crc_end = pos
+        crc, pos = parse_tlv(body, pos)
+        _, pos = parse_tlv(body, pos)  # end of message
+        if check_crc and crc is not None and crc16(body[msg_start:crc_end]) != crc:
+            raise SmlError("message CRC mismatch at %d" % msg_start)
+        messages.append(fields[3])
+    return messages
+
+
+def scaled(value: int, scaler: int, shift: int = 0):
+    """
+    :param value: raw value of a list entry
+    :param scaler: power of ten of the list entry
+    :param shift: additional power of ten to divide by (3 for Wh -> kWh)
+    :return: value * 10 ** (scaler - shift)
+    """
+    exp = (scaler or 0) - shift
+    if exp < 0:
+        return value / 10 ** -exp
+    return value * 10 ** exp
+
+
+def decode_body(body, check_crc: bool = True) -> dict:
+    """
+    :param body: unescaped frame content
+    :return: dict {obis_key: {"value": raw, "scaler": int, "unit": int}}
+    """
+    values = {}
+    for message in parse_messages(body, check_crc):
+        if not message or message[0] != SML_GET_LIST_RESPONSE:
+            continue
+        val_list = message[1][4] or []
+        for entry in val_list:
+            obj_name, status, val_time, unit, scaler, value, signature = entry
+            if obj_name is None:
+                continue
+            values[obj_name.hex()] = {"value": value, "scaler": scaler, "unit": unit}
+    return values
+
+
+def unescape(data) -> bytes:
+    return bytes(data).replace(ESCAPE + ESCAPE, ESCAPE)
+
+
+def decode_frame(frame, check_crc: bool = True) -> dict:
+    """
+    :param frame: complete frame starting with START, optionally with trailer
+    :param check_crc: verify message and (if present) frame CRC
+    :return: see decode_body()
+    """
+    frame = bytes(frame)
+    if not frame.startswith(START):
+        raise SmlError("frame does not start with escape sequence")
+    end = frame.rfind(END)
+    if end < 0:
+        raise SmlError("frame without end sequence")
+    padding = 0
+    if len(frame) >= end + 8:
+        padding = frame[end + 5]
+        if check_crc and crc16(frame[:end + 6]) != int.from_bytes(frame[end + 6:end + 8], 'big'):
+            raise SmlError("frame CRC mismatch")
+    body = unescape(frame[len(START):end])
+    if padding:
+        body = body[:-padding]
+    return decode_body(body, check_crc)
+
+
+def reading(values: dict, obis=None) -> dict:
+    """
+    :param values: result of decode_frame()
+    :param obis: optional {field: OBIS key} replacing entries of OBIS_KEYS
+    :return: dict {"energyNT": kWh, "energyHT": kWh, "power": W}, missing values are None
+    """
+    keys = dict(OBIS_KEYS, **obis) if obis else OBIS_KEYS
+
+    def get(key, shift=0):
+        entry = values.get(key)
+        if entry is None or not isinstance(entry["value"], int):
+            return None
+        return scaled(entry["value"], entry["scaler"], shift)
+
+    return {"energyNT": get(keys["energyNT"], 3), "energyHT": get(keys["energyHT"], 3),
+            "power": get(keys["power"])}
+
+
+class SmlFrameBuffer:
+    """ feed() takes raw bytes as they come from the serial port
+        and returns the complete frames found so far
+    """
+    def __init__(self, max_size=16384):
+        self.buf = bytearray()
+        self.max_size = max_size
+        self.scan = 0           # offset up to which the current frame was searched
+        self.dropped = 0        # bytes thrown away while resyncing
+
+    def feed(self, data) -> list:
+        self.buf += data
+        frames = []
+        while True:
+            start = self.buf.find(START)
+            if start < 0:
+                keep = len(START) - 1
+                if len(self.buf) > keep:
+                    self.dropped += len(self.buf) - keep
+                    del self.buf[:len(self.buf) - keep]
+                self.scan = 0
+                break
+            if start > 0:
+                self.dropped += start
+                del self.buf[:start]
+                self.scan = 0
+            frame_len = self._find_end()
+            if frame_len is None:
+                if len(self.buf) > self.max_size:
+                    # no end within a sane size, resync on the next start
+                    self.dropped += 1
+                    del self.buf[:1]
+                    self.scan = 0
+                    continue
+                break
+            if frame_len > 0:
+                frames.append(bytes(self.buf[:frame_len]))
+                del self.buf[:frame_len]
+            self.scan = 0
+        return frames
+
+    def _find_end(self):
+        """ returns the length of the frame at the start of the buffer,
+            0 if a new start sequence interrupted it or None if incomplete
+        """
+        buf = self.buf
+        pos = max(self.scan, len(START))
+        while True:
+            pos = buf.find(ESCAPE, pos)
+            if pos < 0:
+                self.scan = max(len(START), len(buf) - len(ESCAPE) + 1)
+                return None
+            if pos % 4:
+                pos += 1
+                continue
+            if len(buf) < pos + 8:
+                self.scan = pos
+                return None
+            tag = buf[pos + 4]
+            if tag == 0x1a:
+                return pos + 8
+            if buf[pos + 4:pos + 8] == ESCAPE:
+                pos += 8
+            elif buf[pos:pos + 8] == START:
+                self.dropped += pos
+                del buf[:pos]
+                return 0
+            else:
+                pos += 4
+
+
+def read_frames(port, chunk_size=256):
+    """
+    :param port: opened serial.Serial (or anything with read() and in_waiting)
+    :return: generator of complete raw frames
+
+    Reads whatever is waiting in bulk instead of byte by byte.
+    """
+    frame_buffer = SmlFrameBuffer()
+    while True:
+        waiting = getattr(port, 'in_waiting', 0)
+        data = port.read(min(waiting, chunk_size) if waiting else 1)
+        if not data:
+            continue
+        for frame in frame_buffer.feed(data):
+            yield frame
+
+
+def frames_from_hexdump(path: str) -> list:
+    """ reads frames from a capture like textscratch.txt, one hex frame per line """
+    frames = []
+    hex_start = START.hex()
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith(hex_start):
+                continue
+            try:
+                frames.append(bytes.fromhex(line))
+            except ValueError:
+                continue
+    return frames
+
+
+if __name__ == "__main__":
+    capture = sys.argv[1] if len(sys.argv) > 1 else 'textscratch.txt'
+    frames = frames_from_hexdump(capture)
+    failed = 0
+    t0 = time.perf_counter()
+    for fr in frames:
+        try:
+            r = reading(decode_frame(fr))
+        except SmlError:
+            failed += 1
+    elapsed = time.perf_counter() - t0
+    print("%d frames, %d failed, %.1f frames/s" % (len(frames), failed, len(frames) / elapsed if elapsed else 0))
+    if frames:
+        for key, entry in decode_frame(frames[-1]).items():
+            print(obis_name(key), entry)
+        print(reading(decode_frame(frames[-1])))
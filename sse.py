@@ -1,62 +1,171 @@
+import collections
+import json
 import queue
+from threading import Lock
 
-def format_sse(data: str, event=None) -> str:
+
+def format_sse(data: str, event=None, event_id=None) -> str:
     msg = f'data: {data}\n\n'
     if event is not None:
         msg = f'event: {event}\n{msg}'
+    if event_id is not None:
+        msg = f'id: {event_id}\n{msg}'
     return msg
 
+
+HEARTBEAT = ': keepalive\n\n'
+DROPPED = None  # last item in the queue of a listener which was dropped, stream() ends there
+ALL = "all"     # channel argument of a client which wants the events of every channel
+
+
+def select_channel(value, default=None):
+    """ channel a client asked for, ALL gives None which receives everything """
+    if value == ALL:
+        return None
+    return value or default
+
+
+def receives(listening, channel) -> bool:
+    """ whether a client listening to channel listening (None: all) gets an event of channel """
+    return listening is None or channel is None or listening == channel
+
+
 # # # SSE Function message announcer # # #
 class MessageAnnouncer:
     """ listen() will be called by clients to receive notifications
-        announce() takes messages and announces them to listeners
+        publish() sends a typed json event with an id to all listeners,
+        the last buffer_size events are kept so reconnecting clients
+        can resume from their Last-Event-ID.
+        An event published on a channel (e.g. a meter id) only reaches the
+        listeners of that channel and those listening to all; events without
+        a channel reach everyone. Ids are counted across all channels.
     """
-    def __init__(self):
+    def __init__(self, buffer_size=200, queue_size=20):
         self.listeners = []
+        self.lock = Lock()
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.queue_size = queue_size
+        self.last_id = 0
+        self.dropped = 0
+        self.subscribers = []
 
-    def listen(self):
-        q = queue.Queue(maxsize=5)
-        self.listeners.append(q)
+    def listen(self, last_event_id=None, channel=None):
+        """
+        :param last_event_id: id of the last event the client has seen
+        :param channel: channel to receive, None for all
+        :return: queue.Queue receiving the formatted messages
+        """
+        q = queue.Queue(maxsize=self.queue_size + self.buffer.maxlen)
+        with self.lock:
+            if last_event_id is not None:
+                if (self.buffer and last_event_id < self.buffer[0][0] - 1) or last_event_id > self.last_id:
+                    # missed more than the buffer holds or ids from before a restart,
+                    # let the client start over
+                    q.put_nowait(format_sse(data=json.dumps({}), event="reload"))
+                else:
+                    for event_id, event_channel, msg in self.buffer:
+                        if event_id > last_event_id and receives(channel, event_channel):
+                            q.put_nowait(msg)
+            self.listeners.append((q, channel))
         return q
 
+    def subscribe(self, callback):
+        """ callback(event_id, msg, channel) is called for every buffered and every new event,
+            from the publishing thread, it must not block
+        """
+        with self.lock:
+            for event_id, channel, msg in self.buffer:
+                callback(event_id, msg, channel)
+            self.subscribers.append(callback)
+
+    def unlisten(self, q):
+        with self.lock:
+            self.listeners = [(listener, channel) for listener, channel in self.listeners if listener is not q]
+
+    def publish(self, event: str, data: dict, channel=None) -> int:
+        """ returns the id of the event """
+        with self.lock:
+            self.last_id += 1
+            msg = format_sse(data=json.dumps(data), event=event, event_id=self.last_id)
+            self.buffer.append((self.last_id, channel, msg))
+            self._send(msg, channel)
+            for callback in self.subscribers:
+                callback(self.last_id, msg, channel)
+            return self.last_id
+
     def announce(self, msg):
+        """ sends a preformatted message without id, it is not replayed """
+        with self.lock:
+            self._send(msg)
+
+    def heartbeat(self):
+        self.announce(HEARTBEAT)
+
+    def count(self) -> int:
+        return len(self.listeners)
+
+    def _send(self, msg, channel=None):
         for i in reversed(range(len(self.listeners))):
+            q, listening = self.listeners[i]
+            if not receives(listening, channel):
+                continue
             try:
-                self.listeners[i].put_nowait(msg)
+                q.put_nowait(msg)
             except queue.Full:
+                # the client does not read anymore, it reloads when it does again
                 del self.listeners[i]
+                self.dropped += 1
+                self._drop(q)
 
+    @staticmethod
+    def _drop(q):
+        """ replaces the backlog of a dropped listener by a reload event and DROPPED """
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(format_sse(data=json.dumps({}), event="reload"))
+        q.put_nowait(DROPPED)
+
+
+def stream(announcer, last_event_id=None, heartbeat=15, channel=None):
+    """ generator for a text/event-stream response, sends a heartbeat
+        comment when nothing happened for heartbeat seconds
+    """
+    messages = announcer.listen(last_event_id, channel)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                msg = messages.get(timeout=heartbeat)
+            except queue.Empty:
+                yield HEARTBEAT
+                continue
+            if msg is DROPPED:
+                return
+            yield msg
+    finally:
+        announcer.unlisten(messages)
 
-announcer = MessageAnnouncer()
-announcer.announce(msg=format_sse(data="reload"))
 
 # flask sse listener to include into app
 '''
 @app.route('/listen', methods=['GET'])
 def listen():
-    def stream():
-        messages = announcer.listen()  # returns a queue.Queue
-        while True:
-            msg = messages.get()  # blocks until a new message arrives
-            yield msg
-    return Response(stream(), mimetype='text/event-stream')
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    return Response(sse.stream(announcer, last_id), mimetype='text/event-stream')
 '''
 
-# javascript function to receive sse announces and act on page
+# javascript function to receive sse events and act on page
 '''
 <script>
-   function sse() {
-        var source = new EventSource('/listen');
-        var out = document.getElementById('out');
-        source.onmessage = function(e) {
-          if (e.data.includes('reload')) {
-            window.location.reload(true);
-          } else {
-            out.textContent =  e.data + '\n' + out.textContent;
-            alert(e.data);
-          }
-          out.textContent =  e.data + '\n' + out.textContent;
-        };
-   }
-   sse();
-</script>'''
\ No newline at end of file
+   var source = new EventSource('/listen');
+   source.addEventListener('power', function(e) {
+       var data = JSON.parse(e.data);
+       document.getElementById('current-power').textContent = data.power + ' W';
+   });
+   source.addEventListener('reload', function(e) {
+       window.location.reload(true);
+   });
+</script>'''
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+# Asyncio server for the event stream: one event loop serves every /listen
+# client instead of one thread per open EventSource. Events come from the
+# threaded sse.MessageAnnouncer into a ring buffer and every client keeps its
+# own position in it. A client which cannot keep up gets the missed events in
+# one write when its socket drains again; if it fell out of the buffer it is
+# counted as slow and told to reload instead of being dropped silently.
+# /listen?meter=id streams the channel of one meter, meter=all every channel.
+import asyncio
+import collections
+import itertools
+import json
+from threading import Event, Thread
+from urllib.parse import parse_qs, urlsplit
+
+import sse
+
+
+class StreamServer:
+    """ start() runs the server in its own thread, stats() returns the counters """
+    def __init__(self, announcer, host="0.0.0.0", port=8001, buffer_size=1000, heartbeat=15,
+                 write_timeout=30, write_buffer=65536, allow_origin="*", default_channel=None):
+        """
+        :param announcer: sse.MessageAnnouncer which publishes the events
+        :param buffer_size: events kept for slow and reconnecting clients
+        :param heartbeat: seconds without events before a keepalive comment is sent
+        :param write_timeout: seconds a client may block a write before it is disconnected
+        :param write_buffer: bytes buffered per client before writes wait for the socket
+        :param allow_origin: CORS header, the page is served by the http workers on another port
+        :param default_channel: channel of clients which name none, None streams every channel
+        """
+        self.announcer = announcer
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.write_timeout = write_timeout
+        self.write_buffer = write_buffer
+        self.allow_origin = allow_origin
+        self.default_channel = default_channel
+        self.events = collections.deque(maxlen=buffer_size)
+        self.last_id = 0
+        self.loop = None
+        self.changed = None
+        self.thread = None
+        self.ready = Event()
+        self.clients = 0
+        self.peak_clients = 0
+        self.connections = 0
+        self.slow_clients = 0
+        self.resyncs = 0
+        self.timeouts = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = Thread(target=asyncio.run, args=(self.serve(),), name="streamserver", daemon=True)
+            self.thread.start()
+            self.ready.wait(10)
+        return self
+
+    def stats(self) -> dict:
+        return {"clients": self.clients, "peak_clients": self.peak_clients, "connections": self.connections,
+                "slow_clients": self.slow_clients, "resyncs": self.resyncs, "timeouts": self.timeouts, "last_event_id": self.last_id}
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.announcer.subscribe(self._from_thread)
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        if self.port == 0:
+            self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def _from_thread(self, event_id, msg, channel=None):
+        self.loop.call_soon_threadsafe(self._append, event_id, msg.encode(), channel)
+
+    def _append(self, event_id, data, channel=None):
+        self.events.append((event_id, channel, data))
+        self.last_id = event_id
+        # wakes every waiting client, clearing does not affect the woken ones
+        self.changed.set()
+        self.changed.clear()
+
+    def _pending(self, cursor, channel=None) -> tuple:
+        """ bytes to send to a client of channel at cursor, its new position and whether it fell out of the buffer """
+        first = self.events[0][0] if self.events else self.last_id + 1
+        if cursor < first - 1:
+            self.resyncs += 1
+            return sse.format_sse(data=json.dumps({}), event="reload").encode(), self.last_id, True
+        events = itertools.islice(self.events, cursor - first + 1, None)
+        return b"".join(data for _, event_channel, data in events if sse.receives(channel, event_channel)), \
+            self.last_id, False
+
+    async def _handle(self, reader, writer):
+        try:
+            method, target, headers = await asyncio.wait_for(self._read_request(reader), 10)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        url = urlsplit(target)
+        try:
+            if method != "GET":
+                await self._respond(writer, "405 Method Not Allowed", "text/plain", b"GET only\n")
+            elif url.path == "/listen":
+                query = parse_qs(url.query)
+                last_id = headers.get("last-event-id") or query.get("lastEventId", [None])[0]
+                channel = sse.select_channel(query.get("meter", [None])[0], self.default_channel)
+                await self._stream(writer, int(last_id) if last_id and last_id.isdigit() else None, channel)
+            elif url.path == "/listen/stats":
+                await self._respond(writer, "200 OK", "application/json", json.dumps(self.stats()).encode())
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", b"not found\n")
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader) -> tuple:
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _respond(self, writer, status, mimetype, body):
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                      "Access-Control-Allow-Origin: %s\r\nConnection: close\r\n\r\n"
+                      % (status, mimetype, len(body), self.allow_origin)).encode() + body)
+        await writer.drain()
+
+    async def _stream(self, writer, last_id, channel=None):
+        writer.transport.set_write_buffer_limits(high=self.write_buffer)
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                      "Access-Control-Allow-Origin: %s\r\nX-Accel-Buffering: no\r\n\r\nretry: 3000\n\n"
+                      % self.allow_origin).encode())
+        cursor = self.last_id if last_id is None else last_id
+        if cursor > self.last_id:
+            # ids from before a restart, the page has to start over
+            writer.write(sse.format_sse(data=json.dumps({}), event="reload").encode())
+            cursor = self.last_id
+        self.clients += 1
+        self.connections += 1
+        self.peak_clients = max(self.peak_clients, self.clients)
+        slow = False
+        try:
+            while True:
+                if cursor < self.last_id:
+                    data, cursor, lagged = self._pending(cursor, channel)
+                    if lagged and not slow:
+                        slow = True
+                        self.slow_clients += 1
+                    if not data:
+                        # only events of other channels
+                        continue
+                else:
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), self.heartbeat)
+                        continue
+                    except asyncio.TimeoutError:
+                        data = sse.HEARTBEAT.encode()
+                writer.write(data)
+                try:
+                    await asyncio.wait_for(writer.drain(), self.write_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise
+        finally:
+            self.clients -= 1
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+
+@pytest.fixture
+def timezone(monkeypatch):
+    """ timezone("Europe/Berlin") switches the local time of the process until the test ends """
+    def set_timezone(name):
+        monkeypatch.setenv("TZ", name)
+        time.tzset()
+    yield set_timezone
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """ the smartserver module on an empty db in a temporary directory, readings are only stored by the tests """
+    tmp = tmp_path_factory.mktemp("server")
+    # tests which store rows use a meter of their own
+    os.environ.update(SMARTSERVER_DB=str(tmp / "power.db"),
+                      SMARTSERVER_METERS="main=simulator,reports=simulator,pv=simulator,archived=simulator,"
+                                         "series=simulator,charts=simulator,batch=simulator,meter2=simulator,"
+                                         "meter3=simulator",
+                      SMARTSERVER_ARCHIVE=str(tmp / "archive"), SMARTSERVER_RAW_DIR=str(tmp / "raw"),
+                      SMARTSERVER_GRAPHS=str(tmp / "graphs"), SMARTSERVER_PROFILES=str(tmp / "profiles"))
+    import smartserver
+    smartserver.create_app()
+    return smartserver
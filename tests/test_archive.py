@@ -0,0 +1,62 @@
+import calendar
+import os
+import time
+
+import numpy as np
+
+import archive
+import rawstore
+
+
+def old_samples():
+    """ every 10 minutes from 2024-01-30 to 2024-02-02, power with one decimal and some missing """
+    start = calendar.timegm((2024, 1, 30, 0, 0, 0))
+    ts = list(range(start, start + 3 * 86400, 600))
+    power = [None if i % 17 == 0 else round(100 + i * 0.7, 1) for i in range(len(ts))]
+    return ts, [1000 + i / 100 for i in range(len(ts))], [2000 + i / 100 for i in range(len(ts))], power
+
+
+def test_retention_moves_old_samples_and_reads_them_back(server):
+    ts, e1, e2, power = old_samples()
+    recent = int(time.time()) - 86400
+    rows = [(server.PowerLog, {"meter_id": "archived", "ts": t, "energy1": a, "energy2": b, "power": p})
+            for t, a, b, p in zip(ts + [recent], e1 + [5000.0], e2 + [6000.0], power + [294.9])]
+    server.writer.add_group(rows)
+    assert server.writer.flush(timeout=30)
+    directory = server.meter_archive_dir("archived")
+    moved = archive.apply_retention(server.db.engine, server.PowerLog.__table__, directory, 90, vacuum=False,
+                                    meter_id="archived")
+    assert moved == len(ts)
+    assert archive.months(directory) == [(2024, 1), (2024, 2)]
+    t = server.PowerLog.__table__
+    with server.db.engine.connect() as conn:
+        left = conn.execute(server.db.select(t.c.ts).where(t.c.meter_id == "archived")).fetchall()
+    assert [r[0] for r in left] == [recent]
+    answer = server.app.test_client().get("/api/raw?meter=archived&from=%d&to=%d" % (ts[0], recent + 1)).get_json()
+    assert [r["ts"] for r in answer] == ts + [recent]
+    assert [r["power"] for r in answer] == power + [294.9]
+    assert [r["energy1"] for r in answer] == e1 + [5000.0]
+
+
+def test_float32_archive_files_read_as_written(tmp_path):
+    ts, e1, e2, power = old_samples()
+    power = np.array([np.nan if p is None else p for p in power])
+    np.savez_compressed(archive.month_path(str(tmp_path), 2024, 1), ts=np.array(ts, dtype=np.int64),
+                        energy1=np.array(e1), energy2=np.array(e2), power=power.astype(np.float32))
+    data = archive.load_range(str(tmp_path))
+    assert data["power"].dtype == np.float64
+    assert np.array_equal(data["power"], power, equal_nan=True)
+
+
+def test_store_retention(tmp_path):
+    ts, e1, e2, power = old_samples()
+    store = rawstore.RawStore(str(tmp_path / "main.raw"))
+    recent = int(time.time()) - 86400
+    store.extend(rawstore.records_of(ts + [recent], e1 + [5000.0], e2 + [6000.0], power + [294.9]))
+    directory = str(tmp_path / "archive")
+    assert archive.apply_store_retention(store, directory, 90) == len(ts)
+    assert store.records()["ts"].tolist() == [recent]
+    data = archive.combine(archive.load_range(directory), store.query())
+    assert data["ts"].tolist() == ts + [recent]
+    assert [None if p != p else p for p in data["power"].tolist()] == power + [294.9]
+    assert os.path.exists(archive.month_path(directory, 2024, 2))
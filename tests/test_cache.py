@@ -0,0 +1,88 @@
+import datetime
+
+import flask
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def app():
+    app = flask.Flask(__name__)
+    app.response_cache = cache.ResponseCache(maxsize=2)
+    app.calls = []
+
+    @app.route("/value")
+    @app.response_cache.cached
+    def value():
+        app.calls.append(flask.request.args.get("n"))
+        if flask.request.args.get("n") == "missing":
+            return flask.Response("no", status=404)
+        response = flask.Response('{"n": %s}' % flask.request.args.get("n"), mimetype="application/json")
+        response.headers["X-Next-Cursor"] = "42"
+        return response
+    return app
+
+
+def test_cached_until_bump(app):
+    client = app.test_client()
+    first = client.get("/value?n=1")
+    assert client.get("/value?n=1").get_data() == first.get_data()
+    assert app.calls == ["1"]
+    assert app.response_cache.hits == 1
+    app.response_cache.bump()
+    client.get("/value?n=1")
+    assert app.calls == ["1", "1"]
+
+
+def test_etag_answers_304(app):
+    client = app.test_client()
+    first = client.get("/value?n=1")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+    again = client.get("/value?n=1", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.get_data() == b""
+    assert again.headers["ETag"] == etag
+    # a new data version with the same body keeps the etag
+    app.response_cache.bump()
+    assert client.get("/value?n=1", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/value?n=2", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_headers_and_mimetype_are_kept(app):
+    client = app.test_client()
+    client.get("/value?n=1")
+    cached = client.get("/value?n=1")
+    assert cached.mimetype == "application/json"
+    assert cached.headers["X-Next-Cursor"] == "42"
+
+
+def test_errors_are_not_cached_and_old_entries_go(app):
+    client = app.test_client()
+    client.get("/value?n=missing")
+    client.get("/value?n=missing")
+    assert app.calls == ["missing", "missing"]
+    for n in ("1", "2", "3", "1"):
+        client.get("/value?n=" + n)
+    assert app.calls[2:] == ["1", "2", "3", "1"]
+
+
+def test_other_process_version(app):
+    version = [0]
+    app.response_cache.source = lambda: version[0]
+    client = app.test_client()
+    client.get("/value?n=1")
+    client.get("/value?n=1")
+    version[0] += 1
+    client.get("/value?n=1")
+    assert app.calls == ["1", "1"]
+
+
+def test_new_reading_changes_the_etag_of_a_route(server):
+    client = server.app.test_client()
+    first = client.get("/api/meters")
+    assert client.get("/api/meters", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    server.store_reading({"timestamp": datetime.datetime.now(), "meter": "main", "energyNT": 7.0,
+                          "energyHT": 8.0, "power": 1234.0})
+    assert server.writer.flush(timeout=30)
+    assert client.get("/api/meters", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
@@ -0,0 +1,71 @@
+import datetime
+import json
+import re
+import threading
+
+import pytest
+
+import powerchart
+
+
+def store(server, start, minutes):
+    for i in range(minutes * 6):
+        server.store_reading({"timestamp": start + datetime.timedelta(seconds=10 * i), "meter": "charts",
+                              "energyNT": 100.0 + i / 1000, "energyHT": 200.0, "power": 300.0 + i})
+    assert server.writer.flush(timeout=30)
+
+
+@pytest.mark.parametrize("size", sorted(powerchart.SIZES))
+def test_chart_of_every_size(server, size):
+    store(server, datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(minutes=10), 3)
+    svg = server.app.test_client().get("/chart/minute.svg?meter=charts&size=%s" % size).get_data(as_text=True)
+    width, height = powerchart.SIZES[size]
+    assert 'width="%d"' % width in svg
+    xs = [int(x) for x in re.findall(r'(\d+),\d+', re.search(r'points="([^"]*)"', svg).group(1))]
+    assert xs and max(xs) < width
+
+
+def test_unknown_size(server):
+    client = server.app.test_client()
+    assert client.get("/chart/minute.svg?meter=charts&size=huge").status_code == 404
+    assert client.get("/?meter=charts&size=huge").status_code == 404
+
+
+def test_point_event_carries_every_size(server):
+    q = server.announcer.listen(channel="charts")
+    store(server, datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(minutes=5), 3)
+    server.announcer.unlisten(q)
+    events = [q.get_nowait() for _ in range(q.qsize())]
+    points = [json.loads(m.split("data: ", 1)[1]) for m in events if "event: point" in m]
+    assert points
+    data = points[-1]
+    assert set(data["sizes"]) == set(powerchart.SIZES)
+    assert data["line"] == data["sizes"][server.screen_resolution]["line"]
+
+
+def test_readings_and_requests_share_the_charts(server):
+    errors = []
+    start = datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(minutes=3)
+
+    def read():
+        client = server.app.test_client()
+        try:
+            for _ in range(30):
+                for size in powerchart.SIZES:
+                    assert client.get("/chart/sample.svg?meter=charts&size=%s" % size).status_code == 200
+        except Exception as e:
+            errors.append(e)
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for t in readers:
+        t.start()
+    store(server, start, 2)
+    for t in readers:
+        t.join()
+    assert errors == []
+
+
+def test_home_embeds_the_chart_of_its_size(server):
+    store(server, datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(minutes=4), 2)
+    page = server.app.test_client().get("/?meter=charts&size=high").get_data(as_text=True)
+    assert 'viewbox="0 0 1600 600"' in page
+    assert "data.sizes['high']" in page
@@ -0,0 +1,65 @@
+import datetime
+import json
+
+import pytest
+
+
+def records(start, count, meter_id="batch"):
+    return [{"timestamp": (start + datetime.timedelta(minutes=i)).isoformat(), "meter": meter_id,
+             "energyNT": 100.0 + i / 100, "energyHT": 200.0, "power": 400.0 + i} for i in range(count)]
+
+
+def raw_ts(server, meter_id="batch") -> list:
+    assert server.writer.flush(timeout=30)
+    t = server.PowerLog.__table__
+    with server.db.engine.connect() as conn:
+        return [r[0] for r in conn.execute(server.db.select(t.c.ts).where(t.c.meter_id == meter_id)
+                                           .order_by(t.c.ts)).fetchall()]
+
+
+@pytest.fixture(scope="module")
+def client(server):
+    return server.app.test_client()
+
+
+def test_json_array(server, client):
+    batch = records(datetime.datetime(2020, 5, 1), 30)
+    response = client.post("/input", json=batch)
+    assert response.status_code == 200
+    assert response.get_json() == {"inserted": 30}
+    stored = raw_ts(server)
+    assert len(stored) == 30 and stored[0] == int(datetime.datetime(2020, 5, 1).timestamp())
+    minutes = server.MinuteTable.__table__
+    with server.db.engine.connect() as conn:
+        rollups = conn.execute(server.db.select(server.db.func.count()).select_from(minutes)
+                               .where(minutes.c.meter_id == "batch")).scalar()
+    assert rollups >= 29    # the last minute stays open
+
+
+def test_ndjson(server, client):
+    before = len(raw_ts(server))
+    body = "\n".join(json.dumps(r) for r in records(datetime.datetime(2020, 5, 2), 10)) + "\n"
+    response = client.post("/input", data=body, content_type="application/x-ndjson")
+    assert response.get_json() == {"inserted": 10}
+    assert len(raw_ts(server)) == before + 10
+
+
+def test_invalid_record_rejects_the_batch(server, client):
+    before = len(raw_ts(server))
+    batch = records(datetime.datetime(2020, 5, 3), 5)
+    batch[2]["energyNT"] = "a lot"
+    del batch[4]["timestamp"]
+    response = client.post("/input", json=batch)
+    assert response.status_code == 400
+    assert [e["record"] for e in response.get_json()["errors"]] == [2, 4]
+    body = json.dumps(records(datetime.datetime(2020, 5, 3), 1)[0]) + "\n{broken\n"
+    assert client.post("/input", data=body, content_type="application/x-ndjson").status_code == 400
+    assert len(raw_ts(server)) == before
+
+
+def test_single_reading_goes_through_the_ingest_queue(server, client):
+    before = len(raw_ts(server))
+    reading = records(datetime.datetime(2020, 5, 4), 1)[0]
+    assert client.post("/input", json=reading).get_data(as_text=True) == "Success"
+    server.ingest_queue.join()
+    assert len(raw_ts(server)) == before + 1
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import livebuffer
+
+START = 1_800_000_000 - 1_800_000_000 % 900
+
+
+def filled(count=3000, step=10):
+    ts = START + np.arange(count, dtype=np.int64) * step
+    power = (ts % 977).astype(np.float64)
+    buffers = livebuffer.LiveBuffers()
+    new_minutes = sum(buffers.append(int(t), float(p)) for t, p in zip(ts, power))
+    return buffers, ts, power, new_minutes
+
+
+def test_append_keeps_the_newest_samples_and_minute_means():
+    buffers, ts, power, new_minutes = filled()
+    assert new_minutes == 500
+    sample_ts, sample_power = buffers.view("sample", since=0)
+    assert sample_ts.tolist() == ts[-600:].tolist()
+    assert sample_power.tolist() == power[-600:].tolist()
+    minute_ts, minute_power = buffers.view("minute")
+    assert minute_ts.tolist() == list(range(START, int(ts[-1]) + 1, 60))
+    assert minute_power[:3].tolist() == pytest.approx([power[i * 6:i * 6 + 6].mean() for i in range(3)])
+    quarter_ts, _ = buffers.view("quarter")
+    assert np.all(np.diff(quarter_ts) == 900)
+
+
+@pytest.mark.parametrize("resolution", sorted(livebuffer.RESOLUTIONS))
+def test_load_equals_appends(resolution):
+    buffers, ts, power, _ = filled(count=20000)
+    loaded = livebuffer.LiveBuffers()
+    loaded.load(ts, power)
+    a, b = buffers.view(resolution, since=0), loaded.view(resolution, since=0)
+    assert a[0].tolist() == b[0].tolist()
+    assert a[1].tolist() == pytest.approx(b[1].tolist())
+    # the open bucket continues the same after a load
+    buffers.append(int(ts[-1]) + 5, 1000.0)
+    loaded.append(int(ts[-1]) + 5, 1000.0)
+    assert buffers.view(resolution)[1][-1] == pytest.approx(loaded.view(resolution)[1][-1])
+
+
+def test_views_are_slices_of_the_ring():
+    buffers, ts, _, _ = filled()
+    view_ts, view_power = buffers.view("sample")
+    assert np.shares_memory(view_ts, buffers.data["sample"]["ts"])
+    assert buffers.view("sample", since=int(ts[-10]))[0].tolist() == ts[-10:].tolist()
+    assert len(buffers.view("sample", since=int(ts[-1]) + 1)[0]) == 0
+
+
+def test_late_samples_are_ignored():
+    buffers, ts, _, _ = filled(count=100)
+    before = buffers.view("minute")[1].tolist()
+    assert not buffers.append(int(ts[0]) - 3600, 5000.0)
+    assert buffers.late == 2    # minute and quarter, the sample ring keeps everything
+    assert buffers.view("minute")[1].tolist() == before
+
+
+def test_rings_in_an_external_buffer():
+    memory = bytearray(livebuffer.layout.itemsize)
+    buffers, ts, _, _ = filled()
+    shared = livebuffer.LiveBuffers(memory)
+    shared.copy_from(buffers)
+    shared.append(int(ts[-1]) + 10, 42.0)
+    reader = livebuffer.LiveBuffers(memory)
+    assert reader.view("sample")[1][-1] == 42.0
+
+
+def test_nan_samples_are_not_loaded():
+    buffers = livebuffer.LiveBuffers()
+    buffers.load(np.array([START, START + 10, START + 20]), np.array([1.0, np.nan, 3.0]))
+    assert buffers.view("sample")[0].tolist() == [START, START + 20]
+    assert buffers.view("minute")[1].tolist() == [2.0]
@@ -0,0 +1,69 @@
+import calendar
+import datetime
+import json
+import os
+
+import pytest
+
+import meter
+
+CAPTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "textscratch.txt")
+
+
+def test_hex_capture_replay():
+    start = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    readings = list(meter.CaptureSource(CAPTURE, delay=10, speed=0, start=start))
+    assert len(readings) == 147
+    assert readings[0]["timestamp"] == start
+    assert readings[-1]["timestamp"] == start + datetime.timedelta(seconds=10 * 146)
+    assert readings[-1]["power"] == 294.9
+
+
+def test_json_capture_loops_with_increasing_time(tmp_path):
+    path = tmp_path / "capture.jsonl"
+    records = [{"timestamp": "2026-01-01T12:00:%02d" % s, "energyNT": 1.0 + s, "energyHT": 2.0, "power": 100.0}
+               for s in (0, 10, 20)]
+    path.write_text("\n".join(json.dumps(r) for r in records) + "\nnot json\n")
+    source = meter.CaptureSource(str(path), delay=10, speed=0, loop=True)
+    readings = []
+    for reading in source:
+        readings.append(reading)
+        if len(readings) == 7:
+            break
+    ts = [int(r["timestamp"].timestamp()) for r in readings]
+    assert ts == list(range(ts[0], ts[0] + 70, 10))
+    assert [r["energyNT"] for r in readings] == [1.0, 11.0, 21.0] * 2 + [1.0]
+
+
+def test_simulator_clock_through_repeated_hour(timezone):
+    timezone("Europe/Berlin")
+    start = datetime.datetime.fromtimestamp(calendar.timegm((2026, 10, 25, 0, 0, 0)))
+    source = meter.SimulatorSource(delay=60, speed=0, start=start, count=180)
+    ts = [int(r["timestamp"].timestamp()) for r in source.readings()]
+    assert ts == list(range(ts[0], ts[0] + 180 * 60, 60))
+
+
+def test_simulator_continues_the_counters():
+    source = meter.SimulatorSource(delay=10, speed=0, start=datetime.datetime(2026, 1, 1),
+                                   start_values=lambda: {"energy1": 500.0, "energy2": 600.0}, count=20)
+    readings = list(source)
+    assert len(readings) == 20
+    assert 500.0 < readings[0]["energyNT"] <= readings[-1]["energyNT"]
+    assert all(0 < r["power"] <= 1000 for r in readings)
+
+
+def test_make_source():
+    assert isinstance(meter.make_source("simulator@max"), meter.SimulatorSource)
+    replay = meter.make_source("replay:%s@1000" % CAPTURE)
+    assert isinstance(replay, meter.CaptureSource) and replay.speed == 1000
+    with pytest.raises(ValueError):
+        meter.make_source("modbus:1")
+
+
+def test_parse_meters():
+    assert meter.parse_meters(None) == {"main": "auto"}
+    assert meter.parse_meters("serial:/dev/ttyUSB1") == {"main": "serial:/dev/ttyUSB1"}
+    assert meter.parse_meters("main=serial, pv=replay:x.txt@10") == {"main": "serial", "pv": "replay:x.txt@10"}
+    for spec in ("a=simulator,a=simulator", "bad id=simulator"):
+        with pytest.raises(ValueError):
+            meter.parse_meters(spec)
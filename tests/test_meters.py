@@ -0,0 +1,46 @@
+import datetime
+
+
+def reading(dt, meter_id, energy, power):
+    return {"timestamp": dt.isoformat(), "meter": meter_id, "energyNT": energy, "energyHT": energy, "power": power}
+
+
+def test_batches_of_two_meters_stay_apart(server):
+    client = server.app.test_client()
+    start = datetime.datetime(2019, 3, 1)
+    batch = []
+    for i in range(120):
+        dt = start + datetime.timedelta(seconds=30 * i)
+        batch += [reading(dt, "meter2", 10.0 + i / 100, 100.0), reading(dt, "meter3", 900.0 + i, 5000.0)]
+    assert client.post("/input", json=batch).get_json() == {"inserted": 240}
+    frm, to = int(start.timestamp()), int(start.timestamp()) + 3600
+    rows = client.get("/get/minute?meter=meter2&from=%d&to=%d&limit=100" % (frm, to)).get_json()
+    assert len(rows) == 59
+    assert all(r["Strom_NT"] < 20 for r in rows)
+    raw = client.get("/api/raw?meter=meter2&from=%d&to=%d" % (frm, to)).get_json()
+    assert len(raw) == 120 and {r["power"] for r in raw} == {100.0}
+    series = client.get("/api/series?meter=meter3&from=%d&to=%d&resolution=minute" % (frm, to)).get_json()
+    assert {p[1] for p in series["points"]} == {5000.0}
+
+
+def test_live_values_and_events_per_meter(server):
+    q = server.announcer.listen(channel="meter2")
+    now = datetime.datetime.now().replace(microsecond=0)
+    server.store_reading({"timestamp": now, "meter": "meter2", "energyNT": 50.0, "energyHT": 50.0, "power": 222.0})
+    server.store_reading({"timestamp": now, "meter": "meter3", "energyNT": 2000.0, "energyHT": 2000.0,
+                          "power": 3333.0})
+    server.announcer.unlisten(q)
+    assert server.writer.flush(timeout=30)
+    messages = [q.get_nowait() for _ in range(q.qsize())]
+    assert messages and all('"meter": "meter2"' in m for m in messages)
+    meters = {m["meter"]: m for m in server.app.test_client().get("/api/meters").get_json()}
+    assert set(server.meters) == set(meters)
+    assert meters["meter2"]["power"] == 222.0
+    assert meters["meter3"]["power"] == 3333.0
+
+
+def test_unknown_meter(server):
+    client = server.app.test_client()
+    assert client.get("/get/minute?meter=nope").status_code == 400
+    assert client.get("/api/raw?meter=nope").status_code == 400
+    assert client.post("/input", json=[reading(datetime.datetime(2019, 1, 1), "nope", 1.0, 1.0)]).status_code == 400
@@ -0,0 +1,59 @@
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+import migrate
+
+# the tables as the server created them before the epoch columns
+OLD_SCHEMA = [
+    "CREATE TABLE power_log (id INTEGER PRIMARY KEY, timestamp VARCHAR NOT NULL, energy1 FLOAT NOT NULL, "
+    "energy2 FLOAT NOT NULL, power FLOAT)",
+    "CREATE TABLE minute_table (id INTEGER PRIMARY KEY, timestamp VARCHAR NOT NULL, energy1 FLOAT NOT NULL, "
+    "energy2 FLOAT NOT NULL)",
+]
+
+
+def indexes(engine, table) -> dict:
+    return {ix["name"]: ix["column_names"] for ix in inspect(engine).get_indexes(table)}
+
+
+def test_iso_timestamps_become_epoch_columns(server, timezone, tmp_path):
+    timezone("Europe/Berlin")
+    engine = create_engine("sqlite:///%s" % (tmp_path / "old.db"))
+    with engine.begin() as conn:
+        for ddl in OLD_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO power_log (timestamp, energy1, energy2, power) VALUES "
+                          "('2026-07-01T12:00:10', 1.5, 2.5, 300.0), ('2026-01-01 00:00:00', 1.0, 2.0, NULL)"))
+        conn.execute(text("INSERT INTO minute_table (timestamp, energy1, energy2) "
+                          "VALUES ('2026-07-01T12:00:00', 1.5, 2.5)"))
+    assert migrate.upgrade(engine, server.db.Model.metadata)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT meter_id, ts, energy1, power FROM power_log ORDER BY ts")).fetchall()
+        minute = conn.execute(text("SELECT meter_id, ts, used1 FROM minute_table")).fetchall()
+    assert [tuple(r) for r in rows] == [("main", int(time.mktime((2026, 1, 1, 0, 0, 0, 0, 0, -1))), 1.0, None),
+                                        ("main", int(time.mktime((2026, 7, 1, 12, 0, 10, 0, 0, -1))), 1.5, 300.0)]
+    assert [tuple(r) for r in minute] == [("main", int(time.mktime((2026, 7, 1, 12, 0, 0, 0, 0, -1))), None)]
+    assert indexes(engine, "power_log") == {"ix_power_log_meter_ts": ["meter_id", "ts"]}
+    assert indexes(engine, "minute_table") == {"ix_minute_table_meter_ts": ["meter_id", "ts"]}
+    assert not migrate.upgrade(engine, server.db.Model.metadata)
+
+
+def test_single_column_ts_index_is_dropped(server, tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "indexed.db"))
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE power_log (id INTEGER PRIMARY KEY, ts INTEGER NOT NULL, "
+                          "energy1 FLOAT NOT NULL, energy2 FLOAT NOT NULL, power FLOAT)"))
+        conn.execute(text("CREATE INDEX ix_power_log_ts ON power_log (ts)"))
+        conn.execute(text("CREATE INDEX by_hand ON power_log (power)"))
+    migrate.upgrade(engine, server.db.Model.metadata)
+    assert indexes(engine, "power_log") == {"ix_power_log_meter_ts": ["meter_id", "ts"], "by_hand": ["power"]}
+
+
+def test_queries_use_the_meter_ts_index(server):
+    t = server.PowerLog.__table__
+    query = server.db.select(t.c.ts).where(t.c.meter_id == "main", t.c.ts >= 0, t.c.ts < 10).order_by(t.c.ts)
+    sql = str(query.compile(server.db.engine, compile_kwargs={"literal_binds": True}))
+    with server.db.engine.connect() as conn:
+        plan = " ".join(str(r[-1]) for r in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    assert "ix_power_log_meter_ts" in plan
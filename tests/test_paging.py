@@ -0,0 +1,58 @@
+import calendar
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def minutes(server):
+    """ 250 minute rows of the default meter in 2001, consumption i / 1000 in row i """
+    start = calendar.timegm((2001, 1, 1, 0, 0, 0))
+    rows = []
+    energy = 100.0
+    for i in range(250):
+        energy += i / 1000
+        rows.append((server.MinuteTable, {"meter_id": server.default_meter, "ts": start + 60 * i,
+                                          "energy1": energy, "energy2": 0.0, "used1": i / 1000, "used2": 0.0}))
+    server.writer.add_group(rows)
+    assert server.writer.flush(timeout=30)
+    return start, [row for _, row in rows]
+
+
+def pages(client, url) -> list:
+    """ the rows of every page of url, following X-Next-Cursor """
+    result = []
+    cursor = ""
+    while True:
+        response = client.get(url + "&cursor=" + cursor)
+        assert response.status_code == 200
+        result.append(response.get_json() or [])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return result
+
+
+def test_keyset_pages_cover_every_row_once(server, minutes):
+    start, rows = minutes
+    found = pages(server.app.test_client(), "/get/minute?limit=100&from=%d&to=%d" % (start, start + 250 * 60))
+    assert [len(page) for page in found] == [100, 100, 50]
+    seen = [r for page in found for r in page]
+    assert [r["ts"] for r in seen] == [server.convTime(row["ts"])["str"] for row in reversed(rows)]
+    assert [r["used_NT"] for r in seen] == [round(row["used1"], 3) for row in reversed(rows)]
+
+
+def test_invalid_cursor_is_rejected(server, minutes):
+    response = server.app.test_client().get("/get/minute?cursor=yesterday")
+    assert response.status_code == 400
+
+
+def test_pages_through_the_repeated_hour(server, timezone):
+    timezone("Europe/Berlin")
+    start = calendar.timegm((2026, 10, 25, 0, 0, 0))
+    rows = [(server.MinuteTable, {"meter_id": server.default_meter, "ts": start + 60 * i, "energy1": 500.0 + i,
+                                  "energy2": 0.0, "used1": 1.0, "used2": 0.0}) for i in range(240)]
+    server.writer.add_group(rows)
+    assert server.writer.flush(timeout=30)
+    assert time.localtime(start + 60 * 239).tm_isdst == 0
+    found = pages(server.app.test_client(), "/get/minute?limit=50&from=%d&to=%d" % (start, start + 240 * 60))
+    assert [r["Strom_NT"] for page in found for r in page] == [500.0 + i for i in reversed(range(240))]
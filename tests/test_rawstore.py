@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+import rawstore
+
+
+def filled(path, n=100, start=1000):
+    store = rawstore.RawStore(str(path))
+    ts = np.arange(start, start + 10 * n, 10)
+    store.extend(rawstore.records_of(ts, ts / 10.0, ts / 20.0, np.where(ts % 70 == 0, np.nan, 500.0)))
+    return store
+
+
+def test_round_trip(tmp_path):
+    store = filled(tmp_path / "main.raw")
+    store.append(5000, 1.5, 2.5)
+    assert len(store) == 101
+    assert store.last() == {"ts": 5000, "energy1": 1.5, "energy2": 2.5, "power": None}
+    part = store.range(1100, 1200)
+    assert part["ts"].tolist() == list(range(1100, 1200, 10))
+    columns = store.query(1100, 1200)
+    assert columns["energy1"].tolist() == [t / 10.0 for t in range(1100, 1200, 10)]
+    assert sum(len(chunk[0]) for chunk in store.chunks(chunk_size=30)) == 101
+    store.close()
+    reopened = rawstore.RawStore(str(tmp_path / "main.raw"))
+    assert len(reopened) == 101
+    assert reopened.last()["ts"] == 5000
+
+
+def test_older_samples_merge_and_keep_held_views(tmp_path):
+    store = filled(tmp_path / "main.raw")
+    held = store.records()
+    before = held["ts"].tolist()
+    store.extend(rawstore.records_of([1005, 1010, 1995], [1.0, 2.0, 3.0], [0.0, 0.0, 0.0], [1.0, 2.0, 3.0]))
+    ts = store.records()["ts"].tolist()
+    assert ts == sorted(before + [1005, 1995])
+    assert store.range(1010, 1011)["energy1"].tolist() == [2.0]
+    assert store.rewrites == 1
+    assert held["ts"].tolist() == before
+
+
+def test_drop_before(tmp_path):
+    store = filled(tmp_path / "main.raw")
+    assert store.drop_before(1500) == 50
+    assert store.records()["ts"][0] == 1500
+    assert store.drop_before(1500) == 0
+
+
+def test_second_store_sees_appends_and_rewrites(tmp_path):
+    writer = filled(tmp_path / "main.raw")
+    reader = rawstore.RawStore(str(tmp_path / "main.raw"))
+    assert len(reader) == 100
+    writer.append(9000, 1.0, 1.0, 1.0)
+    assert reader.last()["ts"] == 9000
+    writer.drop_before(1500)
+    assert reader.records()["ts"][0] == 1500
+    assert len(reader) == 51
+
+
+def test_repair_of_overcounted_header(tmp_path):
+    path = tmp_path / "main.raw"
+    filled(path).close()
+    # a count written before records which never reached the disk
+    fd = os.open(str(path), os.O_RDWR)
+    os.pwrite(fd, np.array([150], dtype="<u8").tobytes(), rawstore._COUNT)
+    os.close(fd)
+    store = rawstore.RawStore(str(path))
+    assert len(store) == 100
+    store.append(99999, 1.0, 1.0, 1.0)
+    assert len(store) == 101
+
+
+def test_appends_are_synced_per_interval(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(rawstore.os, "fsync", synced.append)
+    store = rawstore.RawStore(str(tmp_path / "main.raw"), sync_interval=3600)
+    del synced[:]   # the new file
+    for t in range(100):
+        store.append(t, 1.0, 1.0, 1.0)
+    assert synced == []
+    store.close()
+    assert len(synced) == 1
+    store = rawstore.RawStore(str(tmp_path / "main.raw"), sync_interval=0)
+    store.append(100, 1.0, 1.0, 1.0)
+    store.append(101, 1.0, 1.0, 1.0)
+    assert len(synced) == 3
+    assert len(store) == 102
+
+
+def test_repair_of_records_lost_after_their_count(tmp_path):
+    path = tmp_path / "main.raw"
+    filled(path).close()
+    # the count of 5 more records reached the disk, their pages did not and read as zeros
+    with open(str(path), "ab") as f:
+        f.write(bytes(5 * rawstore.record.itemsize))
+    fd = os.open(str(path), os.O_RDWR)
+    os.pwrite(fd, np.array([105], dtype="<u8").tobytes(), rawstore._COUNT)
+    os.close(fd)
+    store = rawstore.RawStore(str(path))
+    assert len(store) == 100
+    assert store.last()["ts"] == 1990
@@ -0,0 +1,69 @@
+import math
+import os
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, select
+
+import archive
+import rebuild
+import rollup
+
+
+def samples(start, count, step=7, seed=4):
+    """ (ts, energy1, energy2, power) arrays, a sample every step seconds, some without power """
+    rng = np.random.default_rng(seed)
+    ts = start + np.arange(count, dtype=np.int64) * step
+    used = rng.uniform(0, 0.002, count)
+    power = rng.uniform(50, 4000, count)
+    power[rng.random(count) < 0.02] = math.nan
+    return ts, 1000 + np.cumsum(used), 2000 + np.cumsum(used[::-1]), power
+
+
+def chunks(data, size):
+    for i in range(0, len(data[0]), size):
+        yield tuple(column[i:i + size] for column in data)
+
+
+@pytest.mark.parametrize("size", [1, 333, 10000, 100000])
+def test_chunks_split_inside_minutes(timezone, size):
+    timezone("Europe/Berlin")
+    data = samples(1792800000, 20000)
+    assert rebuild.compute(chunks(data, size)) == rebuild.compute([data])
+
+
+def test_empty_log():
+    assert rebuild.compute([]) == {res: [] for res in rollup.RESOLUTIONS}
+
+
+@pytest.fixture
+def engine(server, tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "rebuild.db"))
+    server.db.Model.metadata.create_all(engine)
+    return engine
+
+
+def test_rebuild_reads_archive_and_db_of_one_meter(server, engine, tmp_path):
+    raw = server.PowerLog.__table__
+    tables = {res: t.__table__ for res, t in server.rollup_tables.items()}
+    data = samples(1780000000, 30000, step=20)
+    rows = [{"meter_id": "a", "ts": t, "energy1": e1, "energy2": e2, "power": None if p != p else p}
+            for t, e1, e2, p in zip(*(column.tolist() for column in data))]
+    other = {"meter_id": "b", "ts": 1780000000, "energy1": 1.0, "energy2": 1.0, "used1": 0.0, "used2": 0.0}
+    with engine.begin() as conn:
+        conn.execute(raw.insert(), rows[10000:])
+        conn.execute(tables["hour"].insert(), [other])
+    # the oldest third is archived, the first db sample is also in the archive
+    directory = str(tmp_path / "archive")
+    os.makedirs(directory)
+    old = {k: v[:10001] for k, v in zip(archive.FIELDS, data)}
+    archive.write_month(archive.month_path(directory, 2026, 5), old)
+    counts = rebuild.rebuild(engine, raw, tables, chunk_size=4096, archive_dir=directory, meter_id="a")
+    expected = rebuild.compute([data])
+    assert counts == {res: len(expected[res]) for res in rollup.RESOLUTIONS}
+    with engine.connect() as conn:
+        hours = conn.execute(select(tables["hour"]).where(tables["hour"].c.meter_id == "a")
+                             .order_by(tables["hour"].c.ts)).mappings().fetchall()
+        kept = conn.execute(select(tables["hour"].c.ts).where(tables["hour"].c.meter_id == "b")).fetchall()
+    assert [dict((k, r[k]) for k in expected["hour"][0]) for r in hours] == pytest.approx(expected["hour"])
+    assert len(kept) == 1
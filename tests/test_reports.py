@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+
+def local(*date) -> int:
+    return int(time.mktime(date + (0, 0, 0, 0, 0, -1)))
+
+
+def store_minutes(server, meter_id, start, end):
+    """ minute rows of 0.001 kWh NT and 0.002 kWh HT at 60 W mean power in [start, end) """
+    rows = [(server.MinuteTable, {"meter_id": meter_id, "ts": t, "energy1": 0.0, "energy2": 0.0,
+                                  "used1": 0.001, "used2": 0.002, "power_avg": 60.0, "samples": 6})
+            for t in range(start, end, 60)]
+    server.writer.add_group(rows)
+    assert server.writer.flush(timeout=30)
+
+
+def reports(server, meter_id) -> list:
+    t = server.DayReport.__table__
+    with server.db.engine.connect() as conn:
+        return conn.execute(server.db.select(t.c.ts, t.c.used1, t.c.used2).where(t.c.meter_id == meter_id)
+                            .order_by(t.c.ts)).fetchall()
+
+
+def test_reports_continue_after_the_long_autumn_day(server, timezone):
+    timezone("Europe/Berlin")
+    server.update_reports()     # days of the other meters
+    failed = server.writer.failed
+    store_minutes(server, "reports", local(2025, 10, 25), local(2025, 10, 27))
+    assert server.update_reports() == 2
+    store_minutes(server, "reports", local(2025, 10, 27), local(2025, 10, 29))
+    assert server.update_reports() == 2
+    assert server.update_reports() == 0
+    assert server.writer.failed == failed
+    days = reports(server, "reports")
+    assert [ts for ts, _, _ in days] == [local(2025, 10, d) for d in (25, 26, 27, 28)]
+    # the 25 hour day holds 1500 minutes
+    assert [round(used1, 3) for _, used1, _ in days] == [1.44, 1.5, 1.44, 1.44]
+
+
+def test_report_computed_again_replaces_the_stored_one(server, timezone):
+    timezone("Europe/Berlin")
+    failed = server.writer.failed
+    day = local(2025, 11, 3)
+    store_minutes(server, "reports", day, local(2025, 11, 4))
+    server.update_reports()
+    rows = [dict(r, meter_id="reports", peaks="[]", profile="[]")
+            for r in server.compute_reports(day, local(2025, 11, 4), "reports")]
+    ack = server.writer.add_group([(server.DayReport, r) for r in rows], ack=server.dbwriter.Ack())
+    assert ack.wait(timeout=30)
+    assert server.writer.failed == failed
+    assert [ts for ts, _, _ in reports(server, "reports")].count(day) == 1
+
+
+@pytest.mark.parametrize("day, hours", [((2026, 3, 29), 23), ((2026, 10, 25), 25)])
+def test_api_report_of_a_day(server, timezone, day, hours):
+    timezone("Europe/Berlin")
+    start = local(*day)
+    end = local(day[0], day[1], day[2] + 1)
+    assert (end - start) // 3600 == hours
+    store_minutes(server, "pv", start, end)
+    response = server.app.test_client().get("/api/report?meter=pv&from=%d&to=%d" % (start, end))
+    assert response.status_code == 200
+    days = response.get_json()["days"]
+    assert [d["ts"] for d in days] == [start]
+    assert days[0]["used1"] == pytest.approx(hours * 0.06)
+    assert days[0]["used2"] == pytest.approx(hours * 0.12)
@@ -0,0 +1,154 @@
+import calendar
+import datetime
+import math
+import random
+import time
+
+import numpy as np
+import pytest
+
+import rebuild
+import rollup
+import timeutil
+
+# (timezone, utc day) the second and third contain the switch to and from daylight saving time
+DAYS = [("UTC", (2026, 6, 15)), ("Europe/Berlin", (2026, 3, 29)), ("Europe/Berlin", (2026, 10, 25))]
+
+
+def samples(day, seed=1):
+    """ a sample every 10 s from the day before until the day after day, some without power """
+    rng = random.Random(seed)
+    start = calendar.timegm(day + (0, 0, 0)) - 86400
+    e1 = 1000.0
+    e2 = 2000.0
+    rows = []
+    for t in range(start, start + 3 * 86400, 10):
+        power = rng.uniform(100, 3000)
+        if rng.random() < 0.01:
+            power = None
+        if (t // 3600) % 24 < 12:
+            e1 += 0.001
+        else:
+            e2 += 0.001
+        rows.append((t, round(e1, 4), round(e2, 4), power))
+    return rows
+
+
+def rebuilt(rows) -> dict:
+    ts, e1, e2, power = zip(*rows)
+    power = [math.nan if p is None else p for p in power]
+    return rebuild.compute([(np.array(ts, dtype=np.int64), np.array(e1), np.array(e2), np.array(power))])
+
+
+def write(tables, closed):
+    """ stores closed rows by ts like the db does """
+    for resolution, row in closed:
+        tables[resolution][row["ts"]] = row
+
+
+def assert_same(live, rebuilt_rows):
+    """ the live engine closes coarse buckets one finer bucket later, so it may lag one row """
+    assert len(rebuilt_rows) - 1 <= len(live) <= len(rebuilt_rows)
+    for a, b in zip(live, rebuilt_rows):
+        assert a == pytest.approx(b)
+
+
+@pytest.mark.parametrize("tz, day", DAYS)
+def test_live_rollup_equals_rebuild(timezone, tz, day):
+    timezone(tz)
+    rows = samples(day)
+    engine = rollup.RollupEngine()
+    tables = {res: {} for res in rollup.RESOLUTIONS}
+    for t, e1, e2, power in rows:
+        write(tables, engine.add(datetime.datetime.fromtimestamp(t), e1, e2, power))
+    assert engine.late == 0
+    expected = rebuilt(rows)
+    for res in rollup.RESOLUTIONS:
+        assert_same(sorted(tables[res].values(), key=lambda r: r["ts"]), expected[res])
+    # the hours of the local day hold all of its samples, also on the 23 and 25 hour days
+    first = int(time.mktime(day + (0, 0, 0, 0, 0, -1)))
+    end = int(time.mktime(day[:2] + (day[2] + 1, 0, 0, 0, 0, 0, -1)))
+    hours = [r for r in expected["hour"] if first <= r["ts"] < end]
+    assert sum(r["samples"] for r in hours) == sum(1 for t, _, _, p in rows if first <= t < end and p is not None)
+    assert first in {r["ts"] for r in expected["day"]}
+
+
+def test_restart_in_repeated_hour(timezone):
+    """ reopening the buckets from the tables like update_values() in the second 02:30 of the night """
+    timezone("Europe/Berlin")
+    rows = samples((2026, 10, 25), seed=2)
+    restart = calendar.timegm((2026, 10, 25, 1, 30, 0))
+    tables = {res: {} for res in rollup.RESOLUTIONS}
+    engine = rollup.RollupEngine()
+    for t, e1, e2, power in rows:
+        if t >= restart:
+            break
+        write(tables, engine.add(t, e1, e2, power))
+
+    def last(res):
+        return tables[res][max(tables[res])] if tables[res] else None
+
+    engine = rollup.RollupEngine({res: last(res) for res in rollup.RESOLUTIONS})
+    for res, finer in (("month", "day"), ("day", "hour"), ("hour", "minute")):
+        start = engine.next_start(res)
+        for row in sorted(tables[finer].values(), key=lambda r: r["ts"]):
+            if start is None or row["ts"] >= start:
+                write(tables, engine.merge(finer, row))
+    start = engine.next_start("minute")
+    for t, e1, e2, power in rows:
+        if t >= restart:
+            break
+        if t >= start:
+            write(tables, engine.add(t, e1, e2, power))
+    for t, e1, e2, power in rows:
+        if t >= restart:
+            write(tables, engine.add(t, e1, e2, power))
+    assert engine.late == 0
+    expected = rebuilt(rows)
+    for res in rollup.RESOLUTIONS:
+        assert_same(sorted(tables[res].values(), key=lambda r: r["ts"]), expected[res])
+
+
+
+def test_bucket_row_aggregates():
+    engine = rollup.RollupEngine()
+    start = calendar.timegm((2026, 6, 15, 10, 0, 0))
+    closed = []
+    for i, power in enumerate([100.0, None, 300.0, 200.0]):
+        closed += engine.add(start + 10 * i, 1.0 + i, 5.0, power)
+    closed += engine.add(start + 60, 9.0, 5.0, 50.0)
+    assert closed == [("minute", {"ts": start, "energy1": 4.0, "energy2": 5.0, "used1": 3.0, "used2": 0.0,
+                                  "power_min": 100.0, "power_max": 300.0, "power_avg": 200.0, "samples": 3})]
+    assert engine.open_bucket("hour")["used1"] == 3.0
+
+
+def test_late_samples_are_counted_and_left_out():
+    start = calendar.timegm((2026, 6, 15, 10, 0, 0))
+    last_rows = {"minute": {"ts": start, "energy1": 1.0, "energy2": 1.0}}
+    engine = rollup.RollupEngine(last_rows)
+    assert engine.next_start("minute") == start + 60
+    assert engine.add(start + 30, 2.0, 2.0, 10.0) == []
+    assert engine.late == 1
+    assert engine.open_bucket("minute") is None
+    engine.add(start + 70, 3.0, 1.0, 10.0)
+    engine.add(start + 50, 2.5, 1.0, 10.0)
+    assert engine.late == 2
+    # consumption counts from the close of the last written bucket
+    assert engine.open_bucket("minute")["used1"] == 2.0
+
+
+@pytest.mark.parametrize("date, resolution, hours", [
+    ((2026, 3, 29), "day", 23), ((2026, 10, 25), "day", 25), ((2026, 3, 1), "month", 31 * 24 - 1),
+    ((2026, 10, 1), "month", 31 * 24 + 1)])
+def test_bucket_end_in_local_time(timezone, date, resolution, hours):
+    timezone("Europe/Berlin")
+    start = int(time.mktime(date + (0, 0, 0, 0, 0, -1)))
+    assert timeutil.bucket_end(start, resolution) - start == hours * 3600
+
+
+def test_repeated_hour_is_one_hour_bucket(timezone):
+    timezone("Europe/Berlin")
+    first = calendar.timegm((2026, 10, 25, 0, 0, 0))    # 02:00 summer time
+    assert timeutil.bucket_end(first, "hour") == first + 2 * 3600
+    assert timeutil.bucket_end(first, "minute") == first + 60
+    assert timeutil.bucket_end(first + 3600, "minute") == first + 3660
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import downsample
+
+
+@pytest.fixture(scope="module")
+def minutes(server):
+    """ 600 minute rows of the meter "series" from epoch 0 on, one spike of 9000 W """
+    rows = []
+    for i in range(600):
+        power = 9000.0 if i == 300 else 100.0 + i % 50
+        rows.append((server.MinuteTable, {"meter_id": "series", "ts": 60 * i, "energy1": 0.0, "energy2": 0.0,
+                                          "power_avg": power, "power_min": power - 50, "power_max": power + 50,
+                                          "samples": 6}))
+    server.writer.add_group(rows)
+    assert server.writer.flush(timeout=30)
+
+
+def get(server, query):
+    return server.app.test_client().get("/api/series?meter=series&resolution=minute&" + query)
+
+
+def test_from_zero_is_a_time(server, minutes):
+    answer = get(server, "from=0&to=36000&points=1000").get_json()
+    assert answer["from"] == 0
+    assert answer["rows"] == 600
+    assert answer["points"][0] == [0, 100.0]
+
+
+def test_lttb_points(server, minutes):
+    points = get(server, "from=0&to=36000&points=50").get_json()["points"]
+    assert len(points) == 50
+    assert [18000, 9000.0] in points
+
+
+def test_minmax_points(server, minutes):
+    points = get(server, "from=0&to=36000&points=60&mode=minmax").get_json()["points"]
+    assert len(points) == 60
+    assert max(p[2] for p in points) == 9050.0
+    assert min(p[1] for p in points) == 50.0
+
+
+@pytest.mark.parametrize("query", ["mode=bars", "from=yesterday", "resolution=week", "meter=unknown"])
+def test_invalid_parameters(server, query):
+    assert server.app.test_client().get("/api/series?" + query).status_code == 400
+
+
+def spiky(size=10000, seed=3):
+    rng = np.random.default_rng(seed)
+    x = np.arange(size, dtype=np.float64) * 10
+    y = rng.uniform(100, 500, size)
+    y[size * 3 // 7] = 9000.0
+    return x, y
+
+
+def test_lttb_keeps_ends_and_spike():
+    x, y = spiky()
+    dx, dy = downsample.lttb(x, y, 500)
+    assert len(dx) == len(dy) == 500
+    assert (dx[0], dy[0]) == (x[0], y[0])
+    assert (dx[-1], dy[-1]) == (x[-1], y[-1])
+    assert np.all(np.diff(dx) > 0)
+    assert 9000.0 in dy
+    assert set(dx.tolist()) <= set(x.tolist())
+
+
+def test_lttb_returns_short_series_unchanged():
+    x, y = spiky(100)
+    dx, dy = downsample.lttb(x, y, 100)
+    assert dx is x and dy is y
+
+
+def test_minmax_keeps_extremes():
+    x, y = spiky()
+    y[777] = -50.0
+    dx, dmin, dmax = downsample.minmax(x, y, y, 200)
+    assert len(dx) == len(dmin) == len(dmax) == 200
+    assert dx[0] == x[0]
+    assert dmin.min() == -50.0
+    assert dmax.max() == 9000.0
+    assert np.all(dmin <= dmax)
+
+
+def test_minmax_ignores_missing_values():
+    x, y = spiky(1000)
+    y[:5] = np.nan
+    _, dmin, dmax = downsample.minmax(x, y, y, 100)
+    assert not np.isnan(dmin[0]) and not np.isnan(dmax[0])
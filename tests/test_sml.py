@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+import sml
+
+CAPTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "textscratch.txt")
+
+
+@pytest.fixture(scope="module")
+def frames():
+    return sml.frames_from_hexdump(CAPTURE)
+
+
+def test_crc16_x25():
+    # check value of CRC-16/X-25 is 0x906e, SML sends the low byte first
+    assert sml.crc16(b"123456789") == 0x6e90
+
+
+def test_capture_decodes(frames):
+    assert len(frames) == 147
+    readings = [sml.reading(sml.decode_frame(frame)) for frame in frames]
+    assert readings[0] == {"energyNT": 3245.9219, "energyHT": 6826.269, "power": 1251.5}
+    assert readings[-1] == {"energyNT": 3250.9466, "energyHT": 6829.8233, "power": 294.9}
+    assert all(r["energyNT"] is not None and r["energyHT"] is not None for r in readings)
+
+
+def test_corrupted_frame_fails_crc(frames):
+    frame = bytearray(frames[0])
+    frame[40] ^= 0xff
+    with pytest.raises(sml.SmlError):
+        sml.decode_frame(frame)
+
+
+def complete(frame) -> bytes:
+    """ the capture stops at the end escape, the port also sends the padding count and the frame crc """
+    frame = frame + b"\x00"
+    return frame + sml.crc16(frame).to_bytes(2, "big")
+
+
+def test_frame_buffer_splits_stream(frames):
+    sent = [complete(frame) for frame in frames]
+    stream = b"\x00\x01garbage" + b"".join(sent)
+    buffer = sml.SmlFrameBuffer()
+    found = []
+    for i in range(0, len(stream), 37):
+        found += buffer.feed(stream[i:i + 37])
+    assert found == sent
+    assert buffer.dropped == len(b"\x00\x01garbage")
+    assert [sml.reading(sml.decode_frame(f)) for f in found] == [sml.reading(sml.decode_frame(f)) for f in frames]
@@ -0,0 +1,80 @@
+import json
+
+import sse
+
+
+def events(q) -> list:
+    """ (id, event, data) of the messages queued for a listener """
+    result = []
+    while not q.empty():
+        msg = q.get_nowait()
+        if msg is sse.DROPPED:
+            result.append(None)
+            continue
+        fields = dict(line.split(": ", 1) for line in msg.strip().splitlines())
+        result.append((int(fields["id"]) if "id" in fields else None, fields.get("event"),
+                       json.loads(fields["data"])))
+    return result
+
+
+def test_replay_from_last_event_id():
+    announcer = sse.MessageAnnouncer(buffer_size=10)
+    for i in range(5):
+        announcer.publish("power", {"power": i})
+    q = announcer.listen(last_event_id=3)
+    announcer.publish("power", {"power": 5})
+    assert events(q) == [(4, "power", {"power": 3}), (5, "power", {"power": 4}), (6, "power", {"power": 5})]
+
+
+def test_replay_keeps_to_the_channel():
+    announcer = sse.MessageAnnouncer()
+    announcer.publish("power", {"meter": "main"}, channel="main")
+    announcer.publish("power", {"meter": "pv"}, channel="pv")
+    announcer.publish("reload", {})
+    assert [e[0] for e in events(announcer.listen(last_event_id=0, channel="pv"))] == [2, 3]
+    assert [e[0] for e in events(announcer.listen(last_event_id=0))] == [1, 2, 3]
+
+
+def test_reload_when_the_buffer_missed_events_or_ids_are_unknown():
+    announcer = sse.MessageAnnouncer(buffer_size=3)
+    for i in range(10):
+        announcer.publish("power", {"power": i})
+    assert events(announcer.listen(last_event_id=2)) == [(None, "reload", {})]
+    # ids from before a restart of the server
+    assert events(announcer.listen(last_event_id=500)) == [(None, "reload", {})]
+    assert events(announcer.listen(last_event_id=7)) == [(8, "power", {"power": 7}), (9, "power", {"power": 8}),
+                                                          (10, "power", {"power": 9})]
+
+
+def test_dropped_listener_gets_reload_and_its_stream_ends():
+    announcer = sse.MessageAnnouncer(buffer_size=2, queue_size=2)
+    stream = sse.stream(announcer, heartbeat=1)
+    assert next(stream).startswith("retry:")
+    for i in range(10):
+        announcer.publish("power", {"power": i})
+    assert announcer.dropped == 1 and announcer.count() == 0
+    assert "event: reload" in next(stream)
+    assert list(stream) == []
+
+
+def test_stream_sends_heartbeats_and_unlistens():
+    announcer = sse.MessageAnnouncer()
+    stream = sse.stream(announcer, heartbeat=0.01)
+    next(stream)
+    assert next(stream) == sse.HEARTBEAT
+    assert announcer.count() == 1
+    stream.close()
+    assert announcer.count() == 0
+
+
+def test_listen_route_replays_last_event_id(server):
+    first = server.announcer.publish("power", {"meter": "main", "power": 1}, channel="main")
+    server.announcer.publish("power", {"meter": "pv", "power": 2}, channel="pv")
+    server.announcer.publish("power", {"meter": "main", "power": 3}, channel="main")
+    response = server.app.test_client().get("/listen?meter=main", headers={"Last-Event-ID": str(first)},
+                                            buffered=False)
+    body = response.iter_encoded()
+    assert next(body).startswith(b"retry:")
+    replayed = next(body).decode()
+    response.close()
+    assert "id: %d" % (first + 2) in replayed and '"power": 3' in replayed
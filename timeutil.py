@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Local calendar buckets of epoch seconds. A sample belongs to the bucket of
+# its local time, the epoch plus the utc offset of its hour. The live rollup
+# engine uses the scalar functions, the rebuild and the analytics key their
+# numpy arrays the same way, so both agree in the repeated hour in autumn and
+# around the missing one in spring. numpy is imported by the array functions
+# only.
+import datetime
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def utc_offset(t) -> int:
+    """ utc offset in seconds of local time in the utc hour of epoch t """
+    h = int(t) // 3600
+    return int(datetime.datetime.fromtimestamp(h * 3600 + 1800).astimezone().utcoffset().total_seconds())
+
+
+def bucket_key(local, resolution) -> int:
+    """ bucket number of one local time, like bucket_keys() """
+    if resolution == "minute":
+        return local // 60
+    if resolution == "hour":
+        return local // 3600
+    if resolution == "day":
+        return local // 86400
+    if resolution == "month":
+        d = _EPOCH + datetime.timedelta(seconds=local)
+        return (d.year - 1970) * 12 + d.month - 1
+    raise ValueError("unknown resolution '%s'" % resolution)
+
+
+def key_start(key, resolution) -> int:
+    """ local start of one bucket, like key_starts() """
+    if resolution == "minute":
+        return key * 60
+    if resolution == "hour":
+        return key * 3600
+    if resolution == "day":
+        return key * 86400
+    if resolution == "month":
+        return int((datetime.datetime(1970 + key // 12, key % 12 + 1, 1) - _EPOCH).total_seconds())
+    raise ValueError("unknown resolution '%s'" % resolution)
+
+
+def bucket_end(start, resolution) -> int:
+    """ epoch where the bucket starting at epoch start ends, the first moment of another local bucket """
+    offset = utc_offset(start)
+    key = bucket_key(start + offset, resolution)
+    local_end = key_start(key + 1, resolution)
+    end = local_end - offset
+    # the utc offset may change inside the bucket, local time then ends it earlier or later
+    for candidate in sorted((end, local_end - utc_offset(end))):
+        if candidate > start and bucket_key(candidate + utc_offset(candidate), resolution) != key:
+            return candidate
+    return end
+
+
+def local_offsets(ts):
+    """ utc offset in seconds of local time for every epoch in the numpy array ts """
+    import numpy as np
+    hours, inverse = np.unique(ts // 3600, return_inverse=True)
+    offsets = np.empty(len(hours), dtype=np.int64)
+    for i, h in enumerate(hours.tolist()):
+        offsets[i] = utc_offset(h * 3600)
+    return offsets[inverse.reshape(-1)]
+
+
+def bucket_keys(local, resolution):
+    """ bucket number of every local time (epoch seconds shifted by the utc offset) """
+    import numpy as np
+    if resolution == "minute":
+        return local // 60
+    if resolution == "hour":
+        return local // 3600
+    if resolution == "day":
+        return local // 86400
+    if resolution == "month":
+        return local.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError("unknown resolution '%s'" % resolution)
+
+
+def key_starts(keys, resolution):
+    """ local start of the buckets as local epoch seconds """
+    import numpy as np
+    if resolution == "minute":
+        return keys * 60
+    if resolution == "hour":
+        return keys * 3600
+    if resolution == "day":
+        return keys * 86400
+    return keys.astype('datetime64[M]').astype('datetime64[s]').astype(np.int64)